@@ -12,39 +12,390 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
 import argparse
+import csv
+import json
+import os
 import pprint
+import re
+import sys
 
 db_client = MongoClient("localhost", 27017)
 db = db_client.circinspect
 db_sessions = db.sessions
 db_users = db.users
 db_bugs = db.bugs
+db_actions = db.session_actions
+db_session_rollups = db.session_rollups
+db_usage_rollups = db.usage_rollups
+db_contents = db.telemetry_contents
+
+# Maximum number of actions in a session_actions document, same as
+# TELEMETRY_BUCKET_SIZE in server/app.py
+ACTION_BUCKET_SIZE = 50
+
+# Buckets of actions written up to this many seconds before the last bucket
+# processed by updateRollups are read again in the next update, in case
+# their writes became visible late. Actions that were already counted are
+# skipped.
+ROLLUP_OVERLAP_SECONDS = 60
+
+# Number of sessions whose rollups are written to the database at once
+ROLLUP_BATCH_SIZE = 500
+
+# Number of sessions read and updated at once by backfillSessionLengths
+BACKFILL_BATCH_SIZE = 1000
+
+# Number of documents fetched from the database at once by the exports
+EXPORT_BATCH_SIZE = 1000
+
+# Ways to match a session id given to the admin tool with the session ids in
+# the database. "exact" and "prefix" use the session_id index, "substring"
+# finds the session id anywhere in the id, ignoring case, but reads every
+# session in the database.
+SESSION_MATCH_MODES = ["exact", "prefix", "substring"]
+
+
+def getActions(session_id):
+    """Get the actions of a session in the order they were recorded.
+
+    Actions are stored in buckets in the session_actions collection. Actions
+    of sessions recorded before buckets were introduced that are not
+    migrated yet (see migrateActions) are read from the session document.
+
+    Args:
+        session_id (string): full ID of the session
+
+    Returns:
+        a list of actions
+    """
+    q = db_sessions.find_one({"session_id": session_id}, {"actions": 1})
+    actions = list(q.get("actions", [])) if q is not None else []
+    for bucket in db_actions.find({"session_id": session_id}, {"actions": 1}).sort("_id", 1):
+        actions.extend(bucket["actions"])
+    return actions
+
+
+def addContents(actions):
+    """Replace the <field>_hash fields of actions, written by the telemetry
+    policy of the main server, with the content stored for the hash.
+
+    Args:
+        actions (list): actions of a session
+
+    Returns:
+        the list of actions with the contents
+    """
+    hashes = {v for a in actions for k, v in a.items() if k.endswith("_hash")}
+    if len(hashes) == 0:
+        return actions
+    contents = {q["_id"]: q["content"] for q in db_contents.find({"_id": {"$in": list(hashes)}})}
+    out = []
+    for a in actions:
+        a = dict(a)
+        for k in [k for k in a.keys() if k.endswith("_hash")]:
+            if a[k] in contents:
+                a[k[: -len("_hash")]] = contents[a.pop(k)]
+        out.append(a)
+    return out
+
+
+def migrateActions():
+    """Move actions stored in session documents by older versions of the main
+    server to buckets in the session_actions collection.
+
+    Returns:
+        a dict with the number of migrated sessions
+    """
+    migrated = 0
+    for q in db_sessions.find({"actions": {"$exists": True}}, {"session_id": 1, "actions": 1}):
+        actions = q["actions"]
+        buckets = [
+            {
+                "session_id": q["session_id"],
+                "count": len(actions[i : i + ACTION_BUCKET_SIZE]),
+                "actions": actions[i : i + ACTION_BUCKET_SIZE],
+                "updated_at": datetime.utcnow(),
+            }
+            for i in range(0, len(actions), ACTION_BUCKET_SIZE)
+        ]
+        if len(buckets) > 0:
+            db_actions.insert_many(buckets)
+        db_sessions.update_one({"_id": q["_id"]}, {"$unset": {"actions": ""}})
+        migrated += 1
+    return {"migrated_sessions": migrated}
+
+
+def getDay(timestamp):
+    """Get the UTC date of an action timestamp.
+
+    Args:
+        timestamp (int): timestamp in milliseconds
+
+    Returns:
+        the date as a "YYYY-MM-DD" string
+    """
+    return datetime.utcfromtimestamp(timestamp / 1000).strftime("%Y-%m-%d")
+
+
+def newSessionRollup(session_id):
+    """Get the rollup of a session without any actions.
+
+    The rollup keeps the state of the loop in getSessionLengths, so that
+    new actions can be added to it without reading the earlier actions.
+
+    Args:
+        session_id (string): full ID of the session
+
+    Returns:
+        a dict with the rollup of the session
+    """
+    return {
+        "session_id": session_id,
+        "bucket_id": None,  # last bucket of actions that was read
+        "offset": 0,  # number of actions read from that bucket
+        "action_counts": {},
+        "first_timestamp": None,
+        "last_timestamp": None,
+        "last_calls": [],
+        "realtime_mode": True,  # NOTE: assumes app starts in real-time mode
+        "mode_start": None,
+        "debugger_ms": 0,  # time in modes that were left
+        "realtime_ms": 0,
+    }
+
+
+def addActionsToRollup(rollup, actions):
+    """Add new actions of a session to its rollup.
+
+    Args:
+        rollup (dict): rollup of the session
+        actions (list): actions recorded after the ones in the rollup
+    """
+    for a in actions:
+        if rollup["first_timestamp"] is None:
+            rollup["first_timestamp"] = a["timestamp"]
+            rollup["mode_start"] = a["timestamp"]
+        counts = rollup["action_counts"]
+        counts[a["api_call"]] = counts.get(a["api_call"], 0) + 1
+        if a["api_call"] == "/dc/enterDebuggerMode":
+            rollup["realtime_ms"] += a["timestamp"] - rollup["mode_start"]
+            rollup["mode_start"] = a["timestamp"]
+            rollup["realtime_mode"] = False
+        elif a["api_call"] == "/dc/enterRealTimeMode":
+            rollup["debugger_ms"] += a["timestamp"] - rollup["mode_start"]
+            rollup["mode_start"] = a["timestamp"]
+            rollup["realtime_mode"] = True
+        rollup["last_timestamp"] = a["timestamp"]
+        rollup["last_calls"] = (rollup["last_calls"] + [a["api_call"]])[-2:]
+
+
+def addBucketsToRollup(rollup, buckets):
+    """Add the actions of buckets of a session to its rollup. Buckets before
+    the last bucket read into the rollup and actions of that bucket that
+    were already read are skipped, so buckets that are read again are not
+    counted twice.
+
+    Args:
+        rollup (dict): rollup of the session
+        buckets (list): session_actions documents of the session, ordered
+            by _id
+
+    Returns:
+        a list of the actions that were added to the rollup
+    """
+    added = []
+    for bucket in buckets:
+        if rollup["bucket_id"] is not None and bucket["_id"] < rollup["bucket_id"]:
+            continue
+        start = rollup["offset"] if bucket["_id"] == rollup["bucket_id"] else 0
+        actions = bucket["actions"][start:]
+        addActionsToRollup(rollup, actions)
+        rollup["bucket_id"] = bucket["_id"]
+        rollup["offset"] = len(bucket["actions"])
+        added += actions
+    return added
+
+
+def getRollupLengths(rollup):
+    """Get the time spent in a session and in different modes from its
+    rollup. Same as getSessionLengths, sessions that were not ended with a
+    /dc/sessionExit call have a length of 0.
+
+    Args:
+        rollup (dict): rollup of the session
+
+    Returns:
+        Int, Int, Int:
+            time spent in session in milliseconds
+            time spent in debugger in milliseconds
+            time spent in realtime mode in milliseconds
+    """
+    if "/dc/sessionExit" not in rollup["last_calls"]:
+        return 0, 0, 0
+    debugger_length, realtime_length = rollup["debugger_ms"], rollup["realtime_ms"]
+    if rollup["realtime_mode"]:
+        realtime_length += rollup["last_timestamp"] - rollup["mode_start"]
+    else:
+        debugger_length += rollup["last_timestamp"] - rollup["mode_start"]
+    total_length = rollup["last_timestamp"] - rollup["first_timestamp"]
+    return total_length, debugger_length, realtime_length
+
+
+def updateRollups(rebuild=False):
+    """Update the materialized usage rollups with the actions recorded since
+    the last update.
+
+    Each session has a document in the session_rollups collection with its
+    action counts and the state needed to compute its length. The
+    usage_rollups collection has a document for each day, with the "YYYY-MM-DD"
+    date as _id, and a document with the "total" _id for all days:
+        {"_id": ..., "action_counts": {<api call>: <count>}, "sessions": ...,
+         "session_ms": ..., "debugger_ms": ..., "realtime_ms": ...}
+    Actions are counted on the day they were recorded, and sessions and
+    their lengths on the day the session started.
+
+    Only buckets of actions that were written since the last update are
+    read, so reports that use the rollups do not depend on the size of the
+    history. If an update is interrupted, the usage rollups can miss some
+    actions until they are rebuilt.
+
+    Args:
+        rebuild (bool): drop the rollups and compute them again from all
+            actions
+
+    Returns:
+        a dict with the number of updated sessions and added actions
+    """
+    if rebuild:
+        db_session_rollups.drop()
+        db_usage_rollups.drop()
+    state = db_usage_rollups.find_one({"_id": "total"}, {"updated_until": 1}) or {}
+    query = {}
+    if state.get("updated_until", None) is not None:
+        since = state["updated_until"] - timedelta(seconds=ROLLUP_OVERLAP_SECONDS)
+        query = {"updated_at": {"$gte": since}}
+    buckets = db_actions.find(query).sort([("session_id", 1), ("_id", 1)])
+
+    updated_until = state.get("updated_until", None)
+    updated_sessions, added_actions = 0, 0
+    session_ops, usage = [], {}
+
+    def write():
+        if len(session_ops) > 0:
+            db_session_rollups.bulk_write(session_ops, ordered=False)
+        usage_ops = [
+            UpdateOne({"_id": key}, {"$inc": inc}, upsert=True)
+            for key, inc in usage.items()
+            if len(inc) > 0
+        ]
+        if len(usage_ops) > 0:
+            db_usage_rollups.bulk_write(usage_ops, ordered=False)
+        session_ops.clear()
+        usage.clear()
+
+    def increment(day, field, value):
+        for key in (day, "total"):
+            inc = usage.setdefault(key, {})
+            inc[field] = inc.get(field, 0) + value
+
+    for session_id, session_buckets in groupby(buckets, key=lambda b: b["session_id"]):
+        rollup = db_session_rollups.find_one({"session_id": session_id}, {"_id": 0})
+        is_new = rollup is None
+        if is_new:
+            rollup = newSessionRollup(session_id)
+        lengths_before = getRollupLengths(rollup)
+        session_buckets = list(session_buckets)
+        for bucket in session_buckets:
+            if updated_until is None or bucket.get("updated_at", updated_until) > updated_until:
+                updated_until = bucket.get("updated_at", updated_until)
+        actions = addBucketsToRollup(rollup, session_buckets)
+        for a in actions:
+            increment(getDay(a["timestamp"]), "action_counts." + a["api_call"], 1)
+        num_actions = len(actions)
+        if num_actions == 0:
+            continue
+
+        # add the change in the length of the session to the day it started
+        day = getDay(rollup["first_timestamp"])
+        if is_new:
+            increment(day, "sessions", 1)
+        lengths_after = getRollupLengths(rollup)
+        for field, before, after in zip(
+            ("session_ms", "debugger_ms", "realtime_ms"), lengths_before, lengths_after
+        ):
+            if after != before:
+                increment(day, field, after - before)
+        session_ops.append(UpdateOne({"session_id": session_id}, {"$set": rollup}, upsert=True))
+        updated_sessions += 1
+        added_actions += num_actions
+        if len(session_ops) >= ROLLUP_BATCH_SIZE:
+            write()
+
+    write()
+    if updated_until is not None:
+        db_usage_rollups.update_one(
+            {"_id": "total"}, {"$set": {"updated_until": updated_until}}, upsert=True
+        )
+    return {"updated_sessions": updated_sessions, "added_actions": added_actions}
+
+
+def dailyInfo():
+    """Get the usage rollups of each day. Run updateRollups first to include
+    the latest actions.
+
+    Returns:
+        a list of dicts with the action counts, number of started sessions
+        and time spent in sessions of each day
+    """
+    out = []
+    for q in db_usage_rollups.find({"_id": {"$ne": "total"}}).sort("_id", 1):
+        q["day"] = q.pop("_id")
+        out.append(q)
+    return out
+
+
+def getSessionQuery(session_id, match="prefix"):
+    """Get the query that finds sessions by their id.
+
+    Session ids are generated by the frontend in upper case, so exact and
+    prefix matches look for the session_id as given and in upper case. Both
+    can use the session_id index since they are case sensitive and anchored.
+
+    Args:
+        session_id (string): full or partial ID of the session
+        match (string): one of SESSION_MATCH_MODES
+
+    Returns:
+        a dict query on the session_id field
+    """
+    if match == "exact":
+        return {"session_id": {"$in": sorted({session_id, session_id.upper()})}}
+    if match == "prefix":
+        prefixes = sorted({session_id, session_id.upper()})
+        return {"session_id": {"$in": [re.compile("^" + re.escape(p)) for p in prefixes]}}
+    if match == "substring":
+        return {"session_id": {"$regex": "(?i).*" + session_id + ".*(?-i)"}}
+    raise ValueError("Unknown session match mode: " + match)
 
 
 def countActions():
     """Count the total number of times an API call is called from any session
-        by any user
+        by any user. Run updateRollups first to include the latest actions.
 
     Returns:
         a list of API calls and their total counts
     """
-    q = list(
-        db_sessions.aggregate(
-            [
-                {"$unwind": "$actions"},
-                {"$group": {"_id": "$actions.api_call", "count": {"$sum": 1}}},
-            ]
-        )
-    )
-    return q
+    total = db_usage_rollups.find_one({"_id": "total"}, {"action_counts": 1}) or {}
+    return [{"_id": k, "count": v} for k, v in total.get("action_counts", {}).items()]
 
 
 def countActionLike(name):
     """Count API calls that have a path similar to the name argument across
-    users and sessions
+    users and sessions. Run updateRollups first to include the latest actions.
 
     Args:
         name (string): name of the API call to search for
@@ -53,17 +404,18 @@ def countActionLike(name):
         a list of session id - API call tuples and their counts.
     """
     q = list(
-        db_sessions.aggregate(
+        db_session_rollups.aggregate(
             [
-                {"$unwind": "$actions"},
+                {"$project": {"session_id": 1, "counts": {"$objectToArray": "$action_counts"}}},
+                {"$unwind": "$counts"},
                 {
-                    "$match": {"actions.api_call": {"$regex": "(?i).*" + name + ".*(?-i)"}}
+                    "$match": {"counts.k": {"$regex": "(?i).*" + name + ".*(?-i)"}}
                 },  # find actions with the name matching part of api_call,
                 # case-insensitive
                 {
                     "$group": {
-                        "_id": {"session": "$session_id", "call": "$actions.api_call"},
-                        "count": {"$sum": 1},
+                        "_id": {"session": "$session_id", "call": "$counts.k"},
+                        "count": {"$sum": "$counts.v"},
                     }
                 },  # group by both session and API call
             ]
@@ -72,31 +424,32 @@ def countActionLike(name):
     return q
 
 
-def countActionSessionLike(name, session):
-    """Count API calls in a subset of sessions
+def countActionSessionLike(name, session, match="prefix"):
+    """Count API calls in a subset of sessions. Run updateRollups first to
+    include the latest actions.
 
     Args:
         name (string): name of the API call to search for
         session (string): session id to search for
+        match (string): how to match the session id, see SESSION_MATCH_MODES
 
     Returns:
         a list of session id - API call tuples and their counts.
     """
     q = list(
-        db_sessions.aggregate(
+        db_session_rollups.aggregate(
             [
-                {"$unwind": "$actions"},
+                {"$match": getSessionQuery(session, match)},  # find matching sessions
+                {"$project": {"session_id": 1, "counts": {"$objectToArray": "$action_counts"}}},
+                {"$unwind": "$counts"},
                 {
-                    "$match": {
-                        "actions.api_call": {"$regex": "(?i).*" + name + ".*(?-i)"},
-                        "session_id": {"$regex": "(?i).*" + session + ".*(?-i)"},
-                    }
-                },  # find actions with the part of name and session id matching,
+                    "$match": {"counts.k": {"$regex": "(?i).*" + name + ".*(?-i)"}}
+                },  # find actions with the name matching part of api_call,
                 # case-insensitive
                 {
                     "$group": {
-                        "_id": {"session": "$session_id", "call": "$actions.api_call"},
-                        "count": {"$sum": 1},
+                        "_id": {"session": "$session_id", "call": "$counts.k"},
+                        "count": {"$sum": "$counts.v"},
                     }
                 },  # group by both session and API call
             ]
@@ -105,16 +458,13 @@ def countActionSessionLike(name, session):
     return q
 
 
-def computeSessionLength(session_id):
-    """Compute the time spent in session and in different modes.
-
-    Records the calculated data to the database entry for the session.
-    If data is currently in database, uses the one in database instead
-    of recomputing. Does not do anything if the session was not ended
-    properly with a /dc/sessionExit call, and returns 0, 0, 0.
+def getSessionLengths(actions):
+    """Compute the time spent in a session and in different modes from its
+    actions. Sessions that were not ended with a /dc/sessionExit call have
+    a length of 0.
 
     Args:
-        session_id (string): full or partial ID for the session
+        actions (list): actions of the session in the order they were recorded
 
     Returns:
         Int, Int, Int:
@@ -123,13 +473,7 @@ def computeSessionLength(session_id):
             time spent in realtime mode in milliseconds
     """
     total_length, debugger_length, realtime_length = 0, 0, 0
-
-    q = db_sessions.find_one({"session_id": {"$regex": "(?i).*" + session_id + ".*(?-i)"}})
-    actions = q["actions"]
-    if (
-        actions[-1]["api_call"] != "/dc/sessionExit"
-        and actions[-2]["api_call"] != "/dc/sessionExit"
-    ):
+    if "/dc/sessionExit" not in [a["api_call"] for a in actions[-2:]]:
         return 0, 0, 0
     total_length = actions[-1]["timestamp"] - actions[0]["timestamp"]
 
@@ -149,9 +493,35 @@ def computeSessionLength(session_id):
         realtime_length += actions[-1]["timestamp"] - start
     else:
         debugger_length += actions[-1]["timestamp"] - start
+    return total_length, debugger_length, realtime_length
+
+
+def computeSessionLength(session_id, match="prefix"):
+    """Compute the time spent in session and in different modes.
+
+    Records the calculated data to the database entry for the session.
+    If data is currently in database, uses the one in database instead
+    of recomputing. Does not do anything if the session was not ended
+    properly with a /dc/sessionExit call, and returns 0, 0, 0.
+
+    Args:
+        session_id (string): full or partial ID for the session
+        match (string): how to match the session id, see SESSION_MATCH_MODES
+
+    Returns:
+        Int, Int, Int:
+            time spent in session in milliseconds
+            time spent in debugger in milliseconds
+            time spent in realtime mode in milliseconds
+    """
+    q = db_sessions.find_one(getSessionQuery(session_id, match), {"session_id": 1})
+    actions = getActions(q["session_id"])
+    if "/dc/sessionExit" not in [a["api_call"] for a in actions[-2:]]:
+        return 0, 0, 0
+    total_length, debugger_length, realtime_length = getSessionLengths(actions)
 
     db_sessions.update_one(
-        {"session_id": {"$regex": "(?i).*" + session_id + ".*(?-i)"}},
+        {"session_id": q["session_id"]},
         {
             "$set": {
                 "session_length_ms": total_length,
@@ -163,20 +533,91 @@ def computeSessionLength(session_id):
     return total_length, debugger_length, realtime_length
 
 
-def getSession(session_id):
+def backfillSessionLengths():
+    """Record the time spent in session and in different modes for all
+    sessions that do not have it yet, like computeSessionLength does for one
+    session.
+
+    Sessions are read in batches and their lengths are computed from the
+    session rollups (see updateRollups), and written with one bulk write per
+    batch. Progress is printed after each batch. Sessions that were not ended
+    properly with a /dc/sessionExit call are skipped, so the backfill can be
+    interrupted and run again, and picks up sessions that ended since.
+    Sessions whose actions are still stored in the session document must be
+    migrated with migrateActions first.
+
+    Returns:
+        a dict with the number of updated and skipped sessions
+    """
+    updateRollups()
+    query = {"session_length_ms": {"$exists": False}}
+    total = db_sessions.count_documents(query)
+    sessions = (
+        db_sessions.find(query, {"session_id": 1}).sort("_id", 1).batch_size(BACKFILL_BATCH_SIZE)
+    )
+    updated, skipped = 0, 0
+
+    def write(batch):
+        nonlocal updated, skipped
+        rollups = db_session_rollups.find(
+            {"session_id": {"$in": [q["session_id"] for q in batch]}},
+            {"_id": 0, "bucket_id": 0, "offset": 0, "action_counts": 0},
+        )
+        lengths = {
+            r["session_id"]: getRollupLengths(r)
+            for r in rollups
+            if "/dc/sessionExit" in r["last_calls"]
+        }
+        ops = []
+        for q in batch:
+            if q["session_id"] not in lengths:
+                skipped += 1
+                continue
+            total_l, debugger_l, rt_l = lengths[q["session_id"]]
+            ops.append(
+                UpdateOne(
+                    {"_id": q["_id"]},
+                    {
+                        "$set": {
+                            "session_length_ms": total_l,
+                            "debugger_length_ms": debugger_l,
+                            "realtime_length_ms": rt_l,
+                        }
+                    },
+                )
+            )
+        if len(ops) > 0:
+            db_sessions.bulk_write(ops, ordered=False)
+        updated += len(ops)
+        print("Backfilled {}/{} sessions".format(updated + skipped, total))
+
+    batch = []
+    for q in sessions:
+        batch.append(q)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            write(batch)
+            batch = []
+    if len(batch) > 0:
+        write(batch)
+    return {"updated_sessions": updated, "skipped_sessions": skipped}
+
+
+def getSession(session_id, match="prefix"):
     """Get all data related to sessions that match the session_id
 
     Args:
         session_id (string): A session id or a part of it to search for
+        match (string): how to match the session id, see SESSION_MATCH_MODES
 
     Returns:
-        a list of all sessions whose session IDs contain the session_id
+        a list of all sessions whose session IDs match the session_id
     """
-    qs = db_sessions.find({"session_id": {"$regex": "(?i).*" + session_id + ".*(?-i)"}})
+    qs = db_sessions.find(getSessionQuery(session_id, match))
     out = []
     for q in qs:
+        q["actions"] = addContents(getActions(q["session_id"]))
         if "session_length_ms" not in q:
-            total_l, debugger_l, rt_l = computeSessionLength(q["session_id"])
+            total_l, debugger_l, rt_l = computeSessionLength(q["session_id"], "exact")
             q["session_length_ms"] = total_l
             q["debugger_length_ms"] = debugger_l
             q["realtime_length_ms"] = rt_l
@@ -186,52 +627,273 @@ def getSession(session_id):
 
 
 def generalInfo():
-    """Get some general information related to the use of the application
+    """Get some general information related to the use of the application.
+    Run updateRollups first to include the latest actions.
 
     Returns:
         a dict of data related to application
     """
+    total = db_usage_rollups.find_one({"_id": "total"}) or {}
+    counts = total.get("action_counts", {})
     data = {
         "date_utc": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-        "session_count": db_sessions.count_documents({}),
-        "enter_debugger_count": 0,
-        "enter_realtime_count": 0,
-        "total_session_minutes": 0,
-        "total_debugger_minutes": 0,
-        "total_realtime_minutes": 0,
+        "session_count": db_sessions.estimated_document_count(),
+        "enter_debugger_count": counts.get("/dc/enterDebuggerMode", 0),
+        "enter_realtime_count": counts.get("/dc/enterRealTimeMode", 0),
+        "total_session_minutes": total.get("session_ms", 0) / 60000,
+        "total_debugger_minutes": total.get("debugger_ms", 0) / 60000,
+        "total_realtime_minutes": total.get("realtime_ms", 0) / 60000,
     }
-    for a in countActions():
-        if a["_id"] == "/dc/enterDebuggerMode":
-            data["enter_debugger_count"] = a["count"]
-        if a["_id"] == "/dc/enterRealTimeMode":
-            data["enter_realtime_count"] = a["count"]
+    return data
 
-    q = list(
-        db_sessions.aggregate(
-            [
-                {
-                    "$project": {
-                        "session_id": 1,
-                        "session_length_ms": 1,
-                        "debugger_length_ms": 1,
-                        "realtime_length_ms": 1,
-                    }
-                }
-            ]
-        )
+
+def getTimestamp(date):
+    """Get the timestamp of the start of a UTC date.
+
+    Args:
+        date (string): date as a "YYYY-MM-DD" string
+
+    Returns:
+        the timestamp in milliseconds
+    """
+    day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int(day.timestamp() * 1000)
+
+
+def getTimestampRange(start, end):
+    """Get a query on timestamps in a date range.
+
+    Args:
+        start (string): first date to include as "YYYY-MM-DD", or None
+        end (string): first date to exclude as "YYYY-MM-DD", or None
+
+    Returns:
+        a dict query on timestamps in milliseconds, empty if there are no
+        start and end dates
+    """
+    query = {}
+    if start is not None:
+        query["$gte"] = getTimestamp(start)
+    if end is not None:
+        query["$lt"] = getTimestamp(end)
+    return query
+
+
+def exportSessions(file, start=None, end=None, fields=None):
+    """Write sessions to a file as JSON Lines, one session per line, without
+    keeping more than one batch of sessions in memory.
+
+    Args:
+        file: text file to write to
+        start (string): only export sessions started on or after this date
+        end (string): only export sessions started before this date
+        fields (list): only export these fields of the sessions
+
+    Returns:
+        a dict with the number of exported sessions
+    """
+    query = {}
+    timestamps = getTimestampRange(start, end)
+    if len(timestamps) > 0:
+        query["session_start_timestamp"] = timestamps
+    projection = {"_id": 0}
+    if fields is not None:
+        projection.update({f: 1 for f in fields})
+    exported = 0
+    for q in db_sessions.find(query, projection).batch_size(EXPORT_BATCH_SIZE):
+        file.write(json.dumps(q, default=str) + "\n")
+        exported += 1
+    return {"exported_sessions": exported}
+
+
+def streamActions(start=None, end=None, fields=None):
+    """Read the actions of all sessions, in order for each session, without
+    keeping more than one batch of buckets in memory.
+
+    Args:
+        start (string): only read actions recorded on or after this date
+        end (string): only read actions recorded before this date
+        fields (list): only read these fields of the actions, in addition to
+            the api_call and timestamp fields
+
+    Yields:
+        the session id and the action
+    """
+    query = {}
+    timestamps = getTimestampRange(start, end)
+    if len(timestamps) > 0:
+        # skips buckets without any action in the date range, the actions
+        # of the remaining buckets are filtered below
+        query["actions"] = {"$elemMatch": {"timestamp": timestamps}}
+    projection = {"_id": 0, "session_id": 1, "actions": 1}
+    if fields is not None:
+        projection = {"_id": 0, "session_id": 1, "actions.api_call": 1, "actions.timestamp": 1}
+        projection.update({"actions." + f: 1 for f in fields})
+    buckets = (
+        db_actions.find(query, projection)
+        .sort([("session_id", 1), ("_id", 1)])
+        .batch_size(EXPORT_BATCH_SIZE)
     )
+    for bucket in buckets:
+        for a in bucket["actions"]:
+            if "$gte" in timestamps and a["timestamp"] < timestamps["$gte"]:
+                continue
+            if "$lt" in timestamps and a["timestamp"] >= timestamps["$lt"]:
+                continue
+            yield bucket["session_id"], a
+
+
+def exportActions(file, start=None, end=None, fields=None):
+    """Write actions to a file as JSON Lines, one action with its session id
+    per line.
+
+    Args:
+        file: text file to write to
+        start (string): only export actions recorded on or after this date
+        end (string): only export actions recorded before this date
+        fields (list): only export these fields of the actions, in addition
+            to the api_call and timestamp fields
+
+    Returns:
+        a dict with the number of exported actions
+    """
+    exported = 0
+    for session_id, a in streamActions(start, end, fields):
+        file.write(json.dumps({"session_id": session_id, **a}, default=str) + "\n")
+        exported += 1
+    return {"exported_actions": exported}
 
-    for d in q:
-        if "session_length_ms" in d:
-            data["total_session_minutes"] += d["session_length_ms"] / 60000
-            data["total_debugger_minutes"] += d["debugger_length_ms"] / 60000
-            data["total_realtime_minutes"] += d["realtime_length_ms"] / 60000
+
+def actionToCsvRow(session_id, action, columns):
+    """Get the CSV row of an action. Fields that are not strings or numbers
+    are written as JSON, and fields without a column of their own are written
+    together as a JSON object to the extra_fields column.
+
+    Args:
+        session_id (string): session id of the action
+        action (dict): action to write, with its api_call field
+        columns (list): columns of the CSV file, ending with extra_fields
+
+    Returns:
+        a dict from column name to value
+    """
+    row, extra = {"session_id": session_id}, {}
+    for k, v in action.items():
+        if k == "api_call":
+            continue
+        if k not in columns:
+            extra[k] = v
+        elif isinstance(v, (str, int, float)):
+            row[k] = v
         else:
-            total_l, debug_l, rt_l = computeSessionLength(d["session_id"])
-            data["total_session_minutes"] += total_l / 60000
-            data["total_debugger_minutes"] += debug_l / 60000
-            data["total_realtime_minutes"] += rt_l / 60000
-    return data
+            row[k] = json.dumps(v, default=str)
+    if len(extra) > 0:
+        row["extra_fields"] = json.dumps(extra, default=str)
+    return row
+
+
+def exportActionsCsv(directory, start=None, end=None, fields=None):
+    """Write actions to CSV files, one file for each API call. The columns of
+    a file are the session id and the exported fields, or the fields of the
+    first action of that API call when all fields are exported. Actions of
+    the same API call do not always have the same fields, e.g. only sampled
+    actions have a sample_rate, so fields without a column are written to
+    the last column, extra_fields, as a JSON object. Fields that are not
+    strings or numbers are written as JSON.
+
+    Args:
+        directory (string): directory to create the files in, e.g.
+            dc_enterDebuggerMode.csv for /dc/enterDebuggerMode actions
+        start (string): only export actions recorded on or after this date
+        end (string): only export actions recorded before this date
+        fields (list): only export these fields of the actions, in addition
+            to the api_call and timestamp fields
+
+    Returns:
+        a dict with the number of exported actions of each API call
+    """
+    os.makedirs(directory, exist_ok=True)
+    files, writers, columns, exported = {}, {}, {}, {}
+    try:
+        for session_id, a in streamActions(start, end, fields):
+            call = a["api_call"]
+            if call not in writers:
+                name = call.strip("/").replace("/", "_") + ".csv"
+                files[call] = open(os.path.join(directory, name), "x", newline="")
+                if fields is not None:
+                    keys = ["timestamp"] + [f for f in fields if f not in ("api_call", "timestamp")]
+                else:
+                    keys = [k for k in a.keys() if k != "api_call"]
+                columns[call] = ["session_id"] + keys + ["extra_fields"]
+                writers[call] = csv.DictWriter(files[call], columns[call], restval="")
+                writers[call].writeheader()
+                exported[call] = 0
+            writers[call].writerow(actionToCsvRow(session_id, a, columns[call]))
+            exported[call] += 1
+    finally:
+        for file in files.values():
+            file.close()
+    return exported
+
+
+def getPlanStages(plan):
+    """Get the names of all stages in a query plan.
+
+    Args:
+        plan (dict): winning plan of a query from explain()
+
+    Returns:
+        a list of stage names, e.g. ["FETCH", "IXSCAN"]
+    """
+    stages = [plan.get("stage", "")]
+    for child in plan.get("inputStages", []) + [plan.get("inputStage", {})]:
+        if child:
+            stages += getPlanStages(child)
+    return stages
+
+
+def explainQueries():
+    """Explain the queries that the main server and the admin tool run most
+    often, using a user and a session from the database as sample values.
+    Queries that scan a whole collection (COLLSCAN) are marked as slow.
+
+    Returns:
+        a list of dicts with the query name, plan stages, number of
+        examined keys and documents, execution time and whether it is slow
+    """
+    user = db_users.find_one({"token": {"$exists": True}}, {"token": 1}) or {}
+    session = db_sessions.find_one({}, {"session_id": 1}) or {}
+    token = user.get("token", "")
+    session_id = session.get("session_id", "")
+    queries = [
+        ("find user by token", db_users, {"token": token}),
+        ("find session by id", db_sessions, {"session_id": session_id}),
+        ("find actions of session", db_actions, {"session_id": session_id}),
+        ("find session by id prefix", db_sessions, getSessionQuery(session_id[:8])),
+        (
+            "find session by partial id",
+            db_sessions,
+            getSessionQuery(session_id, "substring"),
+        ),
+    ]
+    out = []
+    for name, collection, query in queries:
+        explain = collection.find(query).explain()
+        stats = explain.get("executionStats", {})
+        plan = explain["queryPlanner"]["winningPlan"]
+        # newer MongoDB versions nest the plan when the slot based engine is used
+        stages = getPlanStages(plan.get("queryPlan", plan))
+        out.append(
+            {
+                "query": name,
+                "stages": stages,
+                "keys_examined": stats.get("totalKeysExamined", None),
+                "docs_examined": stats.get("totalDocsExamined", None),
+                "execution_time_ms": stats.get("executionTimeMillis", None),
+                "slow": "COLLSCAN" in stages,
+            }
+        )
+    return out
 
 
 def main():
@@ -243,25 +905,105 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-o", "--output", help="specify an output file to write admin data")
     parser.add_argument("-s", "--session", help="specify a session id")
+    parser.add_argument(
+        "--match",
+        choices=SESSION_MATCH_MODES,
+        default="prefix",
+        help="match the session id exactly, as a prefix (default) or anywhere in the id, "
+        + "ignoring case, which reads every session and is slow on large databases",
+    )
     parser.add_argument(
         "-c", "--count", action="store_true", help="specify whether to count API calls or not"
     )
     parser.add_argument("-cl", "--countlike", help="specify an API call name to count")
+    parser.add_argument(
+        "-m",
+        "--migrate",
+        action="store_true",
+        help="move actions stored in session documents to the session_actions collection",
+    )
+    parser.add_argument(
+        "-b",
+        "--backfill",
+        action="store_true",
+        help="record the length of all sessions that do not have it yet",
+    )
+    parser.add_argument(
+        "-d", "--daily", action="store_true", help="report action counts and usage of each day"
+    )
+    parser.add_argument(
+        "-u",
+        "--update",
+        action="store_true",
+        help="only update the usage rollups with the actions recorded since the last update",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="compute the usage rollups again from all recorded actions",
+    )
+    parser.add_argument(
+        "-x",
+        "--export",
+        choices=["sessions", "actions", "csv"],
+        help="stream sessions or actions as JSON Lines to the output file (or the standard "
+        + "output), or actions as CSV files for each API call to the output directory",
+    )
+    parser.add_argument("--start", help="only export data from this date on, as YYYY-MM-DD")
+    parser.add_argument("--end", help="only export data before this date, as YYYY-MM-DD")
+    parser.add_argument(
+        "--fields", help="comma separated list of fields to export, e.g. user_email,user_ip"
+    )
+    parser.add_argument(
+        "-e",
+        "--explain",
+        action="store_true",
+        help="report the query plans of common queries and whether they use an index",
+    )
     args = parser.parse_args()
 
+    if args.export is not None:
+        fields = args.fields.split(",") if args.fields else None
+        if args.export == "csv":
+            if args.output is None:
+                parser.error("exporting to CSV requires an output directory")
+            out = exportActionsCsv(args.output, args.start, args.end, fields)
+        else:
+            export = exportSessions if args.export == "sessions" else exportActions
+            if args.output is None:
+                out = export(sys.stdout, args.start, args.end, fields)
+            else:
+                with open(args.output, "x") as file:
+                    out = export(file, args.start, args.end, fields)
+        print(out, file=sys.stderr)
+        return
+
     out = ""
-    if args.session and args.countlike:
-        out = countActionSessionLike(args.countlike, args.session)
-    elif args.session and args.count:
-        out = countActionSessionLike("", args.session)
-    elif args.session:
-        out = getSession(args.session)
-    elif args.countlike:
-        out = countActionLike(args.countlike)
-    elif args.count:
-        out = countActions()
+    if args.migrate:
+        out = migrateActions()
+    elif args.explain:
+        out = explainQueries()
+    elif args.backfill:
+        out = backfillSessionLengths()
+    elif args.update or args.rebuild:
+        out = updateRollups(rebuild=args.rebuild)
+    elif args.session and not (args.count or args.countlike):
+        out = getSession(args.session, args.match)
     else:
-        out = generalInfo()
+        # the reports below read the usage rollups
+        updateRollups()
+        if args.daily:
+            out = dailyInfo()
+        elif args.session and args.countlike:
+            out = countActionSessionLike(args.countlike, args.session, args.match)
+        elif args.session:
+            out = countActionSessionLike("", args.session, args.match)
+        elif args.countlike:
+            out = countActionLike(args.countlike)
+        elif args.count:
+            out = countActions()
+        else:
+            out = generalInfo()
 
     if args.output is None:
         pprint.pp(out)
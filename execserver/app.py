@@ -22,33 +22,71 @@ flask application that directly interacts with the user
 and the database.
 """
 
+import math
 import time
 import json
 import traceback
 from multiprocessing import Process, Pipe
 import resource
+import signal
 from flask import Flask, request, jsonify, Response
 import dill as pickle
 from server.magically_trace_stack import MagicallyTraceStack
 from server import helpers
+from server.source import SourceModel
+from server import frames
+from execserver.scheduler import PriorityScheduler, QueueFull, QueueTimeout
+from execserver import ipc
+from execserver.code_cache import CodeCache
 import pennylane as qml
 
+# Number of code execution processes that can run at the same time
+MAX_CONCURRENT_JOBS = 4
 
-def get_trace(code):
+# Number of requests that can wait for a free process per priority class
+MAX_QUEUE_DEPTH = {"debugger": 16, "realtime": 8, "batch": 4}
+
+# Seconds a request can wait in the queue before it is rejected
+QUEUE_TIMEOUT = 10
+
+# Seconds a request can run user code, including the transform stages that
+# are evaluated after the process of the request exited
+CODE_TIME_LIMIT = 10
+
+# Number of transform stages that are executed in parallel processes when
+# they cannot be evaluated on the captured qnode. The first stage runs in the
+# slot of the request, the others only run in parallel if the scheduler has
+# free slots for them.
+MAX_PARALLEL_TRANSFORM_STAGES = 4
+
+# Number of compiled versions of user code kept by each process
+CODE_CACHE_SIZE = 256
+
+# Path of a Unix domain socket to accept requests from a main server on the
+# same machine, in addition to HTTP. None disables the socket.
+EXEC_SOCKET_PATH = None
+
+code_cache = CodeCache(CODE_CACHE_SIZE)
+
+
+def get_trace(code, lines_of_quantum_code=None):
     """Execute user code and trace the result to get more information
 
     Args:
         code (string): user code
+        lines_of_quantum_code (set): line numbers of lines with quantum code,
+            computed from the code if None
 
     Returns
         1. Code trace
         2. Time it took to execute code with tracing
     """
-    lines_of_quantum_code = helpers.get_quantum_lines(code.split("\n"))
+    if lines_of_quantum_code is None:
+        lines_of_quantum_code = helpers.get_quantum_lines(code.split("\n"))
     exec_time_start = time.time()
     try:
         with MagicallyTraceStack(lines_of_quantum_code) as trace:
-            exec(code, globals())
+            exec(code_cache.compile(code), globals())
     except Exception:
         exceptiondata = traceback.format_exc().splitlines()
         exceptionarray = [exceptiondata[-1]] + exceptiondata[1:-1]
@@ -60,20 +98,6 @@ def get_trace(code):
     return trace, time.time() - exec_time_start
 
 
-def code_cleanup(code):
-    """Cleans up the new line characters inside qml operation parameters and cleans up comments
-
-    Args:
-        code (String): Code to clean up
-
-    Returns:
-        String: Code after new line characters and comments have been removed
-    """
-    newline_cleaned_up_code = helpers.newline_cleanup(code)
-    commented_cleaned_up_code = helpers.comment_cleanup(newline_cleaned_up_code)
-    return commented_cleaned_up_code
-
-
 def get_wires(annotated_queue):
     """Get the wires used in the code
 
@@ -98,60 +122,246 @@ def initialize_resource_limits():
     resource.setrlimit(resource.RLIMIT_AS, (2147483648, hard_limit))  # 2GB
 
 
+def apply_transform(qnode, decorator):
+    """Apply a transform decorator of the user code to a qnode, in the same
+        way as the decorator is applied to the function below it.
+
+    Args:
+        qnode (QNode): qnode the transform is applied to
+        decorator (String): line of the decorator, e.g. "@qml.transforms.merge_rotations"
+
+    Returns:
+        QNode: the qnode with the transform added to its transform program
+    """
+    return eval(decorator.strip()[1:], globals())(qnode)
+
+
+def evaluate_transform_by_execution(code, conn, time_limit):
+    """Execute the user code with the image commands added to get the circuit
+        output and visualization of its qnode. Runs in a separate process and
+        sends the result back with send_result().
+
+    Args:
+        code (string): user code with the transforms of the stage uncommented
+        conn (Python Connection Object): one end of the duplex pipe required to
+            communicate between two processes.
+        time_limit (float): seconds left of the time limit of the request
+    """
+    initialize_resource_limits()
+    # stop the process even if the process that started it is terminated
+    signal.alarm(max(1, math.ceil(time_limit)))
+    exec_time = time.time()
+    exec(code_cache.compile(code), globals())
+    exec_time = time.time() - exec_time
+    send_result(
+        conn,
+        {
+            "image": helpers.get_image_png_bytes(globals()["circuit_img"][0]),
+            "output": repr(globals()["res"]).replace("\n", "").replace(" ", ""),
+            "exec_time": exec_time,
+        },
+    )
+
+
+def run_transform_stages(codes, deadline):
+    """Start a process for each transform stage and wait for their results.
+        Every process is joined, also when a stage fails.
+
+    Args:
+        codes (Array): user code of each stage
+        deadline (float): time.time() at which the request runs out of time
+
+    Returns:
+        Array: result of each stage, in the order of codes
+
+    Raises:
+        RuntimeError: if a stage exits without a result
+        TimeoutError: if the stages are not done before the deadline
+    """
+    stages = []
+    for code in codes:
+        parent_conn, child_conn = Pipe()
+        p = Process(
+            target=evaluate_transform_by_execution,
+            args=(code, child_conn, deadline - time.time()),
+        )
+        p.start()
+        # only the process has the other end open, so recv_bytes() fails
+        # instead of waiting forever if the process exits without a result
+        child_conn.close()
+        stages.append((p, parent_conn))
+    results = []
+    try:
+        for p, parent_conn in stages:
+            if not parent_conn.poll(max(0, deadline - time.time())):
+                raise TimeoutError("Transform evaluation ran out of time")
+            try:
+                results.append(frames.loads(parent_conn.recv_bytes()))
+            except EOFError:
+                if time.time() >= deadline:
+                    # stopped by its alarm
+                    raise TimeoutError("Transform evaluation ran out of time")
+                raise RuntimeError("Transform evaluation failed")
+    finally:
+        for p, parent_conn in stages:
+            if len(results) < len(stages):
+                p.kill()
+            p.join()
+            parent_conn.close()
+    return results
+
+
+def evaluate_transforms_by_execution(codes, exec_time_list, deadline, scheduler=None):
+    """Evaluate transform stages that cannot be evaluated on the captured
+        qnode by executing the user code of each stage. The stages do not
+        depend on each other, so up to MAX_PARALLEL_TRANSFORM_STAGES of them
+        run at the same time in separate processes. Runs in the server
+        process after the process of the request exited, so the first stage
+        of each batch uses the slot of the request. The other stages of a
+        batch each take a free slot of the scheduler, so stage processes
+        count against MAX_CONCURRENT_JOBS like the processes of requests.
+        All batches share the time left of the request.
+
+    Args:
+        codes (Array): user code of each stage
+        exec_time_list (Array): list of execution times
+        deadline (float): time.time() at which the request runs out of time
+        scheduler (PriorityScheduler): scheduler of the server, the stages
+            run one at a time if it is None
+
+    Returns:
+        Array: image and output of each stage, in the order of codes
+
+    Raises:
+        RuntimeError: if a stage exits without a result
+        TimeoutError: if the stages are not done before the deadline
+    """
+    results = []
+    start = 0
+    while start < len(codes):
+        if time.time() >= deadline:
+            raise TimeoutError("Transform evaluation ran out of time")
+        extra_slots = 0
+        max_extra_slots = min(MAX_PARALLEL_TRANSFORM_STAGES, len(codes) - start) - 1
+        while scheduler is not None and extra_slots < max_extra_slots and scheduler.try_acquire():
+            extra_slots += 1
+        batch_start_time = time.time()
+        try:
+            batch = run_transform_stages(codes[start : start + 1 + extra_slots], deadline)
+        finally:
+            for _ in range(extra_slots):
+                scheduler.release(time.time() - batch_start_time)
+        results += [(result["image"], result["output"]) for result in batch]
+        # the stages of a batch ran at the same time
+        exec_time_list.append(max(result["exec_time"] for result in batch))
+        start += len(batch)
+    return results
+
+
+def add_transform_stage_results(result, deadline, scheduler=None):
+    """Evaluate the transform stages that the process of a request could not
+        evaluate on the captured qnode, see evaluate_transforms_by_execution(),
+        and add their images and outputs to the transform details.
+
+    Args:
+        result (dict): result sent by process_code(), changed in place
+        deadline (float): time.time() at which the request runs out of time
+        scheduler (PriorityScheduler): scheduler of the server, or None
+
+    Raises:
+        RuntimeError: if a stage exits without a result
+        TimeoutError: if the stages are not done before the deadline
+    """
+    stages = result.pop("transform_stages", [])
+    if len(stages) == 0:
+        return
+    executed = evaluate_transforms_by_execution(
+        [code for _, code in stages], result["exec_times_list"], deadline, scheduler
+    )
+    for (j, _), (image, output) in zip(stages, executed):
+        result["transform_details"][j][0] = image
+        result["transform_details"][j][1] = output
+
+
 def get_transform_results_after_uncommenting_transforms(
-    commands, code, code_received_transforms_commented_arr, exec_time_list, main_fcn_output
+    commands,
+    source,
+    code_received_transforms_commented_arr,
+    exec_time_list,
+    device_name,
+    num_wires,
+    num_shots,
 ):
     """Get the circuit output and visualization of each transform
 
+    The transforms are applied one at a time, starting from the one closest
+    to the qnode, to a qnode with the operations captured from the main
+    function, so the user code is not executed again. If a transform cannot
+    be applied to the qnode, e.g. a decorator that is not a transform, the
+    user code is executed with the transform uncommented for it and the
+    transforms after it, see evaluate_transforms_by_execution().
+
     Args:
         commands (Object): command objkect
-        code (String): the code user inputs
+        source (SourceModel): the code user inputs after preprocessing
         code_received_transforms_commented_arr (Array): an array of each line of the code with transforms commented
         exec_time_list (Array): list of execution times
-        main_fcn_output (String): output of the qnode as a string
+        device_name (String): name of the device of the qnode
+        num_wires (int): number of wires of the device
+        num_shots (int): number of shots of the device
 
     Returns:
-        Array: qnode output and visualization after uncommenting transforms
+        Array, Array:
+            qnode output and visualization after uncommenting transforms,
+            None for the transforms that must be evaluated by execution
+            user code to execute for each of these transforms, with the
+            transform result it is for
     """
     transform_results_after_uncommenting_transforms = []
-    transform_names_and_line_numbers = helpers.get_transform_details(
-        code, starting_idx=commands[-1].identifier + 1
-    )
-    i = len(transform_names_and_line_numbers) - 1
-
-    while i >= 0:
-        t = transform_names_and_line_numbers[i]
-        code_received_transforms_commented_arr[t[1] - 1] = code_received_transforms_commented_arr[
-            t[1] - 1
-        ][1:]
-        code_received_transforms_commented_str = "\n".join(code_received_transforms_commented_arr)
-        exec_time = time.time()
-        exec(code_received_transforms_commented_str, globals())
-        exec_time_list.append(time.time() - exec_time)
-        _, exec_time = get_trace(code_received_transforms_commented_str)
-        exec_time_list.append(exec_time)
-
-        transform_eval = (helpers.get_image_bs64_bytecode(circuit_img[0]), res)
-        eval_str = ""
-        for char in str(main_fcn_output):
-            if char == " ":
-                eval_str = eval_str + char
-
-            if char != "\n":
-                eval_str = eval_str + char
-
-        transform_results_after_uncommenting_transforms.append(
-            [
-                transform_eval[0],
-                repr(transform_eval[1]).replace("\n", "").replace(" ", ""),
-                t[0],
-                t[1] + 1 + commands[-1].identifier,
-                t[1],
-            ]
-        )
-        i -= 1
+    transform_names_and_line_numbers = source.transform_details()
+    stages_to_execute = []
+    user_qnode = globals().get(commands[0].function, None)
+    with helpers.checkout_device(device_name, num_wires, num_shots) as dev:
+        # use the device of the user's qnode, which can have more wires than
+        # the captured operations use
+        if isinstance(user_qnode, qml.QNode):
+            dev = user_qnode.device
+        qnode = helpers.get_qnode(commands[:-1], commands[-1], dev)
+        i = len(transform_names_and_line_numbers) - 1
+
+        while i >= 0:
+            t = transform_names_and_line_numbers[i]
+            code_received_transforms_commented_arr[t[1] - 1] = (
+                code_received_transforms_commented_arr[t[1] - 1][1:]
+            )
+            if qnode is not None:
+                try:
+                    qnode = apply_transform(qnode, t[0])
+                    exec_time = time.time()
+                    res = qnode()
+                    exec_time_list.append(time.time() - exec_time)
+                    # the captured measurements are always a list
+                    res = res[0] if len(res) == 1 else tuple(res)
+                    circuit_img = qml.draw_mpl(qnode)()
+                except Exception:
+                    qnode = None
+            if qnode is None:
+                # evaluated by execution in the server process, see
+                # add_transform_stage_results()
+                image, output = None, None
+            else:
+                image = helpers.get_image_png_bytes(circuit_img[0])
+                output = repr(res).replace("\n", "").replace(" ", "")
+
+            transform_result = [image, output, t[0], t[1] + 1 + commands[-1].identifier, t[1]]
+            if qnode is None:
+                stages_to_execute.append(
+                    (transform_result, "\n".join(code_received_transforms_commented_arr))
+                )
+            transform_results_after_uncommenting_transforms.append(transform_result)
+            i -= 1
 
-    return transform_results_after_uncommenting_transforms
+    return transform_results_after_uncommenting_transforms, stages_to_execute
 
 
 def add_image_commands_to_code_array(code_received_transforms_commented_arr, commands):
@@ -205,7 +415,7 @@ def get_information_of_subroutines(
             commands_to_execute_for_identifier_child = (
                 helpers.get_commands_to_execute_for_identifier(commands, command.identifier)
             )
-            circuit_img_child_byte_code = helpers.get_image_bs64_bytecode(
+            circuit_img_child_byte_code = helpers.get_image_png_bytes(
                 helpers.draw_circuit(
                     commands_to_execute_for_identifier_child[:-1],
                     device_name,
@@ -275,13 +485,25 @@ def remove_exection_time_from_processing_time(exec_time_list, process_start_time
     return processing_time
 
 
-def process_code(code, conn):
+def send_result(conn, result):
+    """Send the result of process_code() to the main process as a binary
+        frame. Images and pickled commands are sent as raw bytes and are
+        only encoded as text if the result is sent to the main server as JSON.
+
+    Args:
+        conn (Python Connection Object): child end of the pipe
+        result (dict): result of the code execution
+    """
+    conn.send_bytes(frames.dumps(result))
+
+
+def process_code(source, conn):
     """Execute and process the user code to extract commands and
-        other useful information. Jsonify the results and send back
-        to the main process.
+        other useful information. Send the results back to the main
+        process with send_result().
 
     Args:
-        code (string): user code
+        source (SourceModel): user code after preprocessing
         conn (Python Connection Object): one end of the duplex pipe required to
             communicate between two processes.
     """
@@ -289,40 +511,40 @@ def process_code(code, conn):
 
     process_start_time = time.time()
     exec_time_list = []
-
-    # code clean up
-    code = code_cleanup(code)
+    code = source.code
 
     # check for syntax errors
-    trace, exec_time = get_trace(code)
+    trace, exec_time = get_trace(code, source.quantum_lines)
     exec_time_list.append(exec_time)
     if type(trace) != MagicallyTraceStack:
         print(trace)
-        return conn.send(jsonify({"error": trace}))
+        return send_result(conn, {"error": trace})
 
     # comment out transforms and get method names
-    code_received_transforms_commented = helpers.comment_out_transforms(code)
-    method_names = helpers.get_method_names(code)
+    code_received_transforms_commented_arr = source.transforms_commented()
+    code_received_transforms_commented = "\n".join(code_received_transforms_commented_arr)
+    method_names = source.method_names
 
     # get stack trace and execution time of code
     trace = None
-    trace, exec_time = get_trace(code_received_transforms_commented)
+    trace, exec_time = get_trace(code_received_transforms_commented, source.quantum_lines)
     exec_time_list.append(exec_time)
     if type(trace) != MagicallyTraceStack:
-        return conn.send(jsonify({"error": trace}))
+        return send_result(conn, {"error": trace})
 
     if not trace.get_stack():
-        return jsonify({"error": ["Please run exactly one quantum node."]})
+        return send_result(conn, {"error": ["Please run exactly one quantum node."]})
 
     # get device information
     annotated_queue = trace.get_stack()["commands"]
     device_name, num_shots, num_wires = helpers.get_device_info(trace.info, annotated_queue)
 
-    code_received_transforms_commented_arr = code_received_transforms_commented.split("\n")
-
     # get list of command objects and main qnode output
     commands = helpers.get_list_of_commands(
-        trace.info, method_names, code_received_transforms_commented, annotated_queue.queue
+        trace.info,
+        method_names,
+        list(code_received_transforms_commented_arr),
+        annotated_queue.queue,
     )
     main_fcn_output, exec_time = helpers.get_fcn_output(
         commands[:-1], device_name, num_wires, num_shots, commands[-1]
@@ -332,17 +554,26 @@ def process_code(code, conn):
 
     add_image_commands_to_code_array(code_received_transforms_commented_arr, commands)
 
-    transform_results_after_uncommenting_transforms = (
+    transform_results_after_uncommenting_transforms, stages_to_execute = (
         get_transform_results_after_uncommenting_transforms(
-            commands, code, code_received_transforms_commented_arr, exec_time_list, main_fcn_output
+            commands,
+            source,
+            code_received_transforms_commented_arr,
+            exec_time_list,
+            device_name,
+            num_wires,
+            num_shots,
         )
     )
     transform_results_after_uncommenting_transforms.sort(key=lambda x: x[3])
+    # index of each transform that is evaluated by execution after sorting
+    positions = {id(t): j for j, t in enumerate(transform_results_after_uncommenting_transforms)}
+    transform_stages = [[positions[id(t)], code] for t, code in stages_to_execute]
 
     commands_to_execute_for_identifier = helpers.get_commands_to_execute_for_identifier(
         commands, commands[0].identifier
     )
-    circuit_img_base_64_byte_code = helpers.get_image_bs64_bytecode(
+    circuit_img_png_bytes = helpers.get_image_png_bytes(
         helpers.draw_circuit(
             commands_to_execute_for_identifier[:-1],
             device_name,
@@ -368,70 +599,218 @@ def process_code(code, conn):
         exec_time_list, process_start_time, time.time()
     )
 
-    conn.send(
-        jsonify(
-            {
-                "name": commands[0].function,
-                "id": commands[0].identifier,
-                "image": circuit_img_base_64_byte_code,
-                "line_number": commands[0].line_number,
-                "children": children_fcn_calls,
-                "has_children": len(children_fcn_calls) > 0,
-                "more_information": more_information_main_fcn,
-                "arguments": arg_vals,
-                "transform_details": transform_results_after_uncommenting_transforms,
-                "device_name": device_name,
-                "commands": pickle.dumps((commands, annotated_queue.queue)).hex(),
-                "debug_index": -1,
-                "num_wires": num_wires,
-                "num_shots": num_shots,
-                "processing_time_no_exec_times": processing_time,
-                "exec_times_list": exec_time_list,
-            }
-        )
+    send_result(
+        conn,
+        {
+            "name": commands[0].function,
+            "id": commands[0].identifier,
+            "image": circuit_img_png_bytes,
+            "line_number": commands[0].line_number,
+            "children": children_fcn_calls,
+            "has_children": len(children_fcn_calls) > 0,
+            "more_information": more_information_main_fcn,
+            "arguments": arg_vals,
+            "transform_details": transform_results_after_uncommenting_transforms,
+            "transform_stages": transform_stages,
+            "device_name": device_name,
+            "commands": pickle.dumps((commands, annotated_queue.queue)),
+            "debug_index": -1,
+            "num_wires": num_wires,
+            "num_shots": num_shots,
+            "processing_time_no_exec_times": processing_time,
+            "exec_times_list": exec_time_list,
+        },
+    )
+
+
+def precompile(source):
+    """Compile the code that process_code() executes for user code in this
+        process, so that the processes started for this request and later
+        requests with the same code find it in the code cache.
+
+    Args:
+        source (SourceModel): user code after preprocessing
+    """
+    for code in (source.code, "\n".join(source.transforms_commented())):
+        try:
+            code_cache.compile(code)
+        except (SyntaxError, ValueError):
+            # reported by process_code()
+            pass
+
+
+def run_code(code, scheduler=None):
+    """Run process_code() in a new process and wait for its result, then
+        evaluate the transform stages that need the user code to be executed.
+
+    Args:
+        code (string): user code
+        scheduler (PriorityScheduler): scheduler that gives free slots to
+            transform stages that run in parallel, see
+            evaluate_transforms_by_execution()
+
+    Returns:
+        Int, dict:
+            HTTP status code, 200 if the process sent a result, 418 if it or
+            the transform stages ran out of time and 400 if it exited without
+            a result
+            result sent by the process, or None
+    """
+    try:
+        # clean up the new line characters inside qml operation parameters
+        # and the comments, and tokenize the code once for all the steps
+        source = SourceModel(code)
+    except Exception:
+        return 400, None
+    precompile(source)
+    parent_conn, child_conn = Pipe()
+    p = Process(
+        target=process_code,
+        args=(
+            source,
+            child_conn,
+        ),
     )
+    p.start()
+    start_time = time.time()
+    result = None
+    while p.is_alive():
+        if parent_conn.poll():
+            result = frames.loads(parent_conn.recv_bytes())
+            break
+        if (time.time() - start_time) > CODE_TIME_LIMIT:
+            p.terminate()
+            p.join()
+            return 418, None
+    if result is None and parent_conn.poll():
+        result = frames.loads(parent_conn.recv_bytes())
+    # the process exits after it sends its result, its slot is used by the
+    # transform stages
+    p.join(1)
+    if p.is_alive():
+        p.kill()
+        p.join()
+    if result is None:
+        return 400, None
+    try:
+        add_transform_stage_results(result, start_time + CODE_TIME_LIMIT, scheduler)
+    except TimeoutError:
+        return 418, None
+    except RuntimeError:
+        return 400, None
+    if "device_name" in result:
+        # processes forked for later requests find the device in their pool
+        try:
+            helpers.add_device_to_pool(
+                result["device_name"], result["num_wires"], result["num_shots"]
+            )
+        except Exception as e:
+            print("Device could not be created: " + str(e))
+    return 200, result
 
 
 def create_app(test_config=None):
     """Main flask application builder function
 
+    Args:
+        test_config: Configuration used by Pytest to override the
+            scheduling limits (MAX_CONCURRENT_JOBS, MAX_QUEUE_DEPTH, QUEUE_TIMEOUT)
+            and the socket path (EXEC_SOCKET_PATH).
+
     Returns:
         flask application
     """
+    if test_config is None:
+        test_config = {}
     app = Flask(__name__, instance_relative_config=True)
 
     app.json.default = helpers.json_default
 
+    scheduler = PriorityScheduler(
+        test_config.get("MAX_CONCURRENT_JOBS", MAX_CONCURRENT_JOBS),
+        test_config.get("MAX_QUEUE_DEPTH", MAX_QUEUE_DEPTH),
+        test_config.get("QUEUE_TIMEOUT", QUEUE_TIMEOUT),
+    )
+
+    def execute(body):
+        """Run the code in the request body once the scheduler gives the
+            request a free execution slot.
+
+        Args:
+            body (dict): request body with the user code and its priority
+
+        Returns:
+            Int, dict, dict:
+                HTTP status code, 429 (queue full) or 503 (waited too long)
+                under load, otherwise the status code from run_code()
+                response headers, including Retry-After under load and the
+                time spent in the queue otherwise
+                result of the code execution with images and commands as
+                raw bytes, or None
+        """
+        try:
+            with scheduler.slot(body.get("priority", None)) as wait_time:
+                status, result = run_code(body["data"], scheduler)
+        except QueueFull as e:
+            return 429, {"Retry-After": str(e.retry_after)}, None
+        except QueueTimeout as e:
+            return 503, {"Retry-After": str(e.retry_after)}, None
+        return status, {"X-Queue-Wait-Time": str(wait_time)}, result
+
     @app.route("/", methods=["POST"])
     def main():
         """Entry point to exec server, executes code and
             responds to main server with information gathered.
+            Requests wait for a free execution slot in order of their
+            priority class.
 
         Returns:
             JSON to be used by the main server and frontend for
-            various purposes.
+            various purposes. The time spent in the queue is reported
+            in the X-Queue-Wait-Time header.
         """
         if request.data == b"":
             body = request.form
         else:
             body = json.loads(request.data.decode("utf-8"))
         if body:
-            parent_conn, child_conn = Pipe()
-            p = Process(
-                target=process_code,
-                args=(
-                    body["data"],
-                    child_conn,
-                ),
-            )
-            p.start()
-            start_time = time.time()
-            while p.is_alive():
-                if parent_conn.poll():
-                    return parent_conn.recv()
-                if (time.time() - start_time) > 10:
-                    p.terminate()
-                    return Response(status=418)
+            status, headers, result = execute(body)
+            if result is None:
+                return Response(status=status, headers=headers)
+            res = jsonify(helpers.encode_binary_fields(result))
+            res.headers.update(headers)
+            return res
         return Response(status=400)
 
+    @app.route("/health", methods=["GET"])
+    def health():
+        """Health probe used by the main server to decide whether to send
+            requests to this exec server.
+
+        Returns:
+            JSON with the number of running and waiting requests.
+        """
+        return jsonify(scheduler.stats())
+
+    def handle_socket_request(req):
+        """Answer a request received on the Unix domain socket in the same
+            way as the HTTP routes. Images and commands are sent as raw bytes.
+
+        Args:
+            req (dict): request with the path and the body
+
+        Returns:
+            Dict with the status code, headers and body of the response
+        """
+        if req.get("path", "/") == "/health":
+            return {"status": 200, "headers": {}, "body": scheduler.stats()}
+        if not req.get("body", None):
+            return {"status": 400, "headers": {}, "body": None}
+        status, headers, result = execute(req["body"])
+        return {"status": status, "headers": headers, "body": result}
+
+    socket_path = test_config.get("EXEC_SOCKET_PATH", EXEC_SOCKET_PATH)
+    if socket_path is not None:
+        ipc.serve(socket_path, handle_socket_request)
+
     return app
@@ -0,0 +1,82 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the cache of compiled user code used by the execution
+server. The same code is executed several times while a request is processed
+and is often sent again by the next request, e.g. by Real-Time Development,
+so it is compiled once and the code object is reused. Code execution
+processes are forked from the server process, so code compiled by the server
+process before the fork is found in the cache of every process started later.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# File name of compiled code, the same as for code given to exec() as a string
+FILENAME = "<string>"
+
+
+class CodeCache:
+    """Least recently used cache of code objects by the hash of their source
+
+    Attributes:
+        max_size: maximum number of cached code objects
+        num_hits: number of compilations answered from the cache
+        num_misses: number of compilations done
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.num_hits = 0
+        self.num_misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # a process can be forked while another thread holds the lock
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        """Replace the lock in a forked process."""
+        self._lock = threading.Lock()
+
+    def compile(self, code):
+        """Compile code to run with exec(). The file name of the code object
+        is FILENAME, so tracebacks and traces of the code are the same as
+        when the code is given to exec() as a string.
+
+        Args:
+            code (string): code
+
+        Returns:
+            code object
+
+        Raises:
+            SyntaxError: if the code cannot be compiled, the error is not cached
+        """
+        key = hashlib.sha256(code.encode("utf-8")).digest()
+        with self._lock:
+            code_object = self._entries.get(key, None)
+            if code_object is not None:
+                self._entries.move_to_end(key)
+                self.num_hits += 1
+                return code_object
+        code_object = compile(code, FILENAME, "exec")
+        with self._lock:
+            self.num_misses += 1
+            self._entries[key] = code_object
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return code_object
@@ -0,0 +1,76 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the Unix domain socket listener of the execution server.
+When the main server and the execution server run on the same machine, the
+main server can send requests over this socket with binary frames from
+server/frames.py instead of JSON over HTTP.
+
+Requests and responses mirror the HTTP API:
+    request:  {"path": "/" or "/health", "body": {...}}
+    response: {"status": int, "headers": {...}, "body": {...}}
+"""
+
+import os
+import socket
+import threading
+from server import frames
+
+
+def handle_connection(conn, handle_request):
+    """Answer requests on a connection until the main server closes it.
+
+    Args:
+        conn (socket.socket): accepted connection
+        handle_request (function): function that takes a request and
+            returns a response
+    """
+    with conn:
+        while True:
+            try:
+                request = frames.recv_frame(conn)
+            except (EOFError, OSError):
+                return
+            frames.send_frame(conn, handle_request(request))
+
+
+def serve(path, handle_request):
+    """Listen on a Unix domain socket in a background thread. Each connection
+    is handled in its own thread so that the execution server scheduler
+    decides the order in which requests run.
+
+    Args:
+        path (string): file system path of the socket
+        handle_request (function): function that takes a request and
+            returns a response
+
+    Returns:
+        socket.socket: the listening socket
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(
+                target=handle_connection, args=(conn, handle_request), daemon=True
+            ).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener
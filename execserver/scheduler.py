@@ -0,0 +1,180 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the work queue used by the execution server to decide
+which request gets to fork a code execution process next. Requests are
+admitted by priority class and rejected early when the queue is full so
+that a burst of real-time traffic cannot starve debugger users or start
+an unbounded number of processes.
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Priority classes from most to least important
+PRIORITIES = ("debugger", "realtime", "batch")
+DEFAULT_PRIORITY = "batch"
+
+
+class QueueFull(Exception):
+    """Raised when the queue for a priority class has no free space.
+
+    Attributes:
+        retry_after: number of seconds the client should wait before retrying
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Execution queue is full")
+        self.retry_after = retry_after
+
+
+class QueueTimeout(Exception):
+    """Raised when a request waited in the queue longer than allowed.
+
+    Attributes:
+        retry_after: number of seconds the client should wait before retrying
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Timed out waiting in the execution queue")
+        self.retry_after = retry_after
+
+
+class PriorityScheduler:
+    """Bounded priority work queue with a fixed number of running slots
+
+    Attributes:
+        max_concurrency: number of requests that can run at the same time
+        max_queue_depth: dict of priority class to the number of requests
+            that can wait in the queue for that class
+        queue_timeout: seconds a request can wait before it is rejected
+        average_job_time: moving average of job run time in seconds, used
+            to estimate Retry-After values
+    """
+
+    def __init__(self, max_concurrency, max_queue_depth, queue_timeout):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self.average_job_time = 1.0
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._counter = itertools.count()
+        self._running = 0
+        self._queued = {p: 0 for p in PRIORITIES}
+
+    def retry_after(self):
+        """Estimate how long it will take for the current queue to drain.
+
+        Returns:
+            Int: seconds until a new request is likely to be admitted
+        """
+        rounds = (len(self._waiting) + 1) / self.max_concurrency
+        return max(1, math.ceil(rounds * self.average_job_time))
+
+    def stats(self):
+        """Get the current load of the scheduler.
+
+        Returns:
+            Dict: number of running requests and waiting requests per class
+        """
+        with self._condition:
+            return {"running": self._running, "waiting": dict(self._queued)}
+
+    def acquire(self, priority):
+        """Wait for a free slot, letting higher priority requests go first.
+            Requests in the same priority class are served in arrival order.
+
+        Args:
+            priority (string): one of PRIORITIES, unknown values are
+                treated as DEFAULT_PRIORITY
+
+        Returns:
+            Float: time spent waiting in the queue in seconds
+        """
+        if priority not in PRIORITIES:
+            priority = DEFAULT_PRIORITY
+        start_time = time.time()
+        with self._condition:
+            if self._queued[priority] >= self.max_queue_depth[priority]:
+                raise QueueFull(self.retry_after())
+            entry = (PRIORITIES.index(priority), next(self._counter))
+            heapq.heappush(self._waiting, entry)
+            self._queued[priority] += 1
+            try:
+                while self._running >= self.max_concurrency or self._waiting[0] != entry:
+                    remaining = self.queue_timeout - (time.time() - start_time)
+                    if remaining <= 0:
+                        raise QueueTimeout(self.retry_after())
+                    self._condition.wait(remaining)
+                heapq.heappop(self._waiting)
+                self._running += 1
+                # the next request may have woken up before this one and
+                # gone back to waiting while a slot is still free
+                self._condition.notify_all()
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+            finally:
+                self._queued[priority] -= 1
+        return time.time() - start_time
+
+    def try_acquire(self):
+        """Take a free slot without waiting. A slot is only taken if no
+            request is waiting for one, so that extra work of a running
+            request never delays requests in the queue.
+
+        Returns:
+            Boolean: True if a slot was taken, it must be freed with release()
+        """
+        with self._condition:
+            if self._running >= self.max_concurrency or len(self._waiting) > 0:
+                return False
+            self._running += 1
+            return True
+
+    def release(self, job_time):
+        """Free the slot taken by acquire() and wake up waiting requests.
+
+        Args:
+            job_time (float): how long the finished job ran in seconds
+        """
+        with self._condition:
+            self._running -= 1
+            self.average_job_time = 0.8 * self.average_job_time + 0.2 * job_time
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority):
+        """Context manager around acquire() and release().
+
+        Args:
+            priority (string): priority class of the request
+
+        Yields:
+            Float: time spent waiting in the queue in seconds
+        """
+        wait_time = self.acquire(priority)
+        start_time = time.time()
+        try:
+            yield wait_time
+        finally:
+            self.release(time.time() - start_time)
@@ -0,0 +1,108 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the allowlist of email addresses that can log in. Each
+line of the allowlist file is either an email address, which is allowed
+exactly, or a domain such as "ubc.ca", which allows every address at that
+domain and its subdomains.
+
+The file is compiled once into a set of addresses and a trie of domain
+labels in reverse order ("ca" -> "ubc" -> ...), so a check takes time
+proportional to the number of labels in the address instead of the number of
+lines in the file. The file is compiled again when it changes on disk.
+"""
+
+import os
+import threading
+
+# Key that marks the end of an allowed domain in the trie
+_END = object()
+
+
+def compile_allowlist(lines):
+    """Compile the lines of an allowlist.
+
+    Args:
+        lines: iterable of lines of the allowlist file
+
+    Returns:
+        set, dict: allowed email addresses and trie of allowed domains
+    """
+    addresses = set()
+    domains = {}
+    for line in lines:
+        entry = line.split("\n")[0]
+        if "@" in entry:
+            addresses.add(entry)
+            continue
+        node = domains
+        for label in reversed(entry.split(".")):
+            node = node.setdefault(label, {})
+        node[_END] = True
+    return addresses, domains
+
+
+class Allowlist:
+    """Allowlist file compiled for fast lookups and reloaded when it changes
+
+    Attributes:
+        path: path of the allowlist file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._version = None
+        self._compiled = (set(), {})
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        """Compile the file again if its modification time or size changed
+        since it was last compiled.
+
+        Returns:
+            set, dict: allowed email addresses and trie of allowed domains
+        """
+        stat = os.stat(self.path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self._version:
+            return self._compiled
+        with self._lock:
+            if version != self._version:
+                with open(self.path) as file:
+                    self._compiled = compile_allowlist(file)
+                self._version = version
+        return self._compiled
+
+    def is_allowed(self, email_address):
+        """Check that the email address is allowed to login.
+
+        Args:
+            email_address (string): user's email address
+
+        Returns:
+            Boolean: True if email address is in the list or from a domain in
+            the list, False otherwise.
+        """
+        addresses, domains = self._reload_if_changed()
+        if email_address in addresses:
+            return True
+        node = domains
+        for label in reversed(email_address.split("@")[1].split(".")):
+            node = node.get(label, None)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
@@ -22,12 +22,20 @@ from flask import Flask, request, jsonify, Response
 import dill as pickle
 import matplotlib
 import json
-from pymongo import MongoClient
 import string
 import random
 import time
+import threading
 import requests
 from server import helpers
+from server.exec_backends import ExecBackendRegistry
+from server.exec_client import ExecClient, CircuitOpen
+from server.telemetry import TelemetryWriter, TelemetryPolicy
+from server.storage import open_storage
+from server.token_cache import TokenCache
+from server.allowlist import Allowlist
+from server.code_policy import CodePolicy
+from server.cost_estimate import find_exceeded_limit
 import pennylane as qml
 
 matplotlib.use("Agg")
@@ -35,6 +43,100 @@ matplotlib.use("Agg")
 
 EXEC_SERVER_URL = "http://localhost:5001"
 
+# Database of users, sessions and bug reports. Use a URL like
+# "sqlite:///circinspect.db" to store them in an SQLite database file
+# instead of MongoDB.
+STORAGE_URL = "mongodb://localhost:27017/circinspect"
+
+# All code execution servers that requests can be sent to, e.g. several
+# exec servers on different ports or machines. An exec server on the same
+# machine can be reached over its Unix domain socket (see EXEC_SOCKET_PATH
+# in execserver/app.py) with a URL like "unix:///tmp/circinspect-exec.sock".
+EXEC_SERVER_URLS = [EXEC_SERVER_URL]
+
+# Send all requests from a session to the same exec server when possible
+EXEC_SESSION_AFFINITY = False
+
+# Seconds between health probes to exec servers, 0 disables the probes.
+# Probes only run when there is more than one exec server.
+EXEC_HEALTH_CHECK_INTERVAL = 5
+
+# Seconds after which an exec server that does not answer a health probe
+# is ejected, and how long it stays ejected
+EXEC_SLOW_THRESHOLD = 1.0
+EXEC_EJECT_TIME = 30
+
+# Keep-alive connections kept open to each exec server
+EXEC_POOL_SIZE = 10
+
+# Seconds to wait for a connection to an exec server and for its response.
+# The read timeout covers the time a request waits in the exec server queue
+# and the time limit for running the code.
+EXEC_CONNECT_TIMEOUT = 1.0
+EXEC_READ_TIMEOUT = 25.0
+
+# Number of times a failed connection to an exec server is retried
+EXEC_RETRIES = 2
+
+# Consecutive failed requests to an exec server after which new requests to it
+# fail right away, and how many seconds they keep failing before a request is
+# tried again. A full queue of one priority class (429) is not a failure.
+EXEC_FAILURE_THRESHOLD = 5
+EXEC_CIRCUIT_RESET_TIME = 10
+
+# Session telemetry is written to the database in the background. Writes are
+# flushed every TELEMETRY_BATCH_SIZE writes or TELEMETRY_FLUSH_INTERVAL
+# seconds, and dropped if more than TELEMETRY_QUEUE_SIZE writes are waiting.
+TELEMETRY_QUEUE_SIZE = 10000
+TELEMETRY_BUCKET_SIZE = 50
+TELEMETRY_BATCH_SIZE = 100
+TELEMETRY_FLUSH_INTERVAL = 1.0
+
+# Fraction of the actions of each API call that are recorded, e.g.
+# {"/expandMethod": 0.1}. API calls that are not listed are always recorded.
+# Session and mode actions (/dc/...) should not be sampled since session
+# lengths are computed from them.
+TELEMETRY_SAMPLE_RATES = {}
+
+# Fields that are stored once in the telemetry_contents collection and
+# recorded in actions as <field>_hash, so repeated code is written only once
+TELEMETRY_HASHED_FIELDS = {"/visualizeCircuit": ["code"], "/expandMethod": ["output"]}
+
+# Fields that are not recorded, for each API call
+TELEMETRY_DROPPED_FIELDS = {}
+
+# Maximum size in bytes of a recorded field. Longer strings are cut, other
+# larger fields are replaced by their size in <field>_size.
+TELEMETRY_MAX_FIELD_SIZE = 65536
+
+# Priority class used by the exec server queue for each frontend mode.
+# Requests that do not come from the frontend are scheduled as "batch".
+EXEC_PRIORITY_BY_MODE = {"Debugger Mode": "debugger", "Real-Time Development": "realtime"}
+
+# Seconds a token lookup is cached for, so that authenticated requests do not
+# need a database round-trip each time. Unknown tokens are cached for
+# TOKEN_NEGATIVE_CACHE_TTL seconds. Found users are never cached past the
+# expiry time of their token.
+TOKEN_CACHE_TTL = 30
+TOKEN_NEGATIVE_CACHE_TTL = 5
+TOKEN_CACHE_SIZE = 10000
+
+# File with the email addresses and domains that are allowed to log in. It is
+# read again when it changes, so entries can be added without a restart.
+ALLOWLIST_PATH = "allowlist.txt"
+
+# Number of restricted code verdicts cached by the hash of the code, so code
+# that is sent again is not checked again
+CODE_POLICY_CACHE_SIZE = 10000
+
+# Limits of the static cost estimate of code (see server/cost_estimate.py).
+# Code over CODE_COST_LIMITS is rejected before it is sent to an exec server.
+# Code over CODE_COST_DOWNGRADE_LIMITS is run with the "batch" priority so
+# that it does not delay cheaper requests from the frontend. A statevector of
+# 26 wires fits in the memory limit of the exec server.
+CODE_COST_LIMITS = {"wires": 26, "operations": 1000000, "subroutine_calls": 100000}
+CODE_COST_DOWNGRADE_LIMITS = {"wires": 20, "operations": 10000, "subroutine_calls": 1000}
+
 NOAUTH = True
 
 
@@ -48,15 +150,52 @@ def create_app(test_config={}):
     Returns:
         flask application
     """
-    db_client = MongoClient("localhost", 27017)
-    db = db_client.circinspect
-    db_sessions = db.sessions
-    db_users = db.users
-    db_bugs = db.bugs
+    storage = open_storage(
+        test_config.get("STORAGE_URL", STORAGE_URL), bucket_size=TELEMETRY_BUCKET_SIZE
+    )
+    # create indexes in the background so that the server can start even if
+    # the database is slow to respond
+    threading.Thread(target=storage.ensure_indexes, daemon=True).start()
+    telemetry = TelemetryWriter(
+        storage,
+        max_queue_size=TELEMETRY_QUEUE_SIZE,
+        batch_size=TELEMETRY_BATCH_SIZE,
+        flush_interval=TELEMETRY_FLUSH_INTERVAL,
+        policy=TelemetryPolicy(
+            sample_rates=TELEMETRY_SAMPLE_RATES,
+            hashed_fields=TELEMETRY_HASHED_FIELDS,
+            dropped_fields=TELEMETRY_DROPPED_FIELDS,
+            max_field_size=TELEMETRY_MAX_FIELD_SIZE,
+        ),
+    )
+    token_cache = TokenCache(
+        ttl=TOKEN_CACHE_TTL, negative_ttl=TOKEN_NEGATIVE_CACHE_TTL, max_size=TOKEN_CACHE_SIZE
+    )
+    allowlist = Allowlist(test_config.get("ALLOWLIST_PATH", ALLOWLIST_PATH))
+    code_policy = CodePolicy(cache_size=CODE_POLICY_CACHE_SIZE)
+    cost_limits = test_config.get("CODE_COST_LIMITS", CODE_COST_LIMITS)
 
     app = Flask(__name__, instance_relative_config=True)
     app.json.default = helpers.json_default
 
+    exec_client = ExecClient(
+        pool_size=EXEC_POOL_SIZE,
+        connect_timeout=EXEC_CONNECT_TIMEOUT,
+        read_timeout=EXEC_READ_TIMEOUT,
+        retries=EXEC_RETRIES,
+        failure_threshold=EXEC_FAILURE_THRESHOLD,
+        reset_timeout=EXEC_CIRCUIT_RESET_TIME,
+    )
+    exec_backends = ExecBackendRegistry(
+        test_config.get("EXEC_SERVER_URLS", EXEC_SERVER_URLS),
+        session_affinity=test_config.get("EXEC_SESSION_AFFINITY", EXEC_SESSION_AFFINITY),
+        eject_time=EXEC_EJECT_TIME,
+        slow_threshold=EXEC_SLOW_THRESHOLD,
+        client=exec_client,
+    )
+    if EXEC_HEALTH_CHECK_INTERVAL > 0 and len(exec_backends.nodes) > 1:
+        exec_backends.start_health_checks(EXEC_HEALTH_CHECK_INTERVAL)
+
     def find_user_by_token(token):
         """Find the database entry for user with the token.
 
@@ -75,13 +214,35 @@ def create_app(test_config={}):
             return {"email_address": "NOAUTH"}
         if type(token) is not str:
             return None
-        user = db_users.find_one({"token": token})
-        if type(user) is not dict:
+        found, user = token_cache.get(token)
+        if not found:
+            # only the fields needed for authentication are fetched and cached
+            user = storage.find_user_by_token(token)
+            if type(user) is not dict:
+                user = None
+            token_cache.put(token, user)
+        if user is None:
             return None
         if user.get("expires", 0) < time.time():
             return None
         return user
 
+    def exec_server_busy(status_code, retry_after):
+        """Build the response sent when the code cannot be executed because
+            the exec servers are overloaded or unreachable.
+
+        Args:
+            status_code (int): 429 or 503
+            retry_after (string): seconds the client should wait before retrying
+
+        Returns:
+            JSON error response with the status code and a Retry-After header
+        """
+        res = jsonify({"error": ["Server is busy, please try again", "line unknown"]})
+        res.status_code = status_code
+        res.headers["Retry-After"] = retry_after
+        return res
+
     @app.route("/visualizeCircuit", methods=["POST"])
     def visualize_on_exec_server():
         """Send the user code to the execution server after
@@ -106,25 +267,55 @@ def create_app(test_config={}):
                 "code": body["data"],
             }
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
+                telemetry.push_action(body["session_id"], data)
 
             code_received = body["data"]
-            # initial check for malicious code
-            restricted_code = helpers.check_for_restricted_code(code_received)
-            if restricted_code != "":
-                return jsonify({"error": restricted_code})
+            # initial check for syntax errors and malicious code
+            error, cost = code_policy.inspect(code_received)
+            if error != "":
+                return jsonify({"error": error})
+            exceeded = find_exceeded_limit(cost, cost_limits)
+            if exceeded is not None:
+                message = (
+                    "Code is too large to run: it is estimated to use "
+                    + str(cost[exceeded])
+                    + " "
+                    + exceeded.replace("_", " ")
+                    + ", the limit is "
+                    + str(cost_limits[exceeded])
+                )
+                return jsonify({"error": [message, "line unknown"]})
 
             # send code to exec server to get the trace
-            res = requests.post(EXEC_SERVER_URL, json={"data": code_received})
+            priority = EXEC_PRIORITY_BY_MODE.get(body.get("mode", None), "batch")
+            if find_exceeded_limit(cost, CODE_COST_DOWNGRADE_LIMITS) is not None:
+                priority = "batch"
+            with exec_backends.node_for(body.get("session_id", None)) as node:
+                try:
+                    res = exec_client.post(
+                        node.url, json={"data": code_received, "priority": priority}
+                    )
+                except CircuitOpen as e:
+                    return exec_server_busy(503, str(e.retry_after))
+                except requests.ConnectionError:
+                    exec_backends.eject(node)
+                    return exec_server_busy(503, str(EXEC_EJECT_TIME))
+                except requests.Timeout:
+                    return jsonify({"error": ["Time limit exceeded", "line unknown"]})
             if res.status_code == 418:
                 return jsonify({"error": ["Time limit exceeded", "line unknown"]})
 
             if res.status_code == 400:
                 return jsonify({"error": ["Please run a quantum circuit", "line unknown"]})
-            return res.json()
+
+            if res.status_code in (429, 503):
+                return exec_server_busy(res.status_code, res.headers.get("Retry-After", "1"))
+
+            # images and commands are raw bytes if the exec server was
+            # reached over a Unix domain socket
+            output = helpers.encode_binary_fields(res.json())
+            output["queue_wait_time"] = float(res.headers.get("X-Queue-Wait-Time", 0))
+            return output
 
     @app.route("/expandMethod", methods=["POST"])
     def expand_method():
@@ -140,7 +331,7 @@ def create_app(test_config={}):
                 "TESTMODE", False
             ):
                 return Response(status=401)
-            (commands, annotated_queue) = pickle.loads(bytes.fromhex(body["commands"]))
+            commands, annotated_queue = pickle.loads(bytes.fromhex(body["commands"]))
             device_name = body["device_name"]
             identifier = body["id"]
             num_wires = body["num_wires"]
@@ -193,10 +384,7 @@ def create_app(test_config={}):
                 "output": jsonify(output).json,
             }
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
+                telemetry.push_action(body["session_id"], data)
 
             return output_to_send
 
@@ -227,16 +415,13 @@ def create_app(test_config={}):
                 "debug_index": body["debug_index"],
             }
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
+                telemetry.push_action(body["session_id"], data)
             device_name = body["device_name"]
             debug_index = int(body["debug_index"])
             num_wires = int(body["num_wires"])
             num_shots = int(body["num_shots"])
             debug_action = body["debug_action"]
-            (commands, _) = pickle.loads(bytes.fromhex(body["commands"]))
+            commands, _ = pickle.loads(bytes.fromhex(body["commands"]))
             found_new_debug_idx = False
             debug_lines = set()
             if len(body["data"]) != 0:
@@ -381,6 +566,32 @@ def create_app(test_config={}):
             )
         return jsonify({})
 
+    @app.route("/health", methods=["GET"])
+    def health():
+        """Report the state of the connections to the exec servers and
+            of the telemetry queue.
+
+        Returns:
+            JSON with exec client counters, the state of each exec server
+            and telemetry counters.
+        """
+        now = time.time()
+        nodes = {
+            url: {
+                "outstanding": node.outstanding,
+                "available": node.is_available(now),
+                "probe_latency": node.probe_latency,
+            }
+            for url, node in exec_backends.nodes.items()
+        }
+        return jsonify(
+            {
+                "exec_client": exec_client.stats(),
+                "exec_servers": nodes,
+                "telemetry": telemetry.stats(),
+            }
+        )
+
     @app.route("/auth/send", methods=["POST"])
     def send_login_user():
         """Send email to the user including the link for them to login
@@ -407,21 +618,20 @@ def create_app(test_config={}):
             token = "".join(random.choices(string.ascii_letters + string.digits, k=9))
 
             # save token to database for use in verify_user()
-            user = db_users.find_one({"email_address": email_address})
+            user = storage.find_user_by_email(email_address)
             if user is None:
                 # first login
-                db.users.insert_one(
+                storage.insert_user(
                     {
                         "email_address": email_address,
                         "token": token,
                         "activated": int(time.time()),
                         "expires": int(time.time()) + 86400,  # 24h
-                        "past_tokens": [],
-                        "sessions": [],
                     }
                 )
             else:
                 activated = user.get("activated", None)
+                past_token = None
                 if activated is not None:
                     if time.time() - activated < 5:
                         # user is spamming send button, do not generate token
@@ -432,21 +642,18 @@ def create_app(test_config={}):
                         "expires": user.get("expires", 0),
                         "deactivated": min(user.get("expires", 0), int(time.time())),
                     }
-                    db_users.update_one(
-                        {"email_address": email_address},  # filter
-                        {"$push": {"past_tokens": past_token}},  # update
-                    )
-                db_users.update_one(
-                    {"email_address": email_address},
-                    {
-                        "$set": {
-                            "token": token,
-                            "activated": int(time.time()),
-                            "expires": int(time.time()) + 86400,
-                        }
-                    },
+                token_cache.invalidate(user.get("token", ""))
+                storage.rotate_token(
+                    email_address,
+                    token,
+                    int(time.time()),
+                    int(time.time()) + 86400,
+                    past_token=past_token,
                 )
 
+            # the new token may have been cached as unknown before it was saved
+            token_cache.invalidate(token)
+
             # Because we do not use a mail client at the moment:
             print("Use link http://localhost:3000?" + token + " for " + email_address)
             return Response(status=204)
@@ -461,28 +668,7 @@ def create_app(test_config={}):
             Boolean: True if email address is in the list or from a domain in
             the list, False otherwise.
         """
-
-        allowEmail = False
-        with open("allowlist.txt") as file:
-            for line in file:
-                if "@" in line:
-                    if line.split("\n")[0] == email_address:
-                        allowEmail = True
-                        break
-                else:
-                    allow_domain = line.split("\n")[0].split(".")
-                    email_domain = email_address.split("@")[1].split(".")
-                    if len(email_domain) < len(allow_domain):
-                        continue
-                    correct = True
-                    for i in range(len(allow_domain)):
-                        if email_domain[-1 - i] != allow_domain[-1 - i]:
-                            correct = False
-                            break
-                    if correct:
-                        allowEmail = True
-                        break
-        return allowEmail
+        return allowlist.is_allowed(email_address)
 
     @app.route("/auth/verify", methods=["POST"])
     def verify_user():
@@ -527,13 +713,14 @@ def create_app(test_config={}):
                 "user_ip": request.remote_addr,
                 "user_token": body["token"],
                 "user_email": user["email_address"],
-                "actions": [{"api_call": "/dc/sessionEnter", "timestamp": body["timestamp"]}],
             }
             if body["policy_accepted"]:
-                db_sessions.insert_one(data)
-                db_users.update_one(
-                    {"token": body["token"]}, {"$push": {"sessions": body["session_id"]}}
+                telemetry.insert_session(data)
+                telemetry.push_action(
+                    body["session_id"],
+                    {"api_call": "/dc/sessionEnter", "timestamp": body["timestamp"]},
                 )
+                storage.add_user_session(body["token"], body["session_id"])
             return Response(status=204)
 
     @app.route("/dc/sessionExit", methods=["POST"])
@@ -554,10 +741,7 @@ def create_app(test_config={}):
                 return Response(status=401)
             data = {"api_call": "/dc/sessionExit", "timestamp": body["timestamp"]}
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
+                telemetry.push_action(body["session_id"], data)
             return Response(status=204)
 
     @app.route("/dc/enterRealTimeMode", methods=["POST"])
@@ -578,10 +762,7 @@ def create_app(test_config={}):
                 return Response(status=401)
             data = {"api_call": "/dc/enterRealTimeMode", "timestamp": body["timestamp"]}
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
+                telemetry.push_action(body["session_id"], data)
             return Response(status=204)
 
     @app.route("/dc/enterDebuggerMode", methods=["POST"])
@@ -602,10 +783,7 @@ def create_app(test_config={}):
                 return Response(status=401)
             data = {"api_call": "/dc/enterDebuggerMode", "timestamp": body["timestamp"]}
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
+                telemetry.push_action(body["session_id"], data)
             return Response(status=204)
 
     @app.route("/dc/displayCircuit", methods=["POST"])
@@ -633,10 +811,7 @@ def create_app(test_config={}):
 
             data = {"api_call": "/dc/displayCircuit", "timestamp": body["timestamp"], "function": f}
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
+                telemetry.push_action(body["session_id"], data)
             return Response(status=204)
 
     @app.route("/dc/displayFuncInfo", methods=["POST"])
@@ -667,10 +842,7 @@ def create_app(test_config={}):
                 "function": f,
             }
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
+                telemetry.push_action(body["session_id"], data)
             return Response(status=204)
 
     @app.route("/bugreport", methods=["POST"])
@@ -694,11 +866,8 @@ def create_app(test_config={}):
                 "user_email": body["user_email"],
             }
             if body["policy_accepted"]:
-                db_sessions.update_one(
-                    {"session_id": body["session_id"]},  # filter
-                    {"$push": {"actions": data}},  # update
-                )
-            db_bugs.insert_one(
+                telemetry.push_action(body["session_id"], data)
+            storage.insert_bug_report(
                 {
                     "token": body["token"],
                     "session_id": body["session_id"],
@@ -0,0 +1,261 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the restricted code checks done by the main server
+before user code is sent to the code execution server. The code is parsed
+and its syntax tree is checked in one pass for banned imports, banned
+built-in functions and attribute accesses that are used to get around the
+checks. The code is also compiled so that syntax errors are reported
+without a round-trip to the code execution server, and the cost of running
+it is estimated. The verdicts are cached by the hash of the code, so code
+that is sent again, e.g. by Real-Time Development, is not checked again.
+"""
+
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+from server import source
+from server.cost_estimate import estimate_cost
+
+BANNED_IMPORTS = {"lane", "json", "csv", "sys", "os", "urllib", "requests", "pathlib"}
+
+# name of a built-in function or attribute: error message
+BANNED_NAMES = {
+    "open": "Filesystem functionality such as open() is disabled. ",
+    "exec": "exec() function is disabled. ",
+    "eval": "eval() function is disabled. ",
+    "compile": "compile() function is disabled. ",
+    "breakpoint": "Other debuggers cannot be used inside CircInspect. ",
+    "__import__": "__import__() function is disabled. ",
+    "__builtins__": "Access to __builtins__ is disabled. ",
+    "globals": "globals() function is disabled. ",
+    # dynamic attribute access gets around the attribute checks, e.g.
+    # getattr(f, "__glo" + "bals__")
+    "getattr": "getattr() function is disabled. ",
+    "setattr": "setattr() function is disabled. ",
+    "delattr": "delattr() function is disabled. ",
+    "vars": "vars() function is disabled. ",
+}
+
+# attributes that give access to modules and functions that are not imported.
+# The banned built-in functions are also reachable through modules, e.g.
+# builtins.open or io.open. compile is left out since qml.compile is a
+# transform, and compiled code cannot be run without exec or eval.
+BANNED_ATTRIBUTES = {
+    **{k: v for k, v in BANNED_NAMES.items() if k != "compile"},
+    "__builtins__": "Access to __builtins__ is disabled. ",
+    "__globals__": "Access to __globals__ is disabled. ",
+    "__subclasses__": "Access to __subclasses__ is disabled. ",
+    "__bases__": "Access to __bases__ is disabled. ",
+    "__mro__": "Access to __mro__ is disabled. ",
+    "__code__": "Access to __code__ is disabled. ",
+    "__loader__": "Access to __loader__ is disabled. ",
+    "__dict__": "Access to __dict__ is disabled. ",
+}
+
+
+class RestrictedCodeVisitor(ast.NodeVisitor):
+    """Finds the first line of a syntax tree with restricted code
+
+    Attributes:
+        banned_imports: names of modules that cannot be imported
+        error: error message of the first restricted code, or None
+        line: line number of the first restricted code
+    """
+
+    def __init__(self, banned_imports=BANNED_IMPORTS):
+        self.banned_imports = banned_imports
+        self.error = None
+        self.line = None
+
+    def found(self, node, error):
+        """Record restricted code if it is before the restricted code found
+        so far."""
+        if self.line is None or node.lineno < self.line:
+            self.error = error
+            self.line = node.lineno
+
+    def check_module_names(self, node, names):
+        """Record a banned import if any part of the module names is banned."""
+        for name in names:
+            for part in name.split("."):
+                if part in self.banned_imports:
+                    self.found(node, "No module named: " + part)
+                    return
+
+    def visit_Import(self, node):
+        self.check_module_names(node, [alias.name for alias in node.names])
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        names = [alias.name for alias in node.names]
+        if node.module is not None:
+            names.append(node.module)
+        self.check_module_names(node, names)
+        # e.g. from builtins import open
+        for alias in node.names:
+            if alias.name in BANNED_NAMES:
+                self.found(node, BANNED_NAMES[alias.name])
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        # any use of the name is restricted, e.g. o = open; o("file")
+        if node.id in BANNED_NAMES:
+            self.found(node, BANNED_NAMES[node.id])
+
+    def visit_Attribute(self, node):
+        if node.attr in BANNED_ATTRIBUTES:
+            self.found(node, BANNED_ATTRIBUTES[node.attr])
+        self.generic_visit(node)
+
+
+def find_restricted_code_in_tree(tree, banned_imports=BANNED_IMPORTS):
+    """Find the first restricted code in a syntax tree.
+
+    Args:
+        tree (ast.Module): syntax tree of the code
+        banned_imports (set): names of modules that cannot be imported
+
+    Returns:
+        [error message, line number] of the first restricted code, or "" if
+        the code has no restricted code
+    """
+    visitor = RestrictedCodeVisitor(banned_imports)
+    visitor.visit(tree)
+    if visitor.error is None:
+        return ""
+    return [visitor.error, " line " + str(visitor.line)]
+
+
+def find_restricted_code(code, banned_imports=BANNED_IMPORTS):
+    """Checks if code has imports that are not allowed, uses functions such as
+        open, exec and eval, or accesses attributes that give access to them.
+
+    Code that cannot be parsed is not executed by the code execution server,
+    so it passes the check and its syntax error is reported by the server.
+
+    Args:
+        code (String): code
+        banned_imports (set): names of modules that cannot be imported
+
+    Returns:
+        [error message, line number] of the first restricted code, or "" if
+        the code has no restricted code
+    """
+    try:
+        # the code execution server removes newlines inside parentheses
+        tree = ast.parse(source.newline_cleanup(code))
+    except (SyntaxError, ValueError):
+        return ""
+    return find_restricted_code_in_tree(tree, banned_imports)
+
+
+def inspect_code(code, banned_imports=BANNED_IMPORTS):
+    """Compile code, check it for restricted code and estimate its cost
+        before it is sent to the code execution server.
+
+    Args:
+        code (String): code
+        banned_imports (set): names of modules that cannot be imported
+
+    Returns:
+        list, dict:
+            [error message, line number] of the syntax error or the first
+            restricted code in the same shape as the errors of the code
+            execution server, or "" if there is no error
+            cost estimate of the code (see server/cost_estimate.py), or None
+            if there is an error
+    """
+    try:
+        # the code execution server runs the code after removing newlines
+        # inside parentheses, which keeps the line numbers of statements
+        tree = ast.parse(source.newline_cleanup(code))
+        error = find_restricted_code_in_tree(tree, banned_imports)
+        if error != "":
+            return error, None
+        # errors such as return outside of a function are only found when
+        # the syntax tree is compiled
+        compile(tree, "<string>", "exec")
+        cost = estimate_cost(tree)
+    except SyntaxError as e:
+        line = " line " + str(e.lineno) if e.lineno is not None else "line unknown"
+        return [type(e).__name__ + ": " + str(e.msg), line], None
+    except (ValueError, OverflowError, MemoryError, RecursionError) as e:
+        # e.g. null bytes in the code or code that is nested too deeply
+        return [type(e).__name__ + ": " + str(e), "line unknown"], None
+    return "", cost
+
+
+class CodePolicy:
+    """Checks done on code before it is sent to the code execution server,
+    with the verdicts cached by the hash of the code
+
+    Attributes:
+        banned_imports: names of modules that cannot be imported
+        cache_size: maximum number of cached verdicts
+        num_checked: number of checks that parsed the code
+        num_cached: number of checks answered from the cache
+    """
+
+    def __init__(self, banned_imports=BANNED_IMPORTS, cache_size=10000):
+        self.banned_imports = banned_imports
+        self.cache_size = cache_size
+        self.num_checked = 0
+        self.num_cached = 0
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def inspect(self, code):
+        """Compile code, check it for restricted code and estimate its cost,
+        see inspect_code().
+
+        Args:
+            code (String): code
+
+        Returns:
+            list, dict:
+                [error message, line number] of the syntax error or the first
+                restricted code, or "" if there is no error
+                cost estimate of the code, or None if there is an error
+        """
+        code_hash = hashlib.sha256(code.encode("utf-8")).digest()
+        with self._lock:
+            verdict = self._verdicts.get(code_hash, None)
+            if verdict is not None:
+                self._verdicts.move_to_end(code_hash)
+                self.num_cached += 1
+        if verdict is None:
+            error, cost = inspect_code(code, self.banned_imports)
+            verdict = (tuple(error) if error != "" else "", cost)
+            with self._lock:
+                self.num_checked += 1
+                self._verdicts[code_hash] = verdict
+                if len(self._verdicts) > self.cache_size:
+                    self._verdicts.popitem(last=False)
+        error, cost = verdict
+        return (list(error) if error != "" else ""), (dict(cost) if cost is not None else None)
+
+    def check(self, code):
+        """Check code for syntax errors and restricted code.
+
+        Args:
+            code (String): code
+
+        Returns:
+            [error message, line number] of the syntax error or the first
+            restricted code, or "" if there is no error
+        """
+        return self.inspect(code)[0]
@@ -0,0 +1,270 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides a static estimate of how much work the code execution
+server does for user code, computed from the syntax tree of the code without
+running it. The estimate has:
+    wires: largest number of wires of a device created with qml.device()
+    operations: number of quantum operations (qml.<Name>(...) calls)
+    subroutine_calls: number of calls to functions defined in the code,
+        each of them is a node of the subroutine expansion tree
+Calls to functions defined in the code count the cost of their body, and the
+cost inside for loops and comprehensions is multiplied by the number of
+iterations when it can be computed from constants. Loops with an unknown
+number of iterations are counted once, so the estimate is a lower bound.
+Values are clamped to MAX_VALUE, which is over every cost limit, so the
+estimate takes bounded time and memory for any constants in the code.
+"""
+
+import ast
+
+# Largest value of constant expressions, iteration counts and costs. Larger
+# values are clamped to it and are over every cost limit.
+MAX_VALUE = 2**62
+
+
+def clamp(value):
+    """Clamp a value to [-MAX_VALUE, MAX_VALUE]."""
+    return max(-MAX_VALUE, min(MAX_VALUE, value))
+
+
+def get_range_length(start, stop, step):
+    """Get the number of items of range(start, stop, step) without creating
+    it, as len() of a range fails for lengths that do not fit in an index."""
+    if step > 0:
+        return max(0, (stop - start + step - 1) // step)
+    return max(0, (start - stop - step - 1) // -step)
+
+
+def get_call_name(node):
+    """Get the dotted name of the function called by a call node, e.g.
+    "qml.RX", or None if the function is not a name or attribute."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+def is_operation_call(name):
+    """Check if a call is a quantum operation such as qml.RX or
+    qml.templates.BasicEntanglerLayers. Measurements like qml.probs and
+    functions like qml.device are lowercase and not operations."""
+    if name is None or not name.startswith("qml."):
+        return False
+    return name.rsplit(".", 1)[1][:1].isupper()
+
+
+class CostEstimator:
+    """Estimates the cost of the code in a syntax tree
+
+    Attributes:
+        functions: function definitions of the code by name
+        constants: integer values of module level names assigned to constants
+    """
+
+    def __init__(self, tree):
+        self.functions = {}
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.functions.setdefault(node.name, node)
+        self.constants = {}
+        for node in tree.body:
+            if (
+                isinstance(node, ast.Assign)
+                and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+            ):
+                value = self.get_value(node.value)
+                if value is not None:
+                    self.constants[node.targets[0].id] = value
+        self._function_costs = {}
+        self._active = set()
+        self.tree = tree
+
+    def get_value(self, node):
+        """Get the integer value of a constant expression, or None."""
+        if isinstance(node, ast.Constant):
+            if type(node.value) is int:
+                return clamp(node.value)
+            return None
+        if isinstance(node, ast.Name):
+            return self.constants.get(node.id, None)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            value = self.get_value(node.operand)
+            return -value if value is not None else None
+        if isinstance(node, ast.BinOp):
+            left = self.get_value(node.left)
+            right = self.get_value(node.right)
+            if left is None or right is None:
+                return None
+            if isinstance(node.op, ast.Add):
+                return clamp(left + right)
+            if isinstance(node.op, ast.Sub):
+                return clamp(left - right)
+            if isinstance(node.op, ast.Mult):
+                return clamp(left * right)
+            if isinstance(node.op, ast.FloorDiv) and right != 0:
+                return left // right
+            if isinstance(node.op, ast.Pow) and right >= 0:
+                if abs(left) > 1 and (abs(left).bit_length() - 1) * right >= MAX_VALUE.bit_length():
+                    # the result is over MAX_VALUE, do not compute it
+                    return MAX_VALUE if left > 0 or right % 2 == 0 else -MAX_VALUE
+                return clamp(left**right)
+            return None
+        if isinstance(node, ast.Call) and get_call_name(node.func) == "len" and len(node.args) == 1:
+            if isinstance(node.args[0], (ast.List, ast.Tuple, ast.Set)):
+                return len(node.args[0].elts)
+        return None
+
+    def get_length(self, node):
+        """Get the number of items of an iterable such as range(10), a list
+        literal or a constant, or None if it is not known."""
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            return len(node.elts)
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return len(node.value)
+        if isinstance(node, ast.Call) and get_call_name(node.func) == "range":
+            args = [self.get_value(arg) for arg in node.args]
+            if 0 < len(args) <= 3 and None not in args and (len(args) < 3 or args[2] != 0):
+                if len(args) == 1:
+                    args = [0] + args
+                return clamp(get_range_length(args[0], args[1], args[2] if len(args) == 3 else 1))
+            return None
+        value = self.get_value(node)
+        if value is not None and value >= 0:
+            # wires=4 is the same as wires=range(4)
+            return value
+        return None
+
+    def get_wires(self):
+        """Get the largest number of wires of a device in the code."""
+        wires = 0
+        for node in ast.walk(self.tree):
+            if not (isinstance(node, ast.Call) and get_call_name(node.func) == "qml.device"):
+                continue
+            arg = None
+            for keyword in node.keywords:
+                if keyword.arg == "wires":
+                    arg = keyword.value
+            if arg is None and len(node.args) > 1:
+                arg = node.args[1]
+            if arg is not None:
+                wires = max(wires, self.get_length(arg) or 0)
+        return wires
+
+    def get_iterations(self, node):
+        """Get the number of iterations of a loop over an iterable, 1 if it
+        is not known."""
+        length = self.get_length(node)
+        return length if length is not None else 1
+
+    def get_function_cost(self, name):
+        """Get the operations and subroutine calls of a call to a function
+        defined in the code. Recursive calls are not counted."""
+        if name in self._function_costs:
+            return self._function_costs[name]
+        if name in self._active:
+            return 0, 0
+        self._active.add(name)
+        cost = self.get_body_cost(self.functions[name].body)
+        self._active.discard(name)
+        self._function_costs[name] = cost
+        return cost
+
+    def get_body_cost(self, nodes):
+        """Get the operations and subroutine calls of a list of nodes."""
+        operations, calls = 0, 0
+        for node in nodes:
+            node_operations, node_calls = self.get_cost(node)
+            operations = clamp(operations + node_operations)
+            calls = clamp(calls + node_calls)
+        return operations, calls
+
+    def get_cost(self, node):
+        """Get the operations and subroutine calls of a node.
+
+        Args:
+            node (ast.AST): node of the syntax tree
+
+        Returns:
+            Int, Int: number of operations and number of subroutine calls
+        """
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            # decorators and default arguments run once, the body runs when
+            # the function is called
+            if isinstance(node, ast.Lambda):
+                return 0, 0
+            return self.get_body_cost(node.decorator_list)
+        if isinstance(node, (ast.For, ast.AsyncFor)):
+            iterations = self.get_iterations(node.iter)
+            operations, calls = self.get_body_cost(node.body)
+            else_operations, else_calls = self.get_body_cost([node.iter] + node.orelse)
+            return (
+                clamp(iterations * operations + else_operations),
+                clamp(iterations * calls + else_calls),
+            )
+        if isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+            iterations = 1
+            for generator in node.generators:
+                iterations = clamp(iterations * self.get_iterations(generator.iter))
+            elements = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+            operations, calls = self.get_body_cost(elements)
+            return clamp(iterations * operations), clamp(iterations * calls)
+
+        operations, calls = self.get_body_cost(list(ast.iter_child_nodes(node)))
+        if isinstance(node, ast.Call):
+            name = get_call_name(node.func)
+            if is_operation_call(name):
+                operations += 1
+            elif name in self.functions:
+                function_operations, function_calls = self.get_function_cost(name)
+                operations = clamp(operations + function_operations)
+                calls = clamp(calls + 1 + function_calls)
+        return operations, calls
+
+
+def estimate_cost(tree):
+    """Estimate how much work the code execution server does for code.
+
+    Args:
+        tree (ast.Module): syntax tree of the code
+
+    Returns:
+        Dict: wires, operations and subroutine_calls, see the module docstring
+    """
+    estimator = CostEstimator(tree)
+    operations, calls = estimator.get_body_cost(tree.body)
+    return {"wires": estimator.get_wires(), "operations": operations, "subroutine_calls": calls}
+
+
+def find_exceeded_limit(cost, limits):
+    """Find a part of a cost estimate that is over its limit.
+
+    Args:
+        cost (dict): cost estimate from estimate_cost()
+        limits (dict): maximum value of each part of the estimate, parts
+            that are not in the dict have no limit
+
+    Returns:
+        String: name of the first part over its limit, or None
+    """
+    for name, limit in limits.items():
+        if cost.get(name, 0) > limit:
+            return name
+    return None
@@ -0,0 +1,188 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the registry of code execution servers used by the
+main server. Requests are sent to the node with the least outstanding
+requests, nodes that fail or respond slowly to health probes are ejected
+for a while, and debug sessions can optionally stick to a single node.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from server.exec_client import ExecClient
+
+# Number of session to node mappings remembered for session affinity
+MAX_AFFINITY_ENTRIES = 10000
+
+
+class ExecNode:
+    """A code execution server that the main server can send code to
+
+    Attributes:
+        url: base URL of the execution server
+        outstanding: number of requests sent to the node without a response yet
+        ejected_until: unix time until which the node does not get new requests
+        probe_latency: time it took the last health probe to respond in seconds
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.ejected_until = 0
+        self.probe_latency = 0
+
+    def is_available(self, now):
+        """Check that the node is not ejected at the given time."""
+        return self.ejected_until <= now
+
+
+class ExecBackendRegistry:
+    """Registry of execution servers with least outstanding requests balancing
+
+    Attributes:
+        nodes: dict of URL to ExecNode
+        session_affinity: if True, requests with the same session id are sent
+            to the same node while it stays available
+        eject_time: seconds a failing or slow node is ejected for
+        slow_threshold: seconds after which a health probe counts as failed
+        client: ExecClient used for health probes
+    """
+
+    def __init__(
+        self, urls, session_affinity=False, eject_time=30, slow_threshold=1.0, client=None
+    ):
+        self.nodes = {}
+        self.session_affinity = session_affinity
+        self.eject_time = eject_time
+        self.slow_threshold = slow_threshold
+        self.client = client if client is not None else ExecClient()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        for url in urls:
+            self.register(url)
+
+    def register(self, url):
+        """Add an execution server to the registry.
+
+        Args:
+            url (string): base URL of the execution server
+        """
+        with self._lock:
+            self.nodes.setdefault(url, ExecNode(url))
+
+    def unregister(self, url):
+        """Remove an execution server from the registry.
+
+        Args:
+            url (string): base URL of the execution server
+        """
+        with self._lock:
+            self.nodes.pop(url, None)
+
+    def choose(self, session_id=None):
+        """Pick the node for a new request and count the request as outstanding.
+            If every node is ejected, the least loaded ejected node is used
+            so that requests still have a chance to succeed.
+
+        Args:
+            session_id (string): session id of the user, used for session affinity
+
+        Returns:
+            ExecNode: node that should run the request
+        """
+        now = time.time()
+        with self._lock:
+            node = None
+            if self.session_affinity and session_id is not None:
+                node = self.nodes.get(self._sessions.get(session_id, None), None)
+                if node is not None and not node.is_available(now):
+                    node = None
+            if node is None:
+                candidates = [n for n in self.nodes.values() if n.is_available(now)]
+                if len(candidates) == 0:
+                    candidates = list(self.nodes.values())
+                node = min(candidates, key=lambda n: n.outstanding)
+            if self.session_affinity and session_id is not None:
+                self._sessions[session_id] = node.url
+                self._sessions.move_to_end(session_id)
+                if len(self._sessions) > MAX_AFFINITY_ENTRIES:
+                    self._sessions.popitem(last=False)
+            node.outstanding += 1
+            return node
+
+    def release(self, node):
+        """Count a request sent by choose() as finished.
+
+        Args:
+            node (ExecNode): node returned by choose()
+        """
+        with self._lock:
+            node.outstanding -= 1
+
+    def eject(self, node):
+        """Stop sending new requests to the node for eject_time seconds.
+
+        Args:
+            node (ExecNode): node that failed
+        """
+        with self._lock:
+            node.ejected_until = time.time() + self.eject_time
+
+    @contextmanager
+    def node_for(self, session_id=None):
+        """Context manager around choose() and release().
+
+        Args:
+            session_id (string): session id of the user
+
+        Yields:
+            ExecNode: node that should run the request
+        """
+        node = self.choose(session_id)
+        try:
+            yield node
+        finally:
+            self.release(node)
+
+    def probe(self):
+        """Send a health probe to every node. Nodes that do not respond
+        within slow_threshold are ejected and nodes that respond are put
+        back into rotation.
+        """
+        for node in list(self.nodes.values()):
+            start_time = time.time()
+            healthy = self.client.health(node.url, self.slow_threshold)
+            node.probe_latency = time.time() - start_time
+            if healthy:
+                with self._lock:
+                    node.ejected_until = 0
+            else:
+                self.eject(node)
+
+    def start_health_checks(self, interval):
+        """Probe the nodes every interval seconds in a background thread.
+
+        Args:
+            interval (float): seconds between two rounds of health probes
+        """
+
+        def run():
+            while True:
+                self.probe()
+                time.sleep(interval)
+
+        threading.Thread(target=run, daemon=True).start()
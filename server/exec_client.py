@@ -0,0 +1,291 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the HTTP client used by the main server to talk to the
+code execution servers. Connections are pooled and kept alive between
+requests, every request has connect and read timeouts, failed connections
+are retried a bounded number of times and a circuit breaker for each
+execution server stops sending requests to it for a while when it keeps
+failing. A full queue (429) is not a failure, as the execution server
+rejects requests of one priority class while it still accepts the others.
+
+Execution servers on the same machine can also be reached over a Unix domain
+socket by using a "unix://<socket path>" URL, in which case requests are sent
+as binary frames (see server/frames.py) instead of JSON over HTTP.
+"""
+
+import socket
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from server import frames
+
+
+class CircuitOpen(Exception):
+    """Raised instead of sending a request while the circuit breaker is open.
+
+    Attributes:
+        retry_after: number of seconds until requests are allowed again
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Code execution servers are unavailable")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """State of the circuit breaker of one exec server
+
+    Attributes:
+        consecutive_failures: number of failures since the last success
+        open_until: time until which requests are not sent, 0 if the
+            circuit is closed
+    """
+
+    def __init__(self):
+        self.consecutive_failures = 0
+        self.open_until = 0
+
+
+class SocketResponse:
+    """Response received over a Unix domain socket. It has the parts of
+    requests.Response that the main server uses.
+
+    Attributes:
+        status_code: HTTP status code set by the exec server
+        headers: dict of response headers
+    """
+
+    def __init__(self, message):
+        self.status_code = message["status"]
+        self.headers = message.get("headers", None) or {}
+        self._body = message.get("body", None)
+
+    def json(self):
+        """Return the decoded body of the response."""
+        return self._body
+
+
+class ExecClient:
+    """Pooled HTTP client with a circuit breaker for each exec server
+
+    Attributes:
+        session: requests session that keeps connections alive
+        timeout: tuple of connect and read timeouts in seconds
+        failure_threshold: consecutive failures of an exec server that open
+            its circuit
+        reset_timeout: seconds the circuit stays open before a trial request
+        num_requests: number of requests sent
+        num_failures: number of requests that failed to connect, timed out or
+            were rejected by an unavailable exec server (503)
+        num_rejected: number of requests not sent because the circuit was open
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        connect_timeout=1.0,
+        read_timeout=25.0,
+        retries=2,
+        failure_threshold=5,
+        reset_timeout=10,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.num_requests = 0
+        self.num_failures = 0
+        self.num_rejected = 0
+        self.pool_size = pool_size
+        self.retries = retries
+        self.num_socket_connections = 0
+        self.num_socket_requests = 0
+        self._idle_sockets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+        # Connection errors are always safe to retry since the request never
+        # reached the exec server. Read errors are only retried for GET
+        # requests because running user code again is expensive.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=0,
+            allowed_methods=frozenset(["GET"]),
+            backoff_factor=0.1,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, url, json):
+        """Send a POST request to an exec server through the circuit breaker.
+
+        Args:
+            url (string): URL of the exec server
+            json (dict): body of the request
+
+        Returns:
+            requests.Response of the exec server
+
+        Raises:
+            CircuitOpen: if the circuit is open and the request was not sent
+            requests.RequestException: if the request failed
+        """
+        with self._lock:
+            breaker = self._breakers.setdefault(url, CircuitBreaker())
+            now = time.time()
+            if breaker.open_until > now:
+                self.num_rejected += 1
+                raise CircuitOpen(max(1, int(breaker.open_until - now)))
+            if breaker.open_until != 0:
+                # half open: let this request through as a trial and keep
+                # the circuit open for the others until it finishes
+                breaker.open_until = now + self.reset_timeout
+            self.num_requests += 1
+        try:
+            if url.startswith("unix://"):
+                res = self._socket_request(url, {"path": "/", "body": json}, self.timeout[1])
+            else:
+                res = self.session.post(url, json=json, timeout=self.timeout)
+        except requests.RequestException:
+            self._record(breaker, False)
+            raise
+        # a full queue of one priority class (429) means that the exec server
+        # is working, only an unavailable exec server (503) is a failure
+        self._record(breaker, res.status_code != 503)
+        return res
+
+    def health(self, url, timeout):
+        """Send a health probe to an exec server.
+
+        Args:
+            url (string): URL of the exec server
+            timeout (float): seconds to wait for the answer
+
+        Returns:
+            Boolean: True if the exec server answered the probe in time
+        """
+        try:
+            if url.startswith("unix://"):
+                res = self._socket_request(url, {"path": "/health"}, timeout)
+            else:
+                res = self.session.get(url + "/health", timeout=timeout)
+        except requests.RequestException:
+            return False
+        return res.status_code == 200
+
+    def _connect(self, path):
+        """Open a new connection to a Unix domain socket, retrying failed
+        connections up to self.retries times.
+        """
+        for attempt in range(self.retries + 1):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout[0])
+            try:
+                sock.connect(path)
+                with self._lock:
+                    self.num_socket_connections += 1
+                return sock
+            except OSError as e:
+                sock.close()
+                if attempt == self.retries:
+                    raise requests.ConnectionError(e)
+                time.sleep(0.1 * 2**attempt)
+
+    def _socket_request(self, url, message, timeout):
+        """Send a message to an exec server over a Unix domain socket and
+            wait for the response. Idle connections are kept open and reused.
+
+        Args:
+            url (string): "unix://" followed by the path of the socket
+            message (dict): request with the path and the body
+            timeout (float): seconds to wait for the response
+
+        Returns:
+            SocketResponse: response of the exec server
+        """
+        path = url[len("unix://") :]
+        with self._lock:
+            idle = self._idle_sockets.setdefault(path, [])
+            sock = idle.pop() if len(idle) > 0 else None
+            self.num_socket_requests += 1
+        reused = sock is not None
+        if sock is None:
+            sock = self._connect(path)
+        try:
+            sock.settimeout(timeout)
+            frames.send_frame(sock, message)
+            res = SocketResponse(frames.recv_frame(sock))
+        except socket.timeout as e:
+            sock.close()
+            raise requests.ReadTimeout(e)
+        except (EOFError, OSError) as e:
+            sock.close()
+            if reused:
+                # the exec server closed the idle connection, e.g. after a
+                # restart, so the request never ran and can be sent again
+                return self._socket_request(url, message, timeout)
+            raise requests.ConnectionError(e)
+        with self._lock:
+            if len(idle) < self.pool_size:
+                idle.append(sock)
+                sock = None
+        if sock is not None:
+            sock.close()
+        return res
+
+    def _record(self, breaker, success):
+        """Update the circuit breaker of an exec server with the result of a
+        request."""
+        with self._lock:
+            if success:
+                breaker.consecutive_failures = 0
+                breaker.open_until = 0
+                return
+            self.num_failures += 1
+            breaker.consecutive_failures += 1
+            if breaker.consecutive_failures >= self.failure_threshold:
+                breaker.open_until = time.time() + self.reset_timeout
+
+    def stats(self):
+        """Get counters for the client and its connection pools.
+
+        Returns:
+            Dict: request counters, whether the circuit of any exec server
+            is open, number of connections opened and the number of requests
+            that reused an open connection
+        """
+        num_connections = self.num_socket_connections
+        num_pool_requests = self.num_socket_requests
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                num_connections += pool.num_connections
+                num_pool_requests += pool.num_requests
+        return {
+            "requests": self.num_requests,
+            "failures": self.num_failures,
+            "rejected": self.num_rejected,
+            "circuit_open": any(b.open_until > time.time() for b in self._breakers.values()),
+            "connections_opened": num_connections,
+            "connections_reused": num_pool_requests - num_connections,
+        }
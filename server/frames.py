@@ -0,0 +1,165 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the length-prefixed binary frames used between the main
+server and the execution server when they talk over a Unix domain socket, and
+between the execution server and its code execution processes.
+
+A frame is made of a JSON header followed by raw binary blobs:
+    [header length: 4 bytes][blob count: 4 bytes][header JSON]
+    [blob 0 length: 4 bytes][blob 0 bytes] ... [blob n length][blob n bytes]
+Any bytes value in the message (e.g. an image) is sent as a blob instead of
+being base64 encoded inside the JSON, and is replaced in the header by a
+{"__blob__": index} placeholder.
+"""
+
+import json
+import struct
+from server import helpers
+
+_HEADER = struct.Struct("!II")
+_LENGTH = struct.Struct("!I")
+
+
+def encode_frame(message):
+    """Encode a message as a binary frame.
+
+    Args:
+        message: JSON serializable object that may contain bytes values
+
+    Returns:
+        List[bytes]: parts of the frame, to be written to a socket in order
+    """
+    blobs = []
+
+    def extract_blobs(o):
+        if isinstance(o, (bytes, bytearray, memoryview)):
+            blobs.append(o)
+            return {"__blob__": len(blobs) - 1}
+        if isinstance(o, dict):
+            return {k: extract_blobs(v) for k, v in o.items()}
+        if isinstance(o, (list, tuple)):
+            return [extract_blobs(v) for v in o]
+        return o
+
+    header = json.dumps(extract_blobs(message), default=helpers.json_default).encode("utf-8")
+    parts = [_HEADER.pack(len(header), len(blobs)), header]
+    for blob in blobs:
+        parts.append(_LENGTH.pack(len(blob)))
+        parts.append(blob)
+    return parts
+
+
+def send_frame(sock, message):
+    """Write a message to a socket as a single frame.
+
+    Args:
+        sock (socket.socket): connected socket
+        message: JSON serializable object that may contain bytes values
+    """
+    for part in encode_frame(message):
+        sock.sendall(part)
+
+
+def recv_exact(sock, n):
+    """Read exactly n bytes from a socket.
+
+    Args:
+        sock (socket.socket): connected socket
+        n (int): number of bytes to read
+
+    Returns:
+        bytearray of length n
+
+    Raises:
+        EOFError: if the connection is closed before n bytes are read
+    """
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    read = 0
+    while read < n:
+        count = sock.recv_into(view[read:], n - read)
+        if count == 0:
+            raise EOFError("Connection closed while reading a frame")
+        read += count
+    return buffer
+
+
+def decode_frame(read):
+    """Decode a frame from a source of bytes.
+
+    Args:
+        read (function): function that returns the next n bytes of the frame
+
+    Returns:
+        The decoded message, with blobs as bytes values
+    """
+    header_length, blob_count = _HEADER.unpack(read(_HEADER.size))
+    header = read(header_length)
+    blobs = []
+    for _ in range(blob_count):
+        (blob_length,) = _LENGTH.unpack(read(_LENGTH.size))
+        blobs.append(bytes(read(blob_length)))
+
+    def insert_blobs(o):
+        if len(o) == 1 and "__blob__" in o:
+            return blobs[o["__blob__"]]
+        return o
+
+    return json.loads(bytes(header), object_hook=insert_blobs)
+
+
+def recv_frame(sock):
+    """Read a single frame from a socket and decode it.
+
+    Args:
+        sock (socket.socket): connected socket
+
+    Returns:
+        The decoded message, with blobs as bytes values
+    """
+    return decode_frame(lambda n: recv_exact(sock, n))
+
+
+def dumps(message):
+    """Encode a message as a single bytes object.
+
+    Args:
+        message: JSON serializable object that may contain bytes values
+
+    Returns:
+        bytes of the frame
+    """
+    return b"".join(encode_frame(message))
+
+
+def loads(data):
+    """Decode a frame created by dumps().
+
+    Args:
+        data (bytes): bytes of the frame
+
+    Returns:
+        The decoded message, with blobs as bytes values
+    """
+    view = memoryview(data)
+    position = 0
+
+    def read(n):
+        nonlocal position
+        position += n
+        return view[position - n : position]
+
+    return decode_frame(read)
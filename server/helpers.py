@@ -21,17 +21,39 @@ import numpy as np
 from matplotlib import pyplot as plt
 import base64
 import io
-from collections import deque
 from flask import Flask, render_template, request, jsonify
 from server.magically_trace_stack import MagicallyTraceStack
+from server import source
+from server import code_policy
 
-import re
-import tokenize
 from server.command import Command
 import time
 import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from flask.json.provider import _default as _json_default
 
+# Number of idle devices kept in the device pool of the process, see
+# checkout_device()
+DEVICE_POOL_SIZE = 16
+
+# (device name, number of wires, number of shots): idle devices, least
+# recently used first
+_device_pool = OrderedDict()
+_device_pool_lock = threading.Lock()
+
+
+def _reset_device_pool_lock():
+    """Replace the lock of the device pool in a forked process."""
+    global _device_pool_lock
+    _device_pool_lock = threading.Lock()
+
+
+# a process can be forked while another thread holds the lock
+os.register_at_fork(after_in_child=_reset_device_pool_lock)
+
 
 def json_default(o):
     """JSON encoder for Python objects that cannot be jsonified
@@ -55,34 +77,12 @@ def check_for_restricted_code(code):
 
     Args:
         code (String): code
-    """
-
-    banned_imports = {"lane", "json", "csv", "sys", "os", "urllib", "requests", "pathlib"}
-
-    lines = code.split("\n")
-    i = 0
-    for line in lines:
-        i += 1
-        ls = re.split(r"[ ,.:=(]+", line)
-        # stop banned imports
-        if "import" in ls:
-            for b in banned_imports:
-                if b in ls:
-                    return ["No module named: " + b, " line " + str(i)]
-
-        # stop open, exec, eval
-        if "open" in ls:
-            return ["Filesystem functionality such as open() is disabled. ", " line " + str(i)]
-
-        if "exec" in ls:
-            return ["exec() function is disabled. ", " line " + str(i)]
-
-        if "eval" in ls:
-            return ["eval() function is disabled. ", " line " + str(i)]
 
-        if "breakpoint" in ls:
-            return ["Other debuggers cannot be used inside CircInspect. ", " line " + str(i)]
-    return ""
+    Returns:
+        [error message, line number] of the first restricted code, or "" if
+        the code has no restricted code
+    """
+    return code_policy.find_restricted_code(code)
 
 
 def get_method_names(code):
@@ -94,13 +94,7 @@ def get_method_names(code):
     Returns:
         Array[string]: Names of methods in the code.
     """
-    code_arr = code.split("\n")
-    method_names = set()
-    for line in code_arr:
-        if "def " in line:
-            fcn_name = line.split(" ")[1].split("(")[0]
-            method_names.add(fcn_name)
-    return method_names
+    return source.get_method_names(code.split("\n"))
 
 
 def find_first_qnode_decorator(tokens):
@@ -109,18 +103,13 @@ def find_first_qnode_decorator(tokens):
         in regular operation.
 
     Args:
-        code (string): the code sent by the frontend
+        tokens: tokens of the code sent by the frontend
 
     Returns:
         index (line number - 1) of the first qnode, if a qnode is found.
         -1, if no qnode decorator is found.
     """
-    qnode_tokens = list(
-        filter(lambda t: t.type == 54 and t.string == "@" and "@qml.qnode" in t.line, tokens)
-    )
-    if len(qnode_tokens) == 0:
-        return -1
-    return qnode_tokens[0].start[0] - 1
+    return source.find_first_qnode_decorator(tokens)
 
 
 def comment_out_transforms(code):
@@ -132,31 +121,8 @@ def comment_out_transforms(code):
     Returns:
         String: The code updated with transforms commented out
     """
-
-    tokens = tokenize.tokenize(io.BytesIO(code.encode("utf-8")).readline)
-    idx = find_first_qnode_decorator(tokens)
-    code_arr = code.split("\n")
-
-    j = idx - 1
-    while j >= 0:
-        if len(code_arr[j]) == 0 or code_arr[j][0] == "#":
-            j -= 1
-        elif "@" == code_arr[j][0]:
-            code_arr[j] = "#" + code_arr[j]
-            j -= 1
-        else:
-            break
-    k = idx + 1
-    while k < len(code_arr):
-        if len(code_arr[k]) == 0 or code_arr[k][0] == "#":
-            k += 1
-        elif "@" == code_arr[k][0]:
-            code_arr[k] = "#" + code_arr[k]
-            k += 1
-        else:
-            break
-
-    return "\n".join(code_arr)
+    idx = source.find_first_qnode_decorator(source.tokenize_code(code))
+    return "\n".join(source.comment_out_transforms(code.split("\n"), idx))
 
 
 def get_transform_details(code, starting_idx):
@@ -172,43 +138,10 @@ def get_transform_details(code, starting_idx):
         Array[[string, int]]: Array of arrays of transform name and
         line number on which its applied
     """
-    transforms_details = deque([])
-    code_arr = code.split("\n")
-    tokens = list(tokenize.tokenize(io.BytesIO(code.encode("utf-8")).readline))
-    idx = find_first_qnode_decorator(tokens)
-
-    # find possible transform decorators (type is OP, string is @ and
-    # not a qnode) from tokens and get a list of their line numbers
-    possible_transforms = list(
-        map(
-            lambda t: t.start[0] - 1,
-            filter(
-                lambda t: t.type == 54 and t.string == "@" and "@qml.qnode(" not in t.line, tokens
-            ),
-        )
-    )
-
-    j = idx - 1
-    while j >= 0:
-        if len(code_arr[j]) == 0 or code_arr[j][0] == "#":
-            j -= 1
-        elif j in possible_transforms:
-            transforms_details.appendleft([code_arr[j], j + 1])
-            j -= 1
-        else:
-            break
-
-    k = idx + 1
-    while k < len(code_arr):
-        if len(code_arr[k]) == 0 or code_arr[k][0] == "#":
-            k += 1
-        if k in possible_transforms:
-            transforms_details.append([code_arr[k], k + 1])
-            k += 1
-        else:
-            break
-
-    return transforms_details
+    tokens = source.tokenize_code(code)
+    idx = source.find_first_qnode_decorator(tokens)
+    possible_transforms = source.find_transform_decorators(tokens)
+    return source.get_transform_details(code.split("\n"), idx, possible_transforms)
 
 
 def get_num_shots(info):
@@ -291,14 +224,14 @@ def get_list_of_commands(info, method_names, code, annotated_queue):
     Args:
         info(list): List of lists of information in stack
         method_names(list): List of method names
-        code(string): Code string
+        code(string): Code string or list of its lines
         annotated_queue: pennylane queue
 
     Returns:
         list(command): List of command objects
     """
     commands = []
-    code_arr = code.split("\n")
+    code_arr = code.split("\n") if type(code) is str else code
 
     for i in range(len(info)):
         ith_info = info[i]
@@ -353,6 +286,9 @@ def get_list_of_commands(info, method_names, code, annotated_queue):
         ) or "pennylane.measurements.mid" in str(type(annotated_queue[i])):
             break
         commands[-1].code_line.append(annotated_queue[i])
+    # the measurements are collected from the end, they are replayed in the
+    # order of the return statement
+    commands[-1].code_line.reverse()
     update_identifier_numbers(commands)
     update_identifier_its_called_from(commands)
 
@@ -443,6 +379,117 @@ def get_commands_to_execute_for_identifier(commands, identifier):
     return commands_called_from_identifier
 
 
+def create_device(device_name, num_wires, num_shots):
+    """Create a device for drawing and simulating captured operations.
+
+    Args:
+        device_name(string): Device name
+        num_wires(int): Number of wires in quantum circuit, 0 for a device
+            without a fixed number of wires
+        num_shots(int): Number of shots, 0 for analytic results
+
+    Returns:
+        Device
+    """
+    kwargs = {}
+    if num_wires != 0:
+        kwargs["wires"] = num_wires
+    if num_shots != 0:
+        kwargs["shots"] = num_shots
+    return qml.device(device_name, **kwargs)
+
+
+def return_device(key, dev):
+    """Put a device that is not used anymore in the device pool, and remove
+    the least recently used devices if the pool is full."""
+    with _device_pool_lock:
+        _device_pool.setdefault(key, []).append(dev)
+        _device_pool.move_to_end(key)
+        num_idle = sum(len(devices) for devices in _device_pool.values())
+        while num_idle > DEVICE_POOL_SIZE:
+            oldest = next(iter(_device_pool))
+            _device_pool[oldest].pop(0)
+            if len(_device_pool[oldest]) == 0:
+                del _device_pool[oldest]
+            num_idle -= 1
+
+
+@contextmanager
+def checkout_device(device_name, num_wires, num_shots):
+    """Take a device for drawing and simulating captured operations from the
+        device pool of the process, and put it back when it is not used
+        anymore. Devices are reused by all threads and requests for the same
+        device name, number of wires and shots, and a device is only used by
+        one of them at a time. Devices that keep a state between executions
+        are reset before they are reused.
+
+    Args:
+        device_name(string): Device name
+        num_wires(int): Number of wires in quantum circuit, 0 for a device
+            without a fixed number of wires
+        num_shots(int): Number of shots, 0 for analytic results
+
+    Yields:
+        Device
+    """
+    key = (device_name, num_wires, num_shots)
+    dev = None
+    with _device_pool_lock:
+        if len(_device_pool.get(key, [])) > 0:
+            dev = _device_pool[key].pop()
+    if dev is None:
+        dev = create_device(device_name, num_wires, num_shots)
+    elif hasattr(dev, "reset"):
+        dev.reset()
+    try:
+        yield dev
+    finally:
+        return_device(key, dev)
+
+
+def add_device_to_pool(device_name, num_wires, num_shots):
+    """Create an idle device in the device pool if it has none for the
+        device name, number of wires and shots, e.g. in the code execution
+        server so that the processes it forks for later requests find it.
+
+    Args:
+        device_name(string): Device name
+        num_wires(int): Number of wires in quantum circuit
+        num_shots(int): Number of shots
+    """
+    key = (device_name, num_wires, num_shots)
+    with _device_pool_lock:
+        if len(_device_pool.get(key, [])) > 0:
+            return
+    return_device(key, create_device(device_name, num_wires, num_shots))
+
+
+class SubroutineOp(qml.operation.Operation):
+    """Box for a call to a subroutine in circuit drawings, labelled with the
+    name of the subroutine. The same class is used for every subroutine, so
+    drawing a circuit does not create a class for each call.
+
+    Args:
+        wires: wires used by the operations of the subroutine
+        function (string): name of the subroutine
+    """
+
+    num_wires = qml.operation.AnyWires
+    grad_method = "A"
+
+    def __init__(self, wires, function, id=None):
+        self._hyperparameters = {"function": function}
+        super().__init__(wires=qml.wires.Wires(wires), id=id)
+        self._name = function
+
+    def label(self, decimals=None, base_label=None, cache=None):
+        return super().label(decimals, base_label or self._name, cache)
+
+    @staticmethod
+    def compute_decomposition(wires, function):
+        return [qml.QubitUnitary(np.eye(2 ** len(wires)), wires=wires)]
+
+
 def draw_circuit(
     commands, device_name, num_wires, num_shots, last_command, all_commands, real_time=True
 ):
@@ -459,14 +506,23 @@ def draw_circuit(
         Circuit Image
     """
 
-    if num_shots != 0 and num_wires != 0:
-        dev = qml.device(device_name, wires=num_wires, shots=num_shots)
-    elif num_wires != 0:
-        dev = qml.device(device_name, wires=num_wires)
-    elif num_shots != 0:
-        dev = qml.device(device_name, shots=num_shots)
-    else:
-        dev = qml.device(device_name)
+    with checkout_device(device_name, num_wires, num_shots) as dev:
+        return draw_commands(dev, commands, num_wires, last_command, all_commands)
+
+
+def draw_commands(dev, commands, num_wires, last_command, all_commands):
+    """Draw circuit of list of commands on a device, see draw_circuit()
+
+    Args:
+        dev(Device): Device
+        commands(list): List of command objects
+        num_wires(int): Number of wires in quantum circuit
+        last_command(pennylane operation): Last command for circuit
+        all_commands(list): List of all command objects
+
+    Returns:
+        Circuit Image
+    """
 
     @qml.qnode(dev)
     def circuit():
@@ -485,24 +541,9 @@ def draw_circuit(
                 set_command_wires = list(set_command_wires)
                 set_command_wires.sort()
 
-                class Func(qml.operation.Operation):
-                    num_wires = qml.operation.AnyWires
-                    grad_method = "A"
-
-                    def __init__(self, wires, op_name, id=None):
-                        self.__class__.__name__ = op_name
-                        all_wires = qml.wires.Wires(wires)
-                        super().__init__(wires=all_wires, id=id)
-
-                    @staticmethod
-                    def compute_decomposition(wires):
-                        op_list = []
-                        op_list.append(qml.QubitUnitary(np.eye(len(wires)), wires=wires))
-                        return op_list
-
                 if len(set_command_wires) == 0:
                     set_command_wires = range(num_wires)
-                Func(wires=set_command_wires, op_name=command.function)
+                SubroutineOp(wires=set_command_wires, function=command.function)
 
             # Measurements are a list even if there is a single measurement.
             # So, second part of this conditional stops measurements from
@@ -514,26 +555,63 @@ def draw_circuit(
     return qml.draw_mpl(circuit, decimals=2)()[0]
 
 
-def get_image_bs64_bytecode(img):
-    """Return the base 64 image bytecode
+def get_image_png_bytes(img):
+    """Return the image as PNG file bytes
 
     Args:
         img(image): Image
 
     Returns:
-        base64bytecode: The base 64 byte code of image
+        bytes: The PNG encoding of the image
     """
-    base_64_byte_code = ""
     plt.ioff()
     with io.BytesIO() as buffer:  # use buffer memory
         img.savefig(buffer, format="png")
-        buffer.seek(0)
-        buffer_val = buffer.getvalue()
+        return buffer.getvalue()
+
+
+def get_image_bs64_bytecode(img):
+    """Return the base 64 image bytecode
+
+    Args:
+        img(image): Image
+
+    Returns:
+        base64bytecode: The base 64 byte code of image
+    """
+    return base64.b64encode(get_image_png_bytes(img)).decode("ascii")
 
-        img_bytecode = base64.b64encode(buffer_val)
-        base_64_byte_code = str(img_bytecode)[2:-1]
 
-    return base_64_byte_code
+def encode_binary_fields(output):
+    """Encode the raw bytes in the execution server output as text so that
+        the output can be sent to the frontend as JSON. Pickled commands are
+        hex encoded and images (any other bytes) are base 64 encoded.
+        Fields that are already encoded are left as they are.
+
+    Args:
+        output(dict): Output of the execution server
+
+    Returns:
+        dict: The output with text instead of bytes
+    """
+
+    def encode(o):
+        if isinstance(o, bytes):
+            return base64.b64encode(o).decode("ascii")
+        if isinstance(o, dict):
+            return {k: encode(v) for k, v in o.items()}
+        if isinstance(o, list):
+            return [encode(v) for v in o]
+        return o
+
+    output = dict(output)
+    commands = output.pop("commands", None)
+    output = encode(output)
+    if isinstance(commands, bytes):
+        commands = commands.hex()
+    if commands is not None:
+        output["commands"] = commands
+    return output
 
 
 def get_fcn_output(commands, device_name, num_wires, num_shots, last_command):
@@ -549,73 +627,34 @@ def get_fcn_output(commands, device_name, num_wires, num_shots, last_command):
     Returns:
         Output for circuit
     """
-    dev = qml.device(device_name, wires=num_wires)
-    if num_shots != 0:
-        dev = qml.device(device_name, wires=num_wires, shots=num_shots)
-
-    @qml.qnode(dev)
-    def circuit():
-        for c in commands:
-            if c.quantum_or_classical == "quantum":
-                qml.apply(c.code_line)
-        return [qml.apply(i) for i in last_command.code_line]
-
-    exec_time = time.time()
-    output = circuit()
+    with checkout_device(device_name, num_wires, num_shots) as dev:
+        circuit = get_qnode(commands, last_command, dev)
+        exec_time = time.time()
+        output = circuit()
     return output, time.time() - exec_time
 
 
-def get_function_output(fcn, code_received):
-    """Get function output result
+def get_qnode(commands, last_command, dev):
+    """Return a qnode that applies the quantum operations of the commands
+    captured from the main function, without running user code
 
     Args:
-        fcn (Command): Function we would like to evaluate
-        code_received: The code
+        commands(list): List of command objects
+        last_command(pennylane operation): Last command for circuit
+        dev(Device): Device of the qnode, e.g. from checkout_device()
 
     Returns:
-        The evaluation of the the function circuit
-
+        QNode of the circuit
     """
-    fcn_call = "ispa=" + fcn.function
-    fcn_call = fcn_call + "("
-
-    if len(fcn.arguments.args) > 0:
-        for key in fcn.arguments.args:
-            fcn_call = fcn_call + key + "=" + str(fcn.arguments.locals[key]) + ","
-        fcn_call = fcn_call[0:-1]
-    fcn_call = fcn_call + ")"
-
-    code_received.append(fcn_call)
 
-    data = {}
-    exec_start_time = time.time()
-    exec("\n".join(code_received), globals(), data)
-    return data["ispa"], time.time() - exec_start_time
-
-
-def get_transform_image(fcn, code_received):
-    """Get the transform image
-
-    Args:
-        fcn (Command): Function we would like to evaluate
-        code_received: The code
-
-    Returns:
-        The transform image
-
-    """
-    img_call = "awa=qml.draw_mpl(" + fcn.function + ")" + "("
-    if len(fcn.arguments.args) > 0:
-        for key in fcn.arguments.args:
-            img_call = img_call + key + "=" + str(fcn.arguments.locals[key]) + ","
-        img_call = img_call[0:-1]
-    img_call = img_call + ")"
-    code_received.append(img_call)
-    data = {}
-    exec_start_time = time.time()
-    exec("\n".join(code_received), globals(), data)
+    @qml.qnode(dev)
+    def circuit():
+        for c in commands:
+            if c.quantum_or_classical == "quantum":
+                qml.apply(c.code_line)
+        return [qml.apply(i) for i in last_command.code_line]
 
-    return get_image_bs64_bytecode(data["awa"][0]), time.time() - exec_start_time
+    return circuit
 
 
 def expand_methods(
@@ -711,57 +750,35 @@ def run_pennylane_commands(
     Returns:
         Returns the pennylane commands evaluated
     """
-    dev = qml.device(device_name, wires=num_wires)
-    if num_shots != 0:
-        dev = qml.device(device_name, wires=num_wires, shots=num_shots)
+    with checkout_device(device_name, num_wires, num_shots) as dev:
 
-    @qml.qnode(dev)
-    def circuit():
-        for c in commands:
-            if c.identifier == debug_identifier:
-                break
-            if c.quantum_or_classical == "quantum":
-                qml.apply(c.code_line)
-        return [qml.apply(i) for i in last_command]
+        @qml.qnode(dev)
+        def circuit():
+            for c in commands:
+                if c.identifier == debug_identifier:
+                    break
+                if c.quantum_or_classical == "quantum":
+                    qml.apply(c.code_line)
+            return [qml.apply(i) for i in last_command]
 
-    return circuit()
+        return circuit()
 
 
 def get_quantum_lines(code):
     """Get the lines in the code that have quantum code
 
     Args:
-        code (String): The code
+        code (Array[String]): The lines of the code
 
     Returns:
         Returns a set of line numbers with quantum code
     """
-    lines = set()
-    for i in range(len(code)):
-        c = code[i]
-        if "qml." in c:
-            lines.add(i + 1)
-    return lines
+    return source.get_quantum_lines(code)
 
 
 def newline_cleanup(code):
-    """Sometimes users put newlines such that the a code line that
-        CircInspect expects to process as a single line gets divided
-        up into multiple lines. This function safely removes the newlines
-        inside paranthesis and puts them after the paranthesis ends.
-        E.g.
-        ---
-        qml.PauliX(
-            wires=0
-            )
-        ---
-        is transformed to
-        ---
-        qml.PauliX(wires=0)
-
-
-        ---
-        (newlines are added back after the PauliX)
+    """Remove the newlines inside parentheses and put them after the line
+        where the parentheses end, see source.newline_cleanup.
 
     Args:
         code (String): Code that has new line characters inside qml operation parameters
@@ -769,35 +786,11 @@ def newline_cleanup(code):
     Returns:
         String: Code after new line characters have been cleaned up
     """
-    newline_num = 0
-    open_parentheses = 0
-    i = 0
-    for c in code:
-        if c == "(":
-            open_parentheses += 1
-        if c == ")":
-            open_parentheses -= 1
-            if open_parentheses == 0:
-                # Add the newlines back at a safe place so line numbers stay
-                # the same for debugging
-                j = code.find("\n", i)
-                code = code[: j + 1] + ("\n" * newline_num) + code[j + 1 :]
-                i += newline_num
-                newline_num = 0
-        if c == "\n" and open_parentheses > 0:
-            code = code[:i] + code[i + 1 :]
-            newline_num += 1
-            i -= 1
-        i += 1
-    return code
+    return source.newline_cleanup(code)
 
 
 def comment_cleanup(code):
     """Replace comments from the code with empty lines"""
-    # type 61 indicates that the token is a comment
-    tokens = filter(
-        lambda t: t.type == 61, tokenize.tokenize(io.BytesIO(code.encode("utf-8")).readline)
-    )
-    for t in tokens:
-        code = code.replace(t.string, "")
-    return code
+    lines = code.split("\n")
+    source.remove_comments(lines, source.tokenize_code(code))
+    return "\n".join(lines)
@@ -0,0 +1,57 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the indexes of the circinspect database. The main server
+creates them when it starts so that authentication and telemetry lookups use
+an index instead of scanning whole collections as the collections grow.
+"""
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+# collection name, index keys, index options
+INDEXES = [
+    # find_user_by_token, sparse so that users without a token are allowed
+    ("users", [("token", ASCENDING)], {"unique": True, "sparse": True}),
+    # user lookup when a login link is sent
+    ("users", [("email_address", ASCENDING)], {}),
+    # session lookups by telemetry and the admin tool
+    ("sessions", [("session_id", ASCENDING)], {}),
+    # appending to the last bucket of a session and reading buckets in order
+    ("session_actions", [("session_id", ASCENDING), ("_id", ASCENDING)], {}),
+    # finding the buckets that changed since the last rollup of the admin tool
+    ("session_actions", [("updated_at", ASCENDING)], {}),
+    ("session_rollups", [("session_id", ASCENDING)], {"unique": True}),
+]
+
+
+def ensure_indexes(db):
+    """Create the indexes in INDEXES if they do not exist. Failures are
+    printed instead of raised so that the server can still start while the
+    database is unavailable.
+
+    Args:
+        db: MongoDB database
+
+    Returns:
+        Boolean: True if all indexes exist
+    """
+    try:
+        for collection, keys, options in INDEXES:
+            db[collection].create_index(keys, **options)
+    except PyMongoError as e:
+        print("Could not create database indexes: " + str(e))
+        return False
+    return True
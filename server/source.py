@@ -0,0 +1,291 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the preprocessing of user code. The code is cleaned up
+and tokenized once, and the information that the code execution server needs
+about the code (its lines, the qnode and transform decorators, the method
+names and the lines with quantum code) is computed from the same tokens.
+Every step takes time proportional to the size of the code.
+"""
+
+import io
+import tokenize
+from collections import deque
+
+
+def tokenize_code(code):
+    """Tokenize code.
+
+    Args:
+        code (string): the code
+
+    Returns:
+        list of tokenize.TokenInfo
+    """
+    return list(tokenize.tokenize(io.BytesIO(code.encode("utf-8")).readline))
+
+
+def newline_cleanup(code):
+    """Sometimes users put newlines such that the a code line that
+        CircInspect expects to process as a single line gets divided
+        up into multiple lines. This function safely removes the newlines
+        inside paranthesis and puts them after the paranthesis ends.
+        E.g.
+        ---
+        qml.PauliX(
+            wires=0
+            )
+        ---
+        is transformed to
+        ---
+        qml.PauliX(wires=0)
+
+
+        ---
+        (newlines are added back after the PauliX)
+
+    Args:
+        code (String): Code that has new line characters inside qml operation parameters
+
+    Returns:
+        String: Code after new line characters have been cleaned up
+    """
+    out = []
+    newline_num = 0
+    pending = 0  # newlines to add back after the next newline
+    open_parentheses = 0
+    for c in code:
+        if c == "(":
+            open_parentheses += 1
+        if c == ")":
+            open_parentheses -= 1
+            if open_parentheses == 0:
+                pending += newline_num
+                newline_num = 0
+        if c == "\n":
+            if open_parentheses > 0:
+                newline_num += 1
+            else:
+                out.append(c)
+            if pending > 0:
+                out.append("\n" * pending)
+                pending = 0
+            continue
+        out.append(c)
+    # keep the line numbers the same if the code does not end with a newline
+    out.append("\n" * pending)
+    return "".join(out)
+
+
+def remove_comments(lines, tokens):
+    """Remove the comments from lines of code.
+
+    Args:
+        lines (list): lines of the code, changed in place
+        tokens (list): tokens of the code
+
+    Returns:
+        list: tokens of the code that are not comments
+    """
+    out = []
+    for t in tokens:
+        if t.type != tokenize.COMMENT:
+            out.append(t)
+            continue
+        row, col = t.start
+        line = lines[row - 1]
+        lines[row - 1] = line[:col] + line[t.end[1] :]
+    return out
+
+
+def find_first_qnode_decorator(tokens, lines=None):
+    """Find the index (line number - 1) of the first qnode decorator.
+
+    Args:
+        tokens (list): tokens of the code
+        lines (list): lines of the code, the lines of the tokens are used
+            if None
+
+    Returns:
+        index (line number - 1) of the first qnode, if a qnode is found.
+        -1, if no qnode decorator is found.
+    """
+    for t in tokens:
+        if t.type == tokenize.OP and t.string == "@":
+            line = t.line if lines is None else lines[t.start[0] - 1]
+            if "@qml.qnode" in line:
+                return t.start[0] - 1
+    return -1
+
+
+def find_transform_decorators(tokens, lines=None):
+    """Find the indices (line number - 1) of decorators that are not qnodes
+        and can be transforms.
+
+    Args:
+        tokens (list): tokens of the code
+        lines (list): lines of the code, the lines of the tokens are used
+            if None
+
+    Returns:
+        set of indices of the decorators
+    """
+    out = set()
+    for t in tokens:
+        if t.type == tokenize.OP and t.string == "@":
+            line = t.line if lines is None else lines[t.start[0] - 1]
+            if "@qml.qnode(" not in line:
+                out.add(t.start[0] - 1)
+    return out
+
+
+def comment_out_transforms(lines, qnode_idx):
+    """Comment out the decorators right before and after the qnode decorator.
+
+    Args:
+        lines (list): lines of the code
+        qnode_idx (int): index of the qnode decorator
+
+    Returns:
+        list: lines of the code with the transforms commented out
+    """
+    code_arr = list(lines)
+    j = qnode_idx - 1
+    while j >= 0:
+        if len(code_arr[j]) == 0 or code_arr[j][0] == "#":
+            j -= 1
+        elif "@" == code_arr[j][0]:
+            code_arr[j] = "#" + code_arr[j]
+            j -= 1
+        else:
+            break
+    k = qnode_idx + 1
+    while k < len(code_arr):
+        if len(code_arr[k]) == 0 or code_arr[k][0] == "#":
+            k += 1
+        elif "@" == code_arr[k][0]:
+            code_arr[k] = "#" + code_arr[k]
+            k += 1
+        else:
+            break
+    return code_arr
+
+
+def get_transform_details(lines, qnode_idx, possible_transforms):
+    """Get the transforms applied to the qnode and their line numbers.
+
+    Args:
+        lines (list): lines of the code
+        qnode_idx (int): index of the qnode decorator
+        possible_transforms (set): indices of decorators that are not qnodes
+
+    Returns:
+        Array[[string, int]]: Array of arrays of transform name and
+        line number on which its applied
+    """
+    transforms_details = deque([])
+    j = qnode_idx - 1
+    while j >= 0:
+        if len(lines[j]) == 0 or lines[j][0] == "#":
+            j -= 1
+        elif j in possible_transforms:
+            transforms_details.appendleft([lines[j], j + 1])
+            j -= 1
+        else:
+            break
+
+    k = qnode_idx + 1
+    while k < len(lines):
+        if len(lines[k]) == 0 or lines[k][0] == "#":
+            k += 1
+        if k in possible_transforms:
+            transforms_details.append([lines[k], k + 1])
+            k += 1
+        else:
+            break
+    return transforms_details
+
+
+def get_method_names(lines):
+    """Get the names of methods defined in lines of code.
+
+    Args:
+        lines (list): lines of the code
+
+    Returns:
+        set of method names
+    """
+    method_names = set()
+    for line in lines:
+        if "def " in line:
+            fcn_name = line.split(" ")[1].split("(")[0]
+            method_names.add(fcn_name)
+    return method_names
+
+
+def get_quantum_lines(lines):
+    """Get the line numbers of lines that have quantum code.
+
+    Args:
+        lines (list): lines of the code
+
+    Returns:
+        set of line numbers
+    """
+    return {i + 1 for i, line in enumerate(lines) if "qml." in line}
+
+
+class SourceModel:
+    """User code after clean up, with the information about it that is used
+    to process it
+
+    Attributes:
+        code: the code without newlines inside parentheses and comments
+        lines: lines of the code
+        tokens: tokens of the code, without comments
+        qnode_idx: index of the first qnode decorator, -1 if there is none
+        transform_idx: indices of decorators that are not qnodes
+        method_names: names of the methods defined in the code
+        quantum_lines: line numbers of lines with quantum code. Commenting
+            out the transforms does not change them.
+    """
+
+    def __init__(self, code):
+        code = newline_cleanup(code)
+        lines = code.split("\n")
+        self.tokens = remove_comments(lines, tokenize_code(code))
+        self.lines = lines
+        self.code = "\n".join(lines)
+        self.qnode_idx = find_first_qnode_decorator(self.tokens, lines)
+        self.transform_idx = find_transform_decorators(self.tokens, lines)
+        self.method_names = get_method_names(lines)
+        self.quantum_lines = get_quantum_lines(lines)
+
+    def transforms_commented(self):
+        """Get the lines of the code with the transforms commented out.
+
+        Returns:
+            list: lines of the code
+        """
+        return comment_out_transforms(self.lines, self.qnode_idx)
+
+    def transform_details(self):
+        """Get the transforms applied to the qnode and their line numbers.
+
+        Returns:
+            Array[[string, int]]: Array of arrays of transform name and
+            line number on which its applied
+        """
+        return get_transform_details(self.lines, self.qnode_idx, self.transform_idx)
@@ -0,0 +1,383 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the storage of users, sessions and bug reports used by
+the main server. The MongoDB storage is used by default. Small deployments
+and the tests can use an embedded SQLite database file instead, which does
+not need a database server.
+
+Session telemetry is written by server/telemetry.py as batches of operations:
+    ("sessions", <session>)
+    ("session_actions", <session id>, <action>)
+    ("telemetry_contents", <hash>, <content>, <size in bytes>)
+"""
+
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pymongo import MongoClient, InsertOne, UpdateOne
+from server.indexes import ensure_indexes
+
+
+class Storage(ABC):
+    """Interface of the storage used by the main server"""
+
+    @abstractmethod
+    def find_user_by_token(self, token):
+        """Find the user with an authentication token.
+
+        Args:
+            token (string): the token user received for authentication
+
+        Returns:
+            Dict: the email_address and expires fields of the user, or None
+            if no user has the token
+        """
+
+    @abstractmethod
+    def find_user_by_email(self, email_address):
+        """Find the user with an email address.
+
+        Args:
+            email_address (string): user's email address
+
+        Returns:
+            Dict: the email_address, token, activated and expires fields of
+            the user, or None if there is no user with the email address
+        """
+
+    @abstractmethod
+    def insert_user(self, user):
+        """Create a user that logs in for the first time.
+
+        Args:
+            user (dict): email_address, token, activated and expires fields
+        """
+
+    @abstractmethod
+    def rotate_token(self, email_address, token, activated, expires, past_token=None):
+        """Give a new authentication token to a user.
+
+        Args:
+            email_address (string): user's email address
+            token (string): the new token
+            activated (int): time the new token was created
+            expires (int): time the new token expires
+            past_token (dict): the replaced token to keep in the history of
+                the user, or None
+        """
+
+    @abstractmethod
+    def add_user_session(self, token, session_id):
+        """Add a session to the sessions of the user with a token.
+
+        Args:
+            token (string): token of the user
+            session_id (string): id of the session
+        """
+
+    @abstractmethod
+    def insert_bug_report(self, report):
+        """Save a bug report sent by a user.
+
+        Args:
+            report (dict): token, session_id, timestamp, email and description
+        """
+
+    @abstractmethod
+    def write_telemetry(self, operations):
+        """Write a batch of telemetry operations in the order they were
+        queued. Failures are printed instead of raised.
+
+        Args:
+            operations (list): telemetry operations, see the module docstring
+
+        Returns:
+            Int: number of operations that failed
+        """
+
+    def ensure_indexes(self):
+        """Create the indexes of the storage if they do not exist.
+
+        Returns:
+            Boolean: True if all indexes exist
+        """
+        return True
+
+
+class MongoStorage(Storage):
+    """Storage in a MongoDB database
+
+    Actions of a session are stored in buckets, see server/telemetry.py.
+
+    Attributes:
+        db: MongoDB database
+        bucket_size: maximum number of actions in a session_actions document
+    """
+
+    def __init__(self, db, bucket_size=50):
+        self.db = db
+        self.bucket_size = bucket_size
+
+    def find_user_by_token(self, token):
+        return self.db.users.find_one({"token": token}, {"email_address": 1, "expires": 1})
+
+    def find_user_by_email(self, email_address):
+        return self.db.users.find_one(
+            {"email_address": email_address},
+            {"email_address": 1, "token": 1, "activated": 1, "expires": 1},
+        )
+
+    def insert_user(self, user):
+        self.db.users.insert_one(dict(user, past_tokens=[], sessions=[]))
+
+    def rotate_token(self, email_address, token, activated, expires, past_token=None):
+        update = {"$set": {"token": token, "activated": activated, "expires": expires}}
+        if past_token is not None:
+            update["$push"] = {"past_tokens": past_token}
+        self.db.users.update_one({"email_address": email_address}, update)
+
+    def add_user_session(self, token, session_id):
+        self.db.users.update_one({"token": token}, {"$push": {"sessions": session_id}})
+
+    def insert_bug_report(self, report):
+        self.db.bugs.insert_one(dict(report))
+
+    def get_write(self, operation):
+        """Get the pymongo write operation of a telemetry operation."""
+        if operation[0] == "sessions":
+            return InsertOne(operation[1])
+        if operation[0] == "session_actions":
+            return UpdateOne(
+                {"session_id": operation[1], "count": {"$lt": self.bucket_size}},
+                {
+                    "$push": {"actions": operation[2]},
+                    "$inc": {"count": 1},
+                    "$currentDate": {"updated_at": True},
+                },
+                upsert=True,
+            )
+        return UpdateOne(
+            {"_id": operation[1]},
+            {"$setOnInsert": {"content": operation[2], "size": operation[3]}},
+            upsert=True,
+        )
+
+    def write_telemetry(self, operations):
+        # one bulk write for each run of operations on the same collection
+        failed = 0
+        start = 0
+        while start < len(operations):
+            collection = operations[start][0]
+            end = start
+            while end < len(operations) and operations[end][0] == collection:
+                end += 1
+            writes = [self.get_write(operation) for operation in operations[start:end]]
+            try:
+                self.db[collection].bulk_write(writes, ordered=True)
+            except Exception as e:
+                failed += len(writes)
+                print("Telemetry write failed: " + str(e))
+            start = end
+        return failed
+
+    def ensure_indexes(self):
+        return ensure_indexes(self.db)
+
+
+class SQLiteStorage(Storage):
+    """Storage in an embedded SQLite database file
+
+    The database uses write-ahead logging so that reads do not wait for
+    writes, and each batch of telemetry is written in one transaction.
+    Lists and documents such as actions are stored as JSON.
+
+    Attributes:
+        path: path of the database file, or ":memory:"
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS users (
+            email_address TEXT PRIMARY KEY, token TEXT UNIQUE,
+            activated INTEGER, expires INTEGER)""",
+        """CREATE TABLE IF NOT EXISTS past_tokens (
+            email_address TEXT, token TEXT, activated INTEGER, expires INTEGER,
+            deactivated INTEGER)""",
+        """CREATE TABLE IF NOT EXISTS user_sessions (
+            email_address TEXT, session_id TEXT)""",
+        """CREATE TABLE IF NOT EXISTS bugs (
+            token TEXT, session_id TEXT, timestamp INTEGER, email TEXT,
+            description TEXT)""",
+        """CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT, session TEXT)""",
+        """CREATE TABLE IF NOT EXISTS session_actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, action TEXT)""",
+        """CREATE TABLE IF NOT EXISTS telemetry_contents (
+            hash TEXT PRIMARY KEY, content TEXT, size INTEGER)""",
+        "CREATE INDEX IF NOT EXISTS sessions_session_id ON sessions (session_id)",
+        """CREATE INDEX IF NOT EXISTS session_actions_session_id
+            ON session_actions (session_id, id)""",
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+
+    def _query_one(self, sql, parameters):
+        """Run a query and return its first row as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute(sql, parameters).fetchone()
+        return dict(row) if row is not None else None
+
+    def _execute(self, statements):
+        """Run a list of (sql, parameters) statements in one transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for sql, parameters in statements:
+                    self._conn.execute(sql, parameters)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def find_user_by_token(self, token):
+        return self._query_one("SELECT email_address, expires FROM users WHERE token = ?", (token,))
+
+    def find_user_by_email(self, email_address):
+        return self._query_one(
+            "SELECT email_address, token, activated, expires FROM users WHERE email_address = ?",
+            (email_address,),
+        )
+
+    def insert_user(self, user):
+        self._execute(
+            [
+                (
+                    "INSERT INTO users VALUES (?, ?, ?, ?)",
+                    (user["email_address"], user["token"], user["activated"], user["expires"]),
+                )
+            ]
+        )
+
+    def rotate_token(self, email_address, token, activated, expires, past_token=None):
+        statements = []
+        if past_token is not None:
+            statements.append(
+                (
+                    "INSERT INTO past_tokens VALUES (?, ?, ?, ?, ?)",
+                    (
+                        email_address,
+                        past_token["token"],
+                        past_token["activated"],
+                        past_token["expires"],
+                        past_token["deactivated"],
+                    ),
+                )
+            )
+        statements.append(
+            (
+                "UPDATE users SET token = ?, activated = ?, expires = ? WHERE email_address = ?",
+                (token, activated, expires, email_address),
+            )
+        )
+        self._execute(statements)
+
+    def add_user_session(self, token, session_id):
+        self._execute(
+            [
+                (
+                    "INSERT INTO user_sessions "
+                    + "SELECT email_address, ? FROM users WHERE token = ?",
+                    (session_id, token),
+                )
+            ]
+        )
+
+    def insert_bug_report(self, report):
+        self._execute(
+            [
+                (
+                    "INSERT INTO bugs VALUES (?, ?, ?, ?, ?)",
+                    (
+                        report["token"],
+                        report["session_id"],
+                        report["timestamp"],
+                        report["email"],
+                        report["description"],
+                    ),
+                )
+            ]
+        )
+
+    def write_telemetry(self, operations):
+        statements = []
+        for operation in operations:
+            if operation[0] == "sessions":
+                session = operation[1]
+                statements.append(
+                    (
+                        "INSERT INTO sessions VALUES (?, ?)",
+                        (session["session_id"], json.dumps(session, default=str)),
+                    )
+                )
+            elif operation[0] == "session_actions":
+                statements.append(
+                    (
+                        "INSERT INTO session_actions (session_id, action) VALUES (?, ?)",
+                        (operation[1], json.dumps(operation[2], default=str)),
+                    )
+                )
+            else:
+                statements.append(
+                    (
+                        "INSERT OR IGNORE INTO telemetry_contents VALUES (?, ?, ?)",
+                        (operation[1], json.dumps(operation[2], default=str), operation[3]),
+                    )
+                )
+        try:
+            self._execute(statements)
+        except Exception as e:
+            print("Telemetry write failed: " + str(e))
+            return len(operations)
+        return 0
+
+
+def open_storage(url, bucket_size=50):
+    """Open the storage at a URL.
+
+    Args:
+        url (string): "mongodb://<host>:<port>/<database>" for MongoDB, the
+            circinspect database is used if there is no database name, or
+            "sqlite:///<path>" for an SQLite database file, e.g.
+            "sqlite:///circinspect.db" or "sqlite:///:memory:"
+        bucket_size (int): maximum number of actions in a session_actions
+            document, only used by MongoDB
+
+    Returns:
+        Storage: the storage
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///") :])
+    client = MongoClient(url)
+    return MongoStorage(client.get_default_database("circinspect"), bucket_size=bucket_size)
@@ -0,0 +1,307 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the write-behind queue used by the main server to record
+session telemetry. Requests only put their database writes in a bounded
+in-process queue, and a background thread writes them to the storage (see
+server/storage.py) in batches, so database latency does not show up in
+user-facing latency.
+
+In MongoDB, actions of a session are not pushed into the session document.
+They are stored in the session_actions collection in buckets of at most
+bucket_size actions per document:
+    {"session_id": ..., "count": <number of actions>, "actions": [...],
+     "updated_at": <time of the last write>}
+so that each write only rewrites a small document and long sessions do not
+grow a single document towards the MongoDB document size limit. Buckets of a
+session are ordered by their _id. updated_at is set by the database and lets
+the admin tool find the buckets that changed since its last rollup.
+
+Before an action is queued, the TelemetryPolicy of the writer decides whether
+it is recorded and how much of it is stored. Large fields such as source code
+can be stored once in the telemetry_contents collection:
+    {"_id": <sha256 of the content>, "content": ..., "size": <bytes>}
+and replaced in the action by a <field>_hash field with the hash, so repeated
+content is only written once.
+"""
+
+import atexit
+import hashlib
+import json
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# Queued by close() to wake up the background thread
+_STOP = object()
+
+
+class TelemetryPolicy:
+    """Rules that decide which actions are recorded and how they are stored
+
+    Attributes:
+        sample_rates: dict of API call to the fraction of its actions that
+            are recorded, 1.0 for API calls that are not in the dict
+        hashed_fields: dict of API call to the fields that are stored in the
+            content store and replaced by their hash
+        dropped_fields: dict of API call to the fields that are not recorded
+        max_field_size: maximum size in bytes of a field that is recorded in
+            an action, larger strings are cut and other values are dropped.
+            The api_call and timestamp fields are always recorded.
+    """
+
+    def __init__(
+        self,
+        sample_rates=None,
+        hashed_fields=None,
+        dropped_fields=None,
+        max_field_size=65536,
+        seen_cache_size=10000,
+    ):
+        self.sample_rates = sample_rates or {}
+        self.hashed_fields = hashed_fields or {}
+        self.dropped_fields = dropped_fields or {}
+        self.max_field_size = max_field_size
+        self.seen_cache_size = seen_cache_size
+        self._seen = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def is_new_content(self, content_hash):
+        """Check whether content is neither stored nor queued to be stored
+        by this process. New content is marked as queued until
+        content_written() is called for it.
+
+        Args:
+            content_hash (string): hash of the content
+
+        Returns:
+            Boolean: True if the content should be written to the store
+        """
+        with self._lock:
+            if content_hash in self._seen:
+                self._seen.move_to_end(content_hash)
+                return False
+            if content_hash in self._pending:
+                return False
+            self._pending.add(content_hash)
+            return True
+
+    def content_written(self, content_hash, stored):
+        """Record the result of a queued content write. Content is only
+        remembered as stored once its write succeeded, so that content whose
+        write was dropped or failed is written again with the next action
+        that has it.
+
+        Args:
+            content_hash (string): hash of the content
+            stored (bool): True if the content was written to the store
+        """
+        with self._lock:
+            self._pending.discard(content_hash)
+            if not stored:
+                return
+            self._seen[content_hash] = True
+            self._seen.move_to_end(content_hash)
+            if len(self._seen) > self.seen_cache_size:
+                self._seen.popitem(last=False)
+
+    def apply(self, action):
+        """Apply the policy to an action.
+
+        Args:
+            action (dict): data of the action, with its api_call
+
+        Returns:
+            dict, dict:
+                the action to record, or None if it is not sampled
+                the content of hashed fields by their hash
+        """
+        call = action.get("api_call", None)
+        rate = self.sample_rates.get(call, 1.0)
+        if rate < 1.0:
+            if random.random() >= rate:
+                return None, {}
+            action = dict(action, sample_rate=rate)
+
+        dropped = self.dropped_fields.get(call, [])
+        hashed = self.hashed_fields.get(call, [])
+        out, contents = {}, {}
+        for field, value in action.items():
+            if field in ("api_call", "timestamp", "sample_rate"):
+                # used by the admin tool, always recorded as they are
+                out[field] = value
+                continue
+            if field in dropped:
+                continue
+            if isinstance(value, str):
+                data = value.encode("utf-8")
+            else:
+                data = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+            if field in hashed:
+                content_hash = hashlib.sha256(data).hexdigest()
+                out[field + "_hash"] = content_hash
+                contents[content_hash] = (value, len(data))
+            elif len(data) <= self.max_field_size:
+                out[field] = value
+            elif isinstance(value, str):
+                out[field] = data[: self.max_field_size].decode("utf-8", "ignore")
+                out[field + "_size"] = len(data)
+            else:
+                out[field + "_size"] = len(data)
+        return out, contents
+
+
+class TelemetryWriter:
+    """Bounded queue of session writes flushed to the storage in batches
+
+    Attributes:
+        storage: Storage that the writes are sent to
+        policy: TelemetryPolicy applied to actions before they are queued
+        batch_size: number of writes that triggers a flush
+        flush_interval: seconds after which queued writes are flushed even
+            if the batch is not full
+        num_written: number of writes sent to the database
+        num_dropped: number of writes dropped because the queue was full
+        num_failed: number of writes that the database rejected
+        num_sampled_out: number of actions not recorded because of sampling
+    """
+
+    def __init__(
+        self, storage, max_queue_size=10000, batch_size=100, flush_interval=1.0, policy=None
+    ):
+        self.storage = storage
+        self.policy = policy or TelemetryPolicy()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+        self.num_sampled_out = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, operation):
+        """Queue a write without waiting for the database. If the queue is
+        full, the write is dropped and counted in num_dropped.
+
+        Args:
+            operation (tuple): telemetry operation, see server/storage.py
+
+        Returns:
+            Boolean: True if the write was queued
+        """
+        try:
+            self._queue.put_nowait(operation)
+        except queue.Full:
+            with self._lock:
+                self.num_dropped += 1
+            return False
+        return True
+
+    def insert_session(self, session):
+        """Queue the creation of a session document.
+
+        Args:
+            session (dict): session document
+        """
+        self.write(("sessions", session))
+
+    def push_action(self, session_id, action):
+        """Queue the recording of an action in a session, after the policy of
+        the writer is applied.
+
+        Args:
+            session_id (string): id of the session
+            action (dict): data of the action
+        """
+        action, contents = self.policy.apply(action)
+        if action is None:
+            with self._lock:
+                self.num_sampled_out += 1
+            return
+        for content_hash, (content, size) in contents.items():
+            if self.policy.is_new_content(content_hash):
+                if not self.write(("telemetry_contents", content_hash, content, size)):
+                    self.policy.content_written(content_hash, False)
+        self.write(("session_actions", session_id, action))
+
+    def _flush(self, batch):
+        """Write a batch of operations in the order they were queued."""
+        failed = self.storage.write_telemetry(batch)
+        # the storage does not report which writes failed, so content of a
+        # batch with failures is written again with its next action
+        for operation in batch:
+            if operation[0] == "telemetry_contents":
+                self.policy.content_written(operation[1], failed == 0)
+        with self._lock:
+            self.num_written += len(batch) - failed
+            self.num_failed += failed
+
+    def _run(self):
+        """Collect queued writes into batches and flush them until close()
+        is called and the queue is empty.
+        """
+        while not (self._stopped.is_set() and self._queue.empty()):
+            batch = []
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    operation = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if operation is _STOP:
+                    break
+                batch.append(operation)
+            if len(batch) > 0:
+                self._flush(batch)
+
+    def close(self, timeout=10):
+        """Stop the background thread once the queue is empty and wait for
+        queued writes to be flushed, e.g. when the server shuts down.
+
+        Args:
+            timeout (float): maximum seconds to wait for the flush
+        """
+        self._stopped.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def stats(self):
+        """Get the counters of the writer.
+
+        Returns:
+            Dict: number of queued, written, dropped and failed writes, and
+            number of actions not recorded because of sampling
+        """
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.num_written,
+            "dropped": self.num_dropped,
+            "failed": self.num_failed,
+            "sampled_out": self.num_sampled_out,
+        }
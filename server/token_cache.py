@@ -0,0 +1,91 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module provides the in-process cache of authentication token lookups
+used by the main server, so that authenticated requests do not need a
+database round-trip each time. Entries expire after a short time, so tokens
+changed by another server process are picked up quickly.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    """Least recently used cache of token to user lookups with expiry
+
+    Attributes:
+        ttl: seconds a found user is cached for
+        negative_ttl: seconds an unknown token is cached for
+        max_size: maximum number of cached tokens
+    """
+
+    def __init__(self, ttl=30, negative_ttl=5, max_size=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """Look up a token in the cache.
+
+        Args:
+            token (string): the token user received for authentication
+
+        Returns:
+            Boolean, dict:
+                True if the token is cached
+                the cached user, or None if the token is cached as unknown
+        """
+        with self._lock:
+            entry = self._entries.get(token, None)
+            if entry is None:
+                return False, None
+            user, expires = entry
+            if expires < time.time():
+                del self._entries[token]
+                return False, None
+            self._entries.move_to_end(token)
+            return True, user
+
+    def put(self, token, user):
+        """Cache the result of a token lookup. A user is not cached past the
+        expiry time of their token.
+
+        Args:
+            token (string): the token user received for authentication
+            user (dict): the user with the token, or None if there is none
+        """
+        now = time.time()
+        if user is None:
+            expires = now + self.negative_ttl
+        else:
+            expires = min(now + self.ttl, user.get("expires", 0))
+        with self._lock:
+            self._entries[token] = (user, expires)
+            self._entries.move_to_end(token)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        """Remove a token from the cache, e.g. when it is replaced.
+
+        Args:
+            token (string): the token to remove
+        """
+        with self._lock:
+            self._entries.pop(token, None)
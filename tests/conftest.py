@@ -21,7 +21,7 @@ from server.app import create_app
 @pytest.fixture
 def app():
     """Start the flask application in testing mode"""
-    app = create_app({"TESTMODE": True})
+    app = create_app({"TESTMODE": True, "STORAGE_URL": "sqlite:///:memory:"})
     yield app
 
 
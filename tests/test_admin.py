@@ -0,0 +1,107 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module is a set of tests for the incremental usage rollups of the admin
+tool located at admin/admin.py. The session lengths of the rollups are
+compared with the lengths computed from all actions of the session.
+"""
+
+import json
+
+from admin.admin import (
+    actionToCsvRow,
+    addBucketsToRollup,
+    getRollupLengths,
+    getSessionLengths,
+    newSessionRollup,
+)
+
+
+def make_actions(calls, start=0):
+    return [{"api_call": call, "timestamp": start + 1000 * i} for i, call in enumerate(calls)]
+
+
+ACTIONS = make_actions(
+    [
+        "/visualizeCircuit",
+        "/dc/enterDebuggerMode",
+        "/dc/next",
+        "/dc/next",
+        "/dc/enterRealTimeMode",
+        "/visualizeCircuit",
+        "/dc/enterDebuggerMode",
+        "/dc/sessionExit",
+        "/dc/closeDebugger",
+    ]
+)
+
+
+def test_rollup_resume():
+    """Check that actions added to a bucket after it was read and buckets
+    that are read again are counted once.
+    """
+    rollup = newSessionRollup("a")
+    added = addBucketsToRollup(rollup, [{"_id": 1, "actions": ACTIONS[:2]}])
+    assert added == ACTIONS[:2]
+    assert (rollup["bucket_id"], rollup["offset"]) == (1, 2)
+    assert getRollupLengths(rollup) == getSessionLengths(ACTIONS[:2]) == (0, 0, 0)
+
+    # the first bucket is read again with new actions, as it was written in
+    # the overlap with the previous update
+    buckets = [{"_id": 1, "actions": ACTIONS[:4]}, {"_id": 2, "actions": ACTIONS[4:6]}]
+    assert addBucketsToRollup(rollup, buckets) == ACTIONS[2:6]
+    assert (rollup["bucket_id"], rollup["offset"]) == (2, 2)
+
+    # buckets before the last bucket read are skipped
+    buckets = [{"_id": 1, "actions": ACTIONS[:4]}, {"_id": 2, "actions": ACTIONS[4:]}]
+    assert addBucketsToRollup(rollup, buckets) == ACTIONS[6:]
+    assert addBucketsToRollup(rollup, buckets) == []
+    assert sum(rollup["action_counts"].values()) == len(ACTIONS)
+    assert getRollupLengths(rollup) == getSessionLengths(ACTIONS) == (8000, 5000, 3000)
+
+
+def test_rollup_session_exit():
+    """Check that sessions have a length only if /dc/sessionExit is one of
+    their last two actions, for every way of splitting the actions into
+    updates.
+    """
+    extra = make_actions(["/visualizeCircuit", "/dc/sessionExit"], start=9000)
+    for actions in (ACTIONS[:8], ACTIONS, ACTIONS + extra[:1], ACTIONS + extra):
+        for split in range(len(actions) + 1):
+            rollup = newSessionRollup("a")
+            addBucketsToRollup(rollup, [{"_id": 1, "actions": actions[:split]}])
+            addBucketsToRollup(rollup, [{"_id": 1, "actions": actions}])
+            assert getRollupLengths(rollup) == getSessionLengths(actions)
+    assert getSessionLengths(ACTIONS + extra[:1]) == (0, 0, 0)
+    assert getSessionLengths(ACTIONS + extra) == (10000, 7000, 3000)
+
+
+def test_csv_row_extra_fields():
+    columns = ["session_id", "timestamp", "code", "extra_fields"]
+    first = {"api_call": "/run", "timestamp": 1000, "code": "x = 1"}
+    sampled = {**first, "sample_rate": 0.1, "code_hash": "abc", "args": [1, 2]}
+
+    assert actionToCsvRow("s1", first, columns) == {
+        "session_id": "s1",
+        "timestamp": 1000,
+        "code": "x = 1",
+    }
+    row = actionToCsvRow("s1", sampled, columns)
+    assert row["code"] == "x = 1"
+    assert json.loads(row["extra_fields"]) == {
+        "sample_rate": 0.1,
+        "code_hash": "abc",
+        "args": [1, 2],
+    }
@@ -0,0 +1,88 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module is a set of tests for the authentication token cache located at
+server/token_cache.py, the allowlist located at server/allowlist.py and the
+/auth/send route that uses it
+"""
+
+import os
+import time
+from server.token_cache import TokenCache
+from server.allowlist import Allowlist
+from server.app import create_app
+
+
+def test_token_cache_expiry():
+    cache = TokenCache(ttl=30, negative_ttl=30, max_size=2)
+    assert cache.get("a") == (False, None)
+
+    # unknown tokens are cached as None
+    cache.put("a", None)
+    assert cache.get("a") == (True, None)
+
+    # users are not cached past the expiry time of their token
+    cache.put("b", {"email_address": "b@b.com", "expires": time.time() + 60})
+    cache.put("c", {"email_address": "c@c.com", "expires": time.time() - 1})
+    assert cache.get("b")[1]["email_address"] == "b@b.com"
+    assert cache.get("c") == (False, None)
+
+    # the least recently used token is evicted when the cache is full
+    cache.put("d", None)
+    assert cache.get("a") == (False, None)
+    assert cache.get("b")[0]
+
+
+def test_token_cache_invalidate():
+    cache = TokenCache()
+    cache.put("a", {"email_address": "a@a.com", "expires": time.time() + 60})
+    cache.invalidate("a")
+    cache.invalidate("unknown")
+    assert cache.get("a") == (False, None)
+
+
+def test_allowlist(tmp_path):
+    path = tmp_path / "allowlist.txt"
+    path.write_text("someone@gmail.com\nubc.ca\ncs.sfu.ca\n")
+    allowlist = Allowlist(str(path))
+    assert allowlist.is_allowed("someone@gmail.com")
+    assert not allowlist.is_allowed("other@gmail.com")
+    assert allowlist.is_allowed("a@ubc.ca")
+    assert allowlist.is_allowed("a@students.ubc.ca")
+    assert not allowlist.is_allowed("a@notubc.ca")
+    assert not allowlist.is_allowed("a@ca")
+    assert allowlist.is_allowed("a@cs.sfu.ca")
+    assert not allowlist.is_allowed("a@sfu.ca")
+
+    # the file is compiled again when it changes
+    path.write_text("sfu.ca\n")
+    os.utime(path, ns=(0, 0))
+    assert allowlist.is_allowed("a@sfu.ca")
+    assert not allowlist.is_allowed("a@ubc.ca")
+
+
+def test_send_login_allowlist(tmp_path):
+    path = tmp_path / "allowlist.txt"
+    path.write_text("ubc.ca\n")
+    app = create_app(
+        {"TESTMODE": True, "STORAGE_URL": "sqlite:///:memory:", "ALLOWLIST_PATH": str(path)}
+    )
+    client = app.test_client()
+
+    response = client.post("/auth/send", json={"email": "someone@students.ubc.ca"})
+    assert response.status_code == 204
+
+    response = client.post("/auth/send", json={"email": "someone@gmail.com"})
+    assert response.status_code == 401
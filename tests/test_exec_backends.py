@@ -0,0 +1,138 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module is a set of tests for the registry of code execution servers
+located at server/exec_backends.py and the HTTP client used to reach them
+located at server/exec_client.py
+"""
+
+import socket
+import pytest
+import requests
+
+from execserver.app import create_app as create_exec_app
+from server.app import create_app
+from server.exec_backends import ExecBackendRegistry
+from server.exec_client import ExecClient, CircuitOpen
+from server import frames
+from tests.functions4testing import visCircuit
+
+UNREACHABLE_URL = "http://127.0.0.1:1"
+
+
+def test_least_outstanding_requests():
+    """Check that a new request goes to the node with the fewest
+    outstanding requests.
+    """
+    registry = ExecBackendRegistry(["http://a", "http://b"])
+    first = registry.choose()
+    second = registry.choose()
+    assert first is not second
+    registry.release(first)
+    assert registry.choose() is first
+
+
+def test_session_affinity():
+    """Check that requests of a session stick to the same node while it is
+    available, and move to another node once it is ejected.
+    """
+    registry = ExecBackendRegistry(["http://a", "http://b"], session_affinity=True)
+    node = registry.choose("session")
+    registry.choose("other session")
+    assert registry.choose("session") is node
+    registry.eject(node)
+    assert registry.choose("session") is not node
+
+
+def test_probe_ejects_dead_node():
+    """Check that a node that does not answer the health probe is ejected
+    and no longer receives requests.
+    """
+    registry = ExecBackendRegistry(["http://127.0.0.1:5001", UNREACHABLE_URL])
+    registry.nodes["http://127.0.0.1:5001"].outstanding = 5
+    registry.probe()
+    assert registry.choose().url == "http://127.0.0.1:5001"
+
+
+def test_circuit_breaker():
+    """Check that the client stops sending requests after repeated failures."""
+    client = ExecClient(retries=0, failure_threshold=2, reset_timeout=60)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            client.post(UNREACHABLE_URL, json={})
+    with pytest.raises(CircuitOpen):
+        client.post(UNREACHABLE_URL, json={})
+    assert client.stats()["rejected"] == 1
+
+
+def test_circuit_breaker_per_server():
+    """Check that full queues (429) do not open the circuit, that 503
+    responses do, and that each exec server has its own circuit.
+    """
+
+    class FakeResponse:
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    client = ExecClient(retries=0, failure_threshold=2, reset_timeout=60)
+    statuses = {"http://a": 429, "http://b": 503}
+    client.session.post = lambda url, json, timeout: FakeResponse(statuses[url])
+    for _ in range(5):
+        assert client.post("http://a", json={}).status_code == 429
+    for _ in range(2):
+        assert client.post("http://b", json={}).status_code == 503
+    with pytest.raises(CircuitOpen):
+        client.post("http://b", json={})
+    assert client.post("http://a", json={}).status_code == 429
+    assert client.stats()["failures"] == 2
+
+
+def test_connection_reuse():
+    """Check that consecutive requests to the same exec server reuse the
+    kept-alive connection.
+    """
+    client = ExecClient()
+    for _ in range(3):
+        client.session.get("http://127.0.0.1:5001/health", timeout=client.timeout)
+    stats = client.stats()
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 2
+
+
+def test_frame_round_trip():
+    """Check that bytes values are sent as raw blobs and come back unchanged."""
+    message = {"image": b"\x89PNG\x00", "children": [{"image": b"\x01"}], "name": "circuit"}
+    a, b = socket.socketpair()
+    frames.send_frame(a, message)
+    assert frames.recv_frame(b) == message
+
+
+def test_unix_socket_transport(tmp_path):
+    """Check that the main server can run code on an exec server over a
+    Unix domain socket.
+    """
+    socket_path = str(tmp_path / "exec.sock")
+    create_exec_app({"EXEC_SOCKET_PATH": socket_path})
+    client = create_app(
+        {
+            "TESTMODE": True,
+            "STORAGE_URL": "sqlite:///:memory:",
+            "EXEC_SERVER_URLS": ["unix://" + socket_path],
+        }
+    ).test_client()
+    with open("test_cases/circuit1.txt", "r") as f:
+        res = visCircuit(client, f.read())
+    assert res.get("error", None) is None
+    assert res["num_wires"] == 6
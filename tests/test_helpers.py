@@ -20,12 +20,19 @@ to other large objects. There is a large set of end-to-end tests in the tests/ f
 that covers these functions.
 """
 
+import ast
 import tokenize
 import io
+import threading
 import pytest
+import numpy as np
+import pennylane as qml
 
 from server import helpers
 from server import command
+from server.source import SourceModel
+from server.code_policy import CodePolicy, inspect_code
+from server.cost_estimate import estimate_cost, MAX_VALUE
 
 
 def test_json_default():
@@ -49,6 +56,80 @@ def test_check_for_restricted_code():
     assert len(helpers.check_for_restricted_code("import pennylane")) == 0
 
 
+def test_code_policy():
+    """Tests that the restricted code check cannot be bypassed by aliasing
+    or attribute access, reports the first line with restricted code, and
+    caches its verdicts.
+    """
+    policy = CodePolicy(cache_size=2)
+    assert policy.check("o = open\no('hello.py')") == [
+        "Filesystem functionality such as open() is disabled. ",
+        " line 1",
+    ]
+    assert policy.check("from pennylane import json") == ["No module named: json", " line 1"]
+    assert policy.check("x = ().__class__.__bases__[0].__subclasses__()")[1] == " line 1"
+    assert policy.check("qml.RX(\n0.1, wires=0)\nimport os\neval('1')")[1] == " line 3"
+    assert policy.check('print("open", "eval")  # exec') == ""
+    assert policy.num_checked == 5
+    assert policy.check('print("open", "eval")  # exec') == ""
+    assert policy.num_checked == 5 and policy.num_cached == 1
+    assert policy.check('f = getattr(circuit, "__glo" + "bals__")')[0].startswith("getattr()")
+    assert policy.check('setattr(qml, "x", 1)')[0].startswith("setattr()")
+    assert policy.check("v = vars(qml)")[0].startswith("vars()")
+    assert policy.check("d = circuit.__dict__")[0] == "Access to __dict__ is disabled. "
+    assert policy.check("import builtins\nf = builtins.open('x')")[1] == " line 2"
+    assert policy.check("from builtins import exec as run")[0].startswith("exec()")
+    assert policy.check("@qml.compile\ndef circuit(): pass") == ""
+
+
+def test_estimate_cost():
+    """Tests that the static cost estimate counts the wires of devices and
+    multiplies the operations and subroutine calls inside loops, and that
+    syntax errors are reported in the same shape as by the exec server.
+    """
+    code = """import pennylane as qml
+n = 3
+dev = qml.device("default.qubit", wires=2 * n)
+
+def layer(i):
+    qml.RX(0.1, wires=i)
+    qml.CNOT(wires=[i, i + 1])
+
+@qml.qnode(dev)
+def circuit():
+    for i in range(n):
+        layer(i)
+    [qml.Hadamard(w) for w in range(2 * n)]
+    return qml.probs()
+
+circuit()
+"""
+    expected = {"wires": 6, "operations": 12, "subroutine_calls": 4}
+    assert estimate_cost(ast.parse(code)) == expected
+    policy = CodePolicy()
+    assert policy.inspect(code) == ("", expected)
+    assert policy.check("def f():\n    return (\n1)\nreturn 1") == [
+        "SyntaxError: 'return' outside function",
+        " line 4",
+    ]
+
+
+def test_estimate_cost_large_values():
+    """Tests that huge constants and ranges are clamped to MAX_VALUE instead
+    of failing or being computed, and that code that cannot be analyzed is
+    reported as an error.
+    """
+    error, cost = inspect_code("for i in range(2**64):\n    qml.RX(0.1, wires=0)\n")
+    assert error == "" and cost["operations"] == MAX_VALUE
+    code = "x = ((((9**64)**64)**64)**64)\nfor i in range(x):\n    qml.RX(0.1, wires=0)\n"
+    error, cost = inspect_code(code)
+    assert error == "" and cost["operations"] == MAX_VALUE
+    error, cost = inspect_code("for i in range(10, 0, -3):\n    qml.RX(0.1, wires=0)\n")
+    assert cost["operations"] == 4
+    error, cost = inspect_code("x = " + "+".join(["1"] * 100000))
+    assert error[0].startswith("RecursionError") and cost is None
+
+
 def test_get_method_names():
     """Check that get_method_names() is able to retrive function names if
     one or more functions are present in the code. It also returns and
@@ -157,6 +238,45 @@ def test_get_identifier_numbers():
     assert commands[1].identifier == 1
 
 
+def test_checkout_device():
+    """Check that devices are reused by threads for the same name, wires and
+    shots, and that a device is not used by two threads at the same time.
+    """
+    devices = []
+
+    def checkout():
+        with helpers.checkout_device("default.qubit", 2, 0) as dev:
+            devices.append(dev)
+
+    for _ in range(2):
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        thread.join()
+    assert devices[0] is devices[1]
+
+    with helpers.checkout_device("default.qubit", 2, 0) as dev:
+        assert dev is devices[0]
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        thread.join()
+        assert devices[2] is not dev
+    with helpers.checkout_device("default.qubit", 2, 100) as dev:
+        assert dev is not devices[0] and dev.shots.total_shots == 100
+
+
+def test_subroutine_op():
+    """Check that subroutine boxes are labelled with the name of the
+    subroutine and compare equal for the same subroutine and wires.
+    """
+    op = helpers.SubroutineOp(wires=[0, 2], function="layer")
+    assert op.name == "layer"
+    assert op.label() == "layer"
+    assert op.hash == helpers.SubroutineOp(wires=[0, 2], function="layer").hash
+    assert op.hash != helpers.SubroutineOp(wires=[0, 2], function="other").hash
+    assert type(helpers.SubroutineOp(wires=[1], function="other")) is type(op)
+    assert qml.equal(op.decomposition()[0], qml.QubitUnitary(np.eye(4), wires=[0, 2]))
+
+
 def test_get_quantum_lines():
     """Test for a simple user code that the function can distinguish
     the quantum lines and return their line numbers.
@@ -205,3 +325,43 @@ print("#not comment")
 """
     returned = helpers.comment_cleanup(code)
     assert returned == expected
+
+
+def test_source_model():
+    """Test that the source model cleans up the code once and finds the
+    qnode, its transforms, the method names and the lines with quantum code.
+    """
+    code = """import pennylane as qml
+dev = qml.device("default.qubit")
+
+@qml.transforms.merge_rotations  # transform
+@qml.qnode(dev)
+def circuit():
+    qml.RX(
+        0.1, wires=0)
+    return qml.probs()
+"""
+    model = SourceModel(code)
+    assert model.lines[3] == "@qml.transforms.merge_rotations  "
+    assert model.lines[6:9] == ["    qml.RX(        0.1, wires=0)", "", "    return qml.probs()"]
+    assert model.qnode_idx == 4
+    assert model.method_names == {"circuit"}
+    assert model.quantum_lines == {2, 4, 5, 7, 9}
+    assert model.transforms_commented()[3] == "#@qml.transforms.merge_rotations  "
+    assert list(model.transform_details()) == [["@qml.transforms.merge_rotations  ", 4]]
+
+
+def test_encode_binary_fields():
+    """Check that raw images are base 64 encoded, pickled commands are hex
+    encoded and already encoded fields are not changed.
+    """
+    output = {
+        "image": b"\x89PNG",
+        "children": [{"image": b"\x01"}, {"image": "AQ=="}],
+        "commands": b"\x80\x04",
+    }
+    returned = helpers.encode_binary_fields(output)
+    assert returned["image"] == "iVBORw=="
+    assert returned["children"] == [{"image": "AQ=="}, {"image": "AQ=="}]
+    assert returned["commands"] == "8004"
+    assert helpers.encode_binary_fields(returned) == returned
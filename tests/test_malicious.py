@@ -60,3 +60,19 @@ def test_access_web_hack_1(client):
 
 def test_access_web_hack_2(client):
     run_hack_test(client, "test_cases/access_web_hack_2.txt")
+
+
+def test_read_file_hack_4(client):
+    run_hack_test(client, "test_cases/read_file_hack_4.txt")
+
+
+def test_read_file_hack_5(client):
+    run_hack_test(client, "test_cases/read_file_hack_5.txt")
+
+
+def test_read_file_hack_6(client):
+    run_hack_test(client, "test_cases/read_file_hack_6.txt")
+
+
+def test_read_file_hack_7(client):
+    run_hack_test(client, "test_cases/read_file_hack_7.txt")
@@ -17,6 +17,7 @@ This set of tests confirm that backend will safely raise an error
 instead of running user code that can break the code execution server.
 """
 
+import time
 from tests.functions4testing import visCircuit
 
 
@@ -43,3 +44,28 @@ def test_infinite_loop_hack_2(client):
 
 def test_heavy_processing_hack(client):
     run_hack_test(client, "test_cases/heavy_processing_hack.txt")
+
+
+def test_too_many_wires_hack(client):
+    """The main server rejects code that is estimated to need more memory
+    than the code execution server has, without sending it to the server."""
+    with open("test_cases/too_many_wires_hack.txt", "r") as f:
+        error = visCircuit(client, f.read()).get("error", None)
+    assert error[0].startswith("Code is too large to run")
+
+
+def test_huge_range_hack(client):
+    """The cost estimate of a loop over a range that is too long to have a
+    length does not fail."""
+    with open("test_cases/huge_range_hack.txt", "r") as f:
+        error = visCircuit(client, f.read()).get("error", None)
+    assert error[0].startswith("Code is too large to run")
+
+
+def test_huge_power_hack(client):
+    """The cost estimate does not compute huge constants."""
+    start_time = time.time()
+    with open("test_cases/huge_power_hack.txt", "r") as f:
+        error = visCircuit(client, f.read()).get("error", None)
+    assert error[0].startswith("Code is too large to run")
+    assert time.time() - start_time < 5
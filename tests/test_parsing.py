@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-""" This set of tests confirm that code parsing works """
+"""This set of tests confirm that code parsing works"""
 
 from tests.functions4testing import visCircuit
 
@@ -39,3 +39,49 @@ def test_transforms_and_multiline_comment_with_qnode(client):
     """
     with open("test_cases/transforms_and_multiline_comment_with_qnode.txt", "r") as f:
         assert visCircuit(client, f.read()).get("error", None) is None
+
+
+def test_transforms_and_other_decorators(client):
+    """Ensure that the output of each transform is computed in the order of
+    the decorators when transforms are combined with decorators that are not
+    transforms, e.g. a decorator that changes the arguments of the qnode.
+    """
+    with open("test_cases/transforms_and_other_decorators.txt", "r") as f:
+        output = visCircuit(client, f.read())
+    assert output.get("error", None) is None
+    details = [transform[1:4] for transform in output["transform_details"]]
+    assert details == [
+        ["-0.4161468365471423", "@double", 14],
+        ["0.5403023058681398", "@qml.transforms.merge_rotations", 15],
+    ]
+
+
+def test_two_decorators_executed(client):
+    """Ensure that the output of each decorator is computed when several
+    decorators that are not transforms must be evaluated by executing the
+    user code.
+    """
+    with open("test_cases/two_decorators_executed.txt", "r") as f:
+        output = visCircuit(client, f.read())
+    assert output.get("error", None) is None
+    details = [transform[1:4] for transform in output["transform_details"]]
+    assert details == [
+        ["-0.6536436208636122", "@double", 14],
+        ["-0.4161468365471423", "@double", 15],
+    ]
+
+
+def test_transforms_with_multiple_measurements(client):
+    """Ensure that the output of each transform lists the measurements in the
+    order of the return statement of the qnode.
+    """
+    with open("test_cases/transforms_with_multiple_measurements.txt", "r") as f:
+        output = visCircuit(client, f.read())
+    assert output.get("error", None) is None
+    details = [transform[1:4] for transform in output["transform_details"]]
+    assert [transform[1:] for transform in details] == [
+        ["@qml.transforms.cancel_inverses", 11],
+        ["@qml.transforms.merge_rotations", 12],
+    ]
+    for transform in details:
+        assert transform[0].startswith("(0.825") and transform[0].endswith(",0.0)")
@@ -0,0 +1,171 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module is a set of tests for the execution server work queue located at
+execserver/scheduler.py and the code cache located at execserver/code_cache.py
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+import pytest
+
+from execserver.scheduler import PriorityScheduler, QueueFull, QueueTimeout
+from execserver.code_cache import CodeCache
+from execserver.app import run_code
+
+TEST_CASES = os.path.join(os.path.dirname(__file__), "test_cases")
+
+
+def test_priority_order():
+    """Check that a waiting debugger request is admitted before a
+    real-time request that arrived earlier.
+    """
+    scheduler = PriorityScheduler(1, {"debugger": 4, "realtime": 4, "batch": 4}, 5)
+    order = []
+
+    def run(priority):
+        with scheduler.slot(priority):
+            order.append(priority)
+
+    scheduler.acquire("batch")
+    threads = [threading.Thread(target=run, args=(p,)) for p in ("realtime", "debugger")]
+    for t in threads:
+        t.start()
+        time.sleep(0.1)
+    scheduler.release(0)
+    for t in threads:
+        t.join()
+    assert order == ["debugger", "realtime"]
+
+
+def test_queue_full():
+    """Check that a request is rejected right away when its class has no
+    space left in the queue, and that the Retry-After estimate is positive.
+    """
+    scheduler = PriorityScheduler(1, {"debugger": 1, "realtime": 0, "batch": 0}, 5)
+    with pytest.raises(QueueFull) as e:
+        scheduler.acquire("realtime")
+    assert e.value.retry_after >= 1
+
+
+def test_queue_timeout():
+    """Check that a request that cannot get a slot in time is rejected and
+    does not keep its place in the queue.
+    """
+    scheduler = PriorityScheduler(1, {"debugger": 1, "realtime": 1, "batch": 1}, 0.1)
+    scheduler.acquire("debugger")
+    with pytest.raises(QueueTimeout):
+        scheduler.acquire("batch")
+    scheduler.release(0)
+    assert scheduler.acquire("batch") < 0.1
+
+
+def test_release_two_slots():
+    """Check that both waiting requests are admitted when two slots are
+    freed together, even if the request behind the head of the queue
+    wakes up first.
+    """
+    scheduler = PriorityScheduler(2, {"debugger": 1, "realtime": 1, "batch": 1}, 2)
+    scheduler.acquire("realtime")
+    scheduler.acquire("realtime")
+    admitted = []
+
+    def run(priority):
+        try:
+            scheduler.acquire(priority)
+            admitted.append(priority)
+        except QueueTimeout:
+            pass
+
+    # the batch request waits first but is behind the debugger request
+    threads = [threading.Thread(target=run, args=(p,)) for p in ("batch", "debugger")]
+    for t in threads:
+        t.start()
+        time.sleep(0.1)
+    start_time = time.time()
+    with scheduler._condition:
+        scheduler.release(0)
+        scheduler.release(0)
+    for t in threads:
+        t.join()
+    assert sorted(admitted) == ["batch", "debugger"]
+    assert time.time() - start_time < 1
+
+
+def test_transform_stage_slots():
+    """Check that transform stages evaluated by execution run in parallel
+    only in free slots of the scheduler, give the slots back and leave no
+    processes behind.
+    """
+    with open(os.path.join(TEST_CASES, "two_decorators_executed.txt"), "r") as f:
+        code = f.read()
+    for max_concurrency, expected_running in ((2, [2]), (1, [1])):
+        scheduler = PriorityScheduler(
+            max_concurrency, {"debugger": 1, "realtime": 1, "batch": 1}, 5
+        )
+        scheduler.acquire("debugger")
+        running = []
+        try_acquire = scheduler.try_acquire
+
+        def count_slots():
+            taken = try_acquire()
+            running.append(scheduler.stats()["running"])
+            return taken
+
+        scheduler.try_acquire = count_slots
+        status, result = run_code(code, scheduler)
+        assert status == 200
+        assert [t[1] for t in result["transform_details"]] == [
+            "-0.6536436208636122",
+            "-0.4161468365471423",
+        ]
+        assert running[:1] == expected_running
+        assert scheduler.stats()["running"] == 1
+        assert multiprocessing.active_children() == []
+
+
+def test_transform_stage_time_limit(monkeypatch):
+    """Check that the transform stages evaluated by execution share the time
+    limit of the request, so that slow user code with many decorators runs
+    out of time instead of holding its slot for each stage.
+    """
+    monkeypatch.setattr("execserver.app.CODE_TIME_LIMIT", 3)
+    with open(os.path.join(TEST_CASES, "two_decorators_executed.txt"), "r") as f:
+        code = f.read()
+    code = "import time\ntime.sleep(1)\n" + code.replace("@double\n", "@double\n" * 3)
+    start_time = time.time()
+    status, result = run_code(code)
+    assert (status, result) == (418, None)
+    assert time.time() - start_time < 5
+    assert multiprocessing.active_children() == []
+
+
+def test_code_cache():
+    """Check that code is compiled once, that the least recently used code
+    is evicted, and that errors point to the line of the user code.
+    """
+    cache = CodeCache(max_size=2)
+    first = cache.compile("x = 1")
+    assert cache.compile("x = 1") is first
+    cache.compile("x = 2")
+    cache.compile("x = 3")
+    assert cache.compile("x = 1") is not first
+    assert (cache.num_hits, cache.num_misses) == (1, 4)
+    with pytest.raises(ZeroDivisionError) as e:
+        exec(cache.compile("x = 1\ny = x / 0"), {})
+    assert e.traceback[-1].frame.code.raw.co_filename == "<string>"
+    assert e.traceback[-1].lineno == 1  # line 2, pytest counts from 0
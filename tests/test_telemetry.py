@@ -0,0 +1,164 @@
+# Copyright 2025 UBC Quantum Software and Algorithms Research Lab
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module is a set of tests for the session telemetry writer located at
+server/telemetry.py, the storage located at server/storage.py and the
+database indexes located at server/indexes.py
+"""
+
+import time
+from server.telemetry import TelemetryWriter, TelemetryPolicy
+from server.storage import MongoStorage, SQLiteStorage
+from server.indexes import ensure_indexes
+
+
+class FakeDatabase:
+    """Database that records bulk writes instead of sending them to MongoDB"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __getitem__(self, collection):
+        return self
+
+    def bulk_write(self, operations, ordered):
+        self.batches.append(operations)
+
+    def create_index(self, keys, **options):
+        self.batches.append((keys, options))
+
+
+def test_writes_are_batched_and_drained():
+    """Check that queued writes are flushed in batches in the order they
+    were queued, with one bulk write per collection, and that close()
+    flushes the remaining writes.
+    """
+    db = FakeDatabase()
+    writer = TelemetryWriter(MongoStorage(db), batch_size=3, flush_interval=60)
+    writer.insert_session({"session_id": "s"})
+    for i in range(3):
+        writer.push_action("s", {"api_call": str(i)})
+    writer.close()
+    assert [len(b) for b in db.batches] == [1, 2, 1]
+    assert writer.stats()["written"] == 4
+
+
+def test_overflow_is_dropped():
+    """Check that writes are dropped and counted when the queue is full."""
+    writer = TelemetryWriter(MongoStorage(FakeDatabase()), max_queue_size=1, flush_interval=60)
+    writer.close()
+    for i in range(3):
+        writer.push_action("s", {"api_call": str(i)})
+    assert writer.stats()["dropped"] == 2
+
+
+def test_ensure_indexes():
+    """Check that the database indexes are created, including the unique
+    token index used for authentication.
+    """
+    db = FakeDatabase()
+    assert ensure_indexes(db)
+    assert ([("token", 1)], {"unique": True, "sparse": True}) in db.batches
+
+
+def test_policy():
+    """Check that actions are sampled, hashed fields are stored once in the
+    content store and large fields are cut.
+    """
+    db = FakeDatabase()
+    policy = TelemetryPolicy(
+        sample_rates={"/debugNext": 0.0},
+        hashed_fields={"/visualizeCircuit": ["code"]},
+        dropped_fields={"/expandMethod": ["output"]},
+        max_field_size=10,
+    )
+    writer = TelemetryWriter(MongoStorage(db), flush_interval=60, policy=policy)
+    writer.push_action("s", {"api_call": "/debugNext", "breakpoints": [1]})
+    for i in range(2):
+        writer.push_action("s", {"api_call": "/visualizeCircuit", "code": "x = 1\n" * 10})
+    writer.push_action("s", {"api_call": "/expandMethod", "output": {}, "name": "a" * 20})
+    writer.close()
+    operations = [o for b in db.batches for o in b]
+    assert writer.stats()["sampled_out"] == 1
+    assert [o._filter.get("_id", None) is not None for o in operations] == [
+        True,
+        False,
+        False,
+        False,
+    ]
+    actions = [o._doc["$push"]["actions"] for o in operations[1:]]
+    assert actions[0] == actions[1]
+    assert actions[0]["code_hash"] == operations[0]._filter["_id"]
+    assert actions[2] == {"api_call": "/expandMethod", "name": "a" * 10, "name_size": 20}
+
+
+def test_failed_content_is_written_again():
+    """Check that content whose write failed is written again with the next
+    action that has it, so that its hash can be resolved.
+    """
+
+    class FailingDatabase(FakeDatabase):
+        def bulk_write(self, operations, ordered):
+            if len(self.batches) == 0:
+                self.batches.append([])
+                raise Exception("write failed")
+            super().bulk_write(operations, ordered)
+
+    db = FailingDatabase()
+    policy = TelemetryPolicy(hashed_fields={"/visualizeCircuit": ["code"]})
+    writer = TelemetryWriter(MongoStorage(db), batch_size=2, flush_interval=60, policy=policy)
+    writer.push_action("s", {"api_call": "/visualizeCircuit", "code": "x = 1"})
+    while writer.stats()["failed"] + writer.stats()["written"] < 2:
+        time.sleep(0.01)
+    writer.push_action("s", {"api_call": "/visualizeCircuit", "code": "x = 1"})
+    writer.push_action("s", {"api_call": "/visualizeCircuit", "code": "x = 1"})
+    writer.close()
+    # the first content write failed, the content is written once after it
+    operations = [o for b in db.batches for o in b]
+    assert [o._filter.get("_id", None) is not None for o in operations] == [
+        False,
+        True,
+        False,
+        False,
+    ]
+    assert writer.stats()["failed"] == 1
+
+
+def test_sqlite_storage():
+    """Check that users, bug reports and telemetry are stored in SQLite."""
+    storage = SQLiteStorage(":memory:")
+    assert storage.find_user_by_token("a") is None
+    storage.insert_user({"email_address": "a@a.com", "token": "a", "activated": 1, "expires": 2})
+    storage.rotate_token(
+        "a@a.com",
+        "b",
+        3,
+        4,
+        past_token={"token": "a", "activated": 1, "expires": 2, "deactivated": 2},
+    )
+    storage.add_user_session("b", "s")
+    storage.insert_bug_report(
+        {"token": "b", "session_id": "s", "timestamp": 5, "email": "a@a.com", "description": "d"}
+    )
+    assert storage.find_user_by_token("a") is None
+    assert storage.find_user_by_token("b") == {"email_address": "a@a.com", "expires": 4}
+    assert storage.find_user_by_email("a@a.com")["activated"] == 3
+
+    writer = TelemetryWriter(storage, flush_interval=60)
+    writer.insert_session({"session_id": "s"})
+    writer.push_action("s", {"api_call": "/dc/sessionEnter", "timestamp": 5})
+    writer.close()
+    assert writer.stats()["written"] == 2
+    assert storage._query_one("SELECT COUNT(*) AS n FROM session_actions", ())["n"] == 1